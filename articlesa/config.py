@@ -7,6 +7,7 @@ from urllib.parse import urlparse
 class RedisConfig:
     """ Configuration for the redis database. """
     url: str = os.getenv("REDIS_URL", "redis://localhost:6379")
+    max_connections: int = int(os.getenv("REDIS_MAX_CONNECTIONS", "50"))
 
     @property
     def host(self) -> str:
@@ -17,6 +18,108 @@ class RedisConfig:
         return urlparse(self.url).port
 
 
+class Neo4JConfig:
+    """ Configuration for the neo4j database. """
+    uri: str = os.getenv("NEO4J_URI", "bolt://localhost:7687")
+    max_connection_pool_size: int = int(os.getenv("NEO4J_MAX_CONNECTION_POOL_SIZE", "50"))
+    # write-behind buffer flushes once this many articles are pending...
+    write_batch_size: int = int(os.getenv("NEO4J_WRITE_BATCH_SIZE", "100"))
+    # ...or once this many seconds have passed
+    write_flush_interval: float = float(os.getenv("NEO4J_WRITE_FLUSH_INTERVAL", "0.5"))
+    # run migrations at server startup instead of only warning about missing schema
+    migrate_on_startup: bool = os.getenv("NEO4J_MIGRATE_ON_STARTUP", "false").lower() == "true"
+
+
+class CacheConfig:
+    """ Configuration for caching articles, in neo4j and in server memory. """
+    # seconds before a stored article is stale; stale articles are still served
+    # while a background job re-parses them
+    max_age: int = int(os.getenv("ARTICLE_MAX_AGE", str(7 * 24 * 60 * 60)))
+    # per-publisher max ages, formatted like "apnews.com=3600,example.com=86400"
+    max_age_overrides: str = os.getenv("ARTICLE_MAX_AGE_OVERRIDES", "")
+    # bounds of the in-memory cache of rendered nodes kept by each server process
+    node_cache_items: int = int(os.getenv("NODE_CACHE_ITEMS", "10000"))
+    node_cache_bytes: int = int(os.getenv("NODE_CACHE_BYTES", str(64 * 1024 * 1024)))
+    node_cache_ttl: float = float(os.getenv("NODE_CACHE_TTL", "600"))
+
+
+class WorkerConfig:
+    """ Configuration for the arq workers. """
+    # seconds to keep job results; callers of a url attach to its result until then
+    keep_result: int = int(os.getenv("WORKER_KEEP_RESULT", "60"))
+    # number of headless browsers per worker, i.e. pages loading at once
+    browser_sessions: int = int(os.getenv("WORKER_BROWSER_SESSIONS", "2"))
+    # browsers are restarted after this many pages to cap their memory use
+    browser_max_pages: int = int(os.getenv("WORKER_BROWSER_MAX_PAGES", "100"))
+    # seconds a browser has to answer a health check, or to load a page
+    browser_health_timeout: float = float(os.getenv("WORKER_BROWSER_HEALTH_TIMEOUT", "5"))
+    page_timeout: float = float(os.getenv("WORKER_PAGE_TIMEOUT", "30"))
+    # seconds a learned "domain needs a browser" hint lasts before plain GETs are retried
+    render_hint_ttl: int = int(os.getenv("WORKER_RENDER_HINT_TTL", str(7 * 24 * 60 * 60)))
+    # seconds to cache resolved redirects, and urls that could not be resolved
+    redirect_ttl: int = int(os.getenv("WORKER_REDIRECT_TTL", str(7 * 24 * 60 * 60)))
+    redirect_negative_ttl: int = int(os.getenv("WORKER_REDIRECT_NEGATIVE_TTL", str(60 * 60)))
+    # outbound connections per worker, and requests per host at once
+    connections: int = int(os.getenv("WORKER_CONNECTIONS", "100"))
+    host_concurrency: int = int(os.getenv("WORKER_HOST_CONCURRENCY", "4"))
+    # seconds between request starts to one host, and longest backoff after a 429/503
+    host_min_interval: float = float(os.getenv("WORKER_HOST_MIN_INTERVAL", "0.1"))
+    host_max_backoff: float = float(os.getenv("WORKER_HOST_MAX_BACKOFF", "60"))
+    host_max_retries: int = int(os.getenv("WORKER_HOST_MAX_RETRIES", "2"))
+    # processes parsing html off the event loop, 0 parses on the event loop
+    parse_processes: int = int(os.getenv("WORKER_PARSE_PROCESSES", str(os.cpu_count() or 1)))
+    # directory fetched html is kept in for re-parsing, empty to not keep html, and its size limit
+    html_store_dir: str = os.getenv("WORKER_HTML_STORE_DIR", "html_store")
+    html_store_bytes: int = int(os.getenv("WORKER_HTML_STORE_BYTES", str(5 * 1024 ** 3)))
+    # port each worker process serves prometheus metrics on, 0 to not serve them
+    metrics_port: int = int(os.getenv("WORKER_METRICS_PORT", "9100"))
+
+
 class ServeConfig:
     """ Configuration for serving the app. """
     port = 7654
+    # deepest tree a stream may be requested for
+    max_depth: int = int(os.getenv("STREAM_MAX_DEPTH", "5"))
+    # most articles a single stream processes, further links are skipped
+    max_nodes: int = int(os.getenv("STREAM_MAX_NODES", "500"))
+    # most children processed per article at each depth, formatted like "50,20,10";
+    # the last value applies to deeper articles too, empty for no limits
+    max_fanout: str = os.getenv("STREAM_MAX_FANOUT", "50,20,10")
+    # seconds interactive depth 1 parse jobs are moved ahead in the queue, depth 0 twice as
+    # far; background jobs wait at most about twice this long behind interactive ones
+    priority_boost: float = float(os.getenv("QUEUE_PRIORITY_BOOST", "300"))
+    # seconds a stream keeps running without clients, waiting for one to reconnect
+    stream_grace: float = float(os.getenv("STREAM_GRACE_PERIOD", "30"))
+    # seconds the events of a finished stream are kept for replaying, and most events kept
+    stream_retention: float = float(os.getenv("STREAM_RETENTION", "60"))
+    stream_log_events: int = int(os.getenv("STREAM_LOG_EVENTS", "10000"))
+    # streams requested with batch=true send node events produced within this many
+    # seconds of each other as one node_batch event, of at most this many events
+    batch_window: float = float(os.getenv("STREAM_BATCH_WINDOW", "0.05"))
+    batch_max_events: int = int(os.getenv("STREAM_BATCH_MAX_EVENTS", "100"))
+
+
+class TraceConfig:
+    """ Configuration for tracing streams, see articlesa.trace. """
+    # json lines file finished spans are appended to, empty to not trace
+    file: str = os.getenv("TRACE_FILE", "")
+
+
+class MockConfig:
+    """ Configuration for the synthetic web served by articlesa.test.articlemock. """
+    words_file: str = os.getenv("MOCK_WORDS_FILE", "/usr/share/dict/words")
+    # seed mixed into every article, change it to get a different web
+    seed: str = os.getenv("MOCK_SEED", "")
+    # least and most links per article
+    min_links: int = int(os.getenv("MOCK_MIN_LINKS", "1"))
+    max_links: int = int(os.getenv("MOCK_MAX_LINKS", "5"))
+    # seconds each response is delayed by, plus up to jitter more
+    latency: float = float(os.getenv("MOCK_LATENCY", "0"))
+    latency_jitter: float = float(os.getenv("MOCK_LATENCY_JITTER", "0"))
+    # fraction of articles that answer 500
+    error_rate: float = float(os.getenv("MOCK_ERROR_RATE", "0"))
+    # fraction of links that go through a redirect
+    redirect_ratio: float = float(os.getenv("MOCK_REDIRECT_RATIO", "0"))
+    # fraction of links to a small pool of articles shared by the whole web
+    duplicate_ratio: float = float(os.getenv("MOCK_DUPLICATE_RATIO", "0"))
+    duplicate_pool: int = int(os.getenv("MOCK_DUPLICATE_POOL", "20"))
@@ -18,10 +18,10 @@ from articlesa.logger import logger
 
 
 async def submit_url(session: ClientSession, url: str) -> None:
-    """Submit a URL via serve API."""
+    """Submit a URL via serve API, queued behind interactive requests."""
     logger.info(f"trying to GET {url}")
     async with session.get(
-        f"http://localhost:{ServeConfig.port}/a/{url}"
+        f"http://localhost:{ServeConfig.port}/a/{url}", params={"background": "true"}
     ) as resp:
         await resp.text()
         logger.info(f"GET {url} returned {resp.status}")
@@ -0,0 +1,69 @@
+"""
+articlesa.metrics defines the prometheus metrics of the gateway and workers.
+
+Every stage an article goes through is timed in stage_seconds, labelled by
+stage, so a slow tree can be traced to the queue, HEAD requests, the browser,
+parsing, neo4j or sending events. The gateway serves its metrics at /metrics,
+and each worker process serves its own on WorkerConfig.metrics_port.
+"""
+
+from prometheus_client import Counter, Gauge, Histogram
+
+
+# seconds spent in each stage of processing an article:
+# queue_wait, head, fetch, browser_download, parse (worker)
+# neo4j_read, neo4j_write, sse_emit (gateway)
+stage_seconds = Histogram(
+    "articlesa_stage_seconds",
+    "Seconds spent in each stage of processing an article.",
+    ["stage"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300),
+)
+
+# lookups of the gateway node cache and the worker redirect cache, by result
+cache_lookups = Counter(
+    "articlesa_cache_lookups",
+    "Cache lookups, by cache and whether they hit.",
+    ["cache", "result"],
+)
+
+sse_events = Counter(
+    "articlesa_sse_events",
+    "Server-sent events sent to clients, by event type.",
+    ["event"],
+)
+
+streams_active = Gauge(
+    "articlesa_streams_active",
+    "Article streams being produced.",
+)
+stream_tasks = Gauge(
+    "articlesa_stream_tasks",
+    "Retrievals and link watchers in flight, summed over every stream.",
+)
+stream_peak_tasks = Histogram(
+    "articlesa_stream_peak_tasks",
+    "Most retrievals and link watchers in flight at once in a stream.",
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500),
+)
+streams_resumed = Counter(
+    "articlesa_streams_resumed",
+    "Streams resumed from a Last-Event-ID header.",
+)
+
+# work given up on because every stream waiting on it disconnected: "streams",
+# retrieval "tasks" cancelled and arq "jobs" aborted
+abandoned = Counter(
+    "articlesa_abandoned",
+    "Work given up on because no stream was waiting on it anymore.",
+    ["kind"],
+)
+
+articles_written = Counter(
+    "articlesa_articles_written",
+    "Articles written into neo4j by the write buffer.",
+)
+write_errors = Counter(
+    "articlesa_write_errors",
+    "Batches of articles that failed to be written into neo4j.",
+)
@@ -1,16 +1,38 @@
 """
 articlesa.neo provides tooling for interacting with the neo4j database.
 
-This module provides a single async context manager, Neo4JDriver, which
-should be entered to perform any database operations.
+This module provides a single async context manager, Neo4JArticleDriver, which
+should be entered to perform any database operations. Long-lived processes
+like the server may instead open() it once and close() it at shutdown.
 """
 
-import os
+from typing import Optional, Sequence
 
-from neo4j import AsyncGraphDatabase, AsyncDriver
+from neo4j import AsyncGraphDatabase, AsyncDriver, EagerResult
 from neo4j.time import DateTime, Date, Time
 
-from articlesa.types import ParsedArticle
+from articlesa.config import Neo4JConfig
+from articlesa.metrics import stage_seconds
+from articlesa.trace import span
+from articlesa.types import ParsedArticle, url_to_hash
+
+
+# constraints and indexes every query relies on, by name; see migrate()
+SCHEMA = {
+    "article_url": "CREATE CONSTRAINT article_url IF NOT EXISTS FOR (article:Article) REQUIRE article.url IS UNIQUE",
+    "author_name": "CREATE CONSTRAINT author_name IF NOT EXISTS FOR (author:Author) REQUIRE author.name IS UNIQUE",
+    "publisher_netloc": "CREATE CONSTRAINT publisher_netloc IF NOT EXISTS FOR (publisher:Publisher) REQUIRE publisher.netloc IS UNIQUE",
+    "article_urlhash": "CREATE INDEX article_urlhash IF NOT EXISTS FOR (article:Article) ON (article.urlhash)",
+}
+
+
+# articles written before urlhash existed, which migrate() backfills
+MISSING_URLHASH_QUERY = """\
+MATCH (article:Article)
+WHERE article.urlhash IS NULL
+RETURN article.url AS url
+LIMIT $limit
+"""
 
 
 class ArticleNotFound(Exception):
@@ -25,17 +47,74 @@ class Neo4JArticleDriver():
     All reads and writes to the database happen within this context manager.
     """
     _driver: AsyncDriver
-    uri: str = os.environ.get("NEO4J_URI", "bolt://localhost:7687")
+    uri: str = Neo4JConfig.uri
+
+    def __init__(self, max_connection_pool_size: int = Neo4JConfig.max_connection_pool_size) -> None:
+        """Initialize driver settings; no connections are made until opened."""
+        self.max_connection_pool_size = max_connection_pool_size
+        # articles written before urlhash existed may lack it, until migrate()
+        # or check_backfill() finds none do
+        self.backfill_pending = True
+
+    async def open(self) -> 'Neo4JArticleDriver':
+        """Create the underlying connection pool and return the driver."""
+        self._driver = AsyncGraphDatabase.driver(
+            self.uri, max_connection_pool_size=self.max_connection_pool_size
+        )
+        return self
+
+    async def close(self) -> None:
+        """Close every pooled connection."""
+        await self._driver.close()
 
     async def __aenter__(self) -> 'Neo4JArticleDriver':
         """Enter the async context manager and return the driver."""
-        self._driver = await AsyncGraphDatabase.driver(self.uri).__aenter__()
-        return self
+        return await self.open()
 
     async def __aexit__(self, exc_type, exc_value, traceback) -> None:  # noqa
         """Exit the async context manager."""
-        # TODO: figure out why we see unclosed connection warnings  # noqa
-        await self._driver.__aexit__(exc_type, exc_value, traceback)
+        await self.close()
+
+    async def migrate(self, batch_size: int = 1000) -> int:
+        """
+        Create any missing constraints and indexes, then backfill urlhash.
+
+        Safe to run repeatedly. Returns the number of articles backfilled.
+        """
+        for statement in SCHEMA.values():
+            await self._driver.execute_query(statement)
+        # cypher has no md5, so hashes for articles written before urlhash
+        # existed are computed here
+        set_query = """\
+        UNWIND $rows AS row
+        MATCH (article:Article {url: row.url})
+        SET article.urlhash = row.urlhash
+        """
+        backfilled = 0
+        while True:
+            response = await self._driver.execute_query(MISSING_URLHASH_QUERY, limit=batch_size)
+            if not response.records:
+                self.backfill_pending = False
+                return backfilled
+            rows = [
+                {"url": record["url"], "urlhash": url_to_hash(record["url"])}
+                for record in response.records
+            ]
+            await self._driver.execute_query(set_query, rows=rows)
+            backfilled += len(rows)
+
+    async def check_backfill(self) -> bool:
+        """Check if any article lacks urlhash, so reads must also match articles by url."""
+        response = await self._driver.execute_query(MISSING_URLHASH_QUERY, limit=1)
+        self.backfill_pending = bool(response.records)
+        return self.backfill_pending
+
+    async def check_schema(self) -> list[str]:
+        """Return the names of SCHEMA entries missing from the database."""
+        constraints = await self._driver.execute_query("SHOW CONSTRAINTS YIELD name")
+        indexes = await self._driver.execute_query("SHOW INDEXES YIELD name")
+        existing = {record["name"] for record in constraints.records + indexes.records}
+        return [name for name in SCHEMA if name not in existing]
 
     async def get_stats(self) -> dict:
         """Get quick stats describing the database."""
@@ -53,7 +132,7 @@ class Neo4JArticleDriver():
 
     async def put_article(self,
                           parsed_article: ParsedArticle,
-                          parent_url: str,
+                          parent_url: Optional[str] = None,
                           ) -> None:
         """
         Put a parsed article into the database.
@@ -61,60 +140,137 @@ class Neo4JArticleDriver():
         Includes putting author and publisher nodes.
         If a parent_url is passed, a relationship is created between the parent and the child.
         """
+        await self.put_articles([(parsed_article, parent_url)])
+
+    async def put_articles(self,
+                           batch: Sequence[tuple[ParsedArticle, Optional[str]]],
+                           ) -> None:
+        """
+        Put many parsed articles into the database in a single transaction.
+
+        Each item pairs an article with an optional parent_url, as in put_article.
+        Articles are also linked to any stored articles they link to, since
+        children may be written before the parent that was streamed with them.
+        """
         query = """\
-        MERGE (article:Article {url: $url})
-        SET article.title = $title,
-            article.links = $links,
-            article.published = $published,
-            article.parsedAtUtc = $parsedAtUtc
-        WITH article
-        UNWIND $authors AS author_name
-        MERGE (author:Author {name: author_name})
-        MERGE (article)-[:AUTHORED_BY]->(author)
-        MERGE (publisher:Publisher {netloc: $publisherNetLoc})
+        UNWIND $rows AS row
+        MERGE (article:Article {url: row.url})
+        SET article.urlhash = row.urlhash,
+            article.title = row.title,
+            article.links = row.links,
+            article.published = row.published,
+            article.parsedAtUtc = row.parsedAtUtc
+        MERGE (publisher:Publisher {netloc: row.publisherNetLoc})
         MERGE (article)-[:PUBLISHED_BY]->(publisher)
-        WITH article, $parent_url AS parent_url
-        MATCH (parent:Article {url: parent_url})
-        MERGE (parent)-[:LINKS_TO]->(article)
-        """
-        _response = await self._driver.execute_query(
-            query,
-            url=parsed_article.url,
-            title=parsed_article.title,
-            links=parsed_article.links,
-            published=parsed_article.published,
-            parsedAtUtc=parsed_article.parsedAtUtc,
-            authors=parsed_article.authors,
-            publisherNetLoc=parsed_article.publisherNetLoc,
-            parent_url=parent_url,
+        FOREACH (author_name IN row.authors |
+            MERGE (author:Author {name: author_name})
+            MERGE (article)-[:AUTHORED_BY]->(author)
+        )
+        WITH article, row
+        OPTIONAL MATCH (parent:Article {url: row.parent_url})
+        FOREACH (_ IN CASE WHEN parent IS NULL THEN [] ELSE [1] END |
+            MERGE (parent)-[:LINKS_TO]->(article)
         )
+        WITH article, row
+        CALL {
+            WITH article, row
+            UNWIND row.links AS link
+            MATCH (child:Article {url: link})
+            MERGE (article)-[:LINKS_TO]->(child)
+        }
+        """
+        rows = [
+            {
+                "url": parsed_article.url,
+                "urlhash": url_to_hash(parsed_article.url),
+                "title": parsed_article.title,
+                "links": parsed_article.links,
+                "published": parsed_article.published,
+                "parsedAtUtc": parsed_article.parsedAtUtc,
+                "authors": parsed_article.authors,
+                "publisherNetLoc": parsed_article.publisherNetLoc,
+                "parent_url": parent_url,
+            }
+            for parsed_article, parent_url in batch
+        ]
+        if rows:
+            with stage_seconds.labels("neo4j_write").time(), span("neo4j_write", articles=len(rows)):
+                await self._driver.execute_query(query, rows=rows)
+
+    @staticmethod
+    def _to_parsed_article(article: dict, authors: list[dict]) -> ParsedArticle:
+        """Build a ParsedArticle from an article node and its author nodes."""
+        article["authors"] = [author["name"] for author in authors]
+
+        # need to call to_native on DateTime/Date/Time objects
+        for key, value in article.items():
+            if isinstance(value, (DateTime, Date, Time)):
+                article[key] = value.to_native()
+
+        # explicitly set published as undefined if missing
+        if not article.get("published"):
+            article["published"] = None
+
+        return ParsedArticle(**article, text=None)
+
+    async def _read_by_url(self,
+                           query: str,
+                           fallback_query: str,
+                           url: str,
+                           parameters: Optional[dict] = None,
+                           ) -> EagerResult:
+        """
+        Execute a read query that matches an article by $urlhash.
+
+        Articles written before urlhash existed have none until migrate() is
+        run, so while that backfill is pending and nothing matches,
+        fallback_query, which matches the article by $url instead, is
+        executed. parameters are any other query parameters.
+        """
+        with stage_seconds.labels("neo4j_read").time(), span("neo4j_read"):
+            response = await self._driver.execute_query(query, {**(parameters or {}), "urlhash": url_to_hash(url)})
+            if not response.records and self.backfill_pending:
+                response = await self._driver.execute_query(fallback_query, {**(parameters or {}), "url": url})
+        return response
 
     async def get_article(self, url: str) -> ParsedArticle:
-        """Get an article by url. Raises KeyError if not found."""
-        query = """\
-        MATCH (article:Article {url: $url})
+        """Get an article by url. Raises ArticleNotFound if not found."""
+        returned = """\
         OPTIONAL MATCH (article)-[:AUTHORED_BY]->(author:Author)
         WITH article, COLLECT(author) AS authors
         RETURN article, authors
         """
-        response = await self._driver.execute_query(query, url=url)
+        query = "MATCH (article:Article {urlhash: $urlhash})\n" + returned
+        fallback_query = "MATCH (article:Article {url: $url})\n" + returned
+        response = await self._read_by_url(query, fallback_query, url)
         if response.records:
             data = response.records[0].data()
-            authors = data.get("authors", [])
-            data["article"]["authors"] = [author["name"] for author in authors]
-
-            # need to call to_native on DateTime/Date/Time objects
-            for key, value in data["article"].items():
-                if isinstance(value, (DateTime, Date, Time)):
-                    data["article"][key] = value.to_native()
-
-            # explicitly set published as undefined if missing
-            if not data["article"].get("published"):
-                data["article"]["published"] = None
-
-            return ParsedArticle(
-                **data.get("article", {}),
-                text=None,
-            )
+            return self._to_parsed_article(data["article"], data.get("authors", []))
         else:
             raise ArticleNotFound(url)
+
+    async def get_subtree(self, url: str, max_depth: int, max_nodes: int) -> dict[str, ParsedArticle]:
+        """
+        Get an article and the stored articles it links to, up to max_depth links away.
+
+        Returns a dict of at most max_nodes articles keyed by url, which is
+        empty if the root article is not found.
+        """
+        # path lengths can't be parameters, so max_depth is formatted into the query
+        path = "-[:LINKS_TO*0..%d]->(article:Article)\n" % int(max_depth)
+        returned = """\
+        WITH DISTINCT article
+        LIMIT $max_nodes
+        OPTIONAL MATCH (article)-[:AUTHORED_BY]->(author:Author)
+        WITH article, COLLECT(author) AS authors
+        RETURN article, authors
+        """
+        query = "MATCH (root:Article {urlhash: $urlhash})" + path + returned
+        fallback_query = "MATCH (root:Article {url: $url})" + path + returned
+        response = await self._read_by_url(query, fallback_query, url, {"max_nodes": max_nodes})
+        subtree = {}
+        for record in response.records:
+            data = record.data()
+            article = self._to_parsed_article(data["article"], data.get("authors", []))
+            subtree[article.url] = article
+        return subtree
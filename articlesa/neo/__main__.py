@@ -18,6 +18,8 @@ subparser = parser.add_subparsers(dest="command", required=True)
 
 parser_stats = subparser.add_parser("stats", help="get stats about the database.")
 
+parser_migrate = subparser.add_parser("migrate", help="create constraints and indexes, backfill urlhash.")
+
 parser_put = subparser.add_parser("put", help="put and get an article from the database.")
 parser_put.add_argument("--url", type=str, help="url of the article to put into the database.")
 
@@ -29,6 +31,9 @@ async def main() -> None:  # noqa: D103
         if args.command == "stats":
             stats = await driver.get_stats()
             pprint(stats)  # noqa: T203
+        elif args.command == "migrate":
+            backfilled = await driver.migrate()
+            print(f"schema up to date, backfilled urlhash for {backfilled} articles")  # noqa: T201
         elif args.command == "put":
             url = article_urls[0]
             if args.url:
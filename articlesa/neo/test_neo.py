@@ -0,0 +1,62 @@
+""" Test reading articles by url from neo4j. """
+from datetime import datetime
+from types import SimpleNamespace
+from typing import Optional
+
+import pytest
+
+from articlesa.neo import ArticleNotFound, Neo4JArticleDriver
+
+
+class FakeDriver:
+    """Stands in for the neo4j driver, finding articles by url only, as if none had a urlhash."""
+    def __init__(self, articles: list[dict]) -> None:
+        """Initialize with the article nodes stored."""
+        self.articles = articles
+        self.queries: list[str] = []
+
+    async def execute_query(self, query: str, parameters: Optional[dict] = None) -> SimpleNamespace:
+        """Record the query, returning the articles it matches by url."""
+        self.queries.append(query)
+        records = []
+        if "{url: $url}" in query and parameters is not None:
+            records = [
+                SimpleNamespace(data=lambda article=article: {"article": dict(article), "authors": []})
+                for article in self.articles if article["url"] == parameters["url"]
+            ]
+        return SimpleNamespace(records=records)
+
+
+def make_driver(articles: list[dict], backfill_pending: bool) -> tuple[Neo4JArticleDriver, FakeDriver]:
+    """Return an article driver on a fake neo4j driver."""
+    driver = Neo4JArticleDriver()
+    driver._driver = fake = FakeDriver(articles)  # type: ignore[assignment]
+    driver.backfill_pending = backfill_pending
+    return driver, fake
+
+
+URL = "https://example.com/a"
+ARTICLE: dict = {
+    "url": URL, "title": "title", "links": [],
+    "published": None, "parsedAtUtc": datetime(2024, 1, 1),
+}
+
+
+@pytest.mark.asyncio
+async def test_read_falls_back_to_url_while_backfill_is_pending() -> None:
+    """Test an article without urlhash is found by url while the backfill is pending."""
+    driver, fake = make_driver([ARTICLE], backfill_pending=True)
+    article = await driver.get_article(URL)
+    assert article.url == URL
+    assert ["{urlhash: $urlhash}" in query for query in fake.queries] == [True, False]
+
+
+@pytest.mark.asyncio
+async def test_read_queries_once_after_backfill() -> None:
+    """Test a missing article costs one query once every article has a urlhash."""
+    driver, fake = make_driver([], backfill_pending=False)
+    with pytest.raises(ArticleNotFound):
+        await driver.get_article(URL)
+    assert await driver.get_subtree(URL, max_depth=2, max_nodes=10) == {}
+    assert len(fake.queries) == 2
+    assert all("{urlhash: $urlhash}" in query for query in fake.queries)
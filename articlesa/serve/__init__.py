@@ -1,12 +1,59 @@
 """Serve module; collects routers from submodules and creates FastAPI app."""
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
 from fastapi import FastAPI
 
+from articlesa.config import Neo4JConfig
+from articlesa.logger import logger
+from articlesa.neo import Neo4JArticleDriver
 from articlesa.serve.client import router as client_router
 from articlesa.serve.gateway import router as gateway_router
 from articlesa.serve.home import router as home_router
+from articlesa.serve.notify import JobNotifier
+from articlesa.serve.writer import ArticleWriteBuffer
+from articlesa.worker import make_pool
+
+
+async def check_schema(neodriver: Neo4JArticleDriver) -> None:
+    """Make sure the neo4j schema exists and urlhash is backfilled, migrating if configured to."""
+    try:
+        if Neo4JConfig.migrate_on_startup:
+            await neodriver.migrate()
+            return
+        if missing := await neodriver.check_schema():
+            logger.warning(
+                f"neo4j schema is missing {missing}, run `python -m articlesa.neo migrate`"
+            )
+        if await neodriver.check_backfill():
+            logger.warning(
+                "some neo4j articles have no urlhash, so reads also match by url until "
+                "`python -m articlesa.neo migrate` is run"
+            )
+    except Exception as e:
+        logger.opt(exception=e).error("unable to check neo4j schema")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    """Set up process-wide pools and drivers shared by every request."""
+    app.state.arqpool = await make_pool()
+    app.state.neodriver = await Neo4JArticleDriver().open()
+    await check_schema(app.state.neodriver)
+    app.state.notifier = JobNotifier(app.state.arqpool)
+    await app.state.notifier.start()
+    app.state.writer = ArticleWriteBuffer(app.state.neodriver)
+    await app.state.writer.start()
+    try:
+        yield
+    finally:
+        await app.state.writer.stop()
+        await app.state.notifier.stop()
+        await app.state.neodriver.close()
+        await app.state.arqpool.aclose()
 
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 app.include_router(client_router)
 app.include_router(gateway_router)
@@ -8,8 +8,7 @@ window.addEventListener('DOMContentLoaded', function() {
     container: document.getElementById('graph'),
   });
 
-  cy.on('add', 'node', _evt => {
-    console.log("got node add event...")
+  function runLayout() {
     var layout = cy.layout({
       name: 'concentric',
       concentric: function( node ){ // returns numeric value for each node, placing higher nodes in levels towards the centre
@@ -17,6 +16,17 @@ window.addEventListener('DOMContentLoaded', function() {
         },
       });
     layout.run();
+  }
+
+  // lay out once nodes stop being added for a moment, rather than on every node
+  var layoutTimer = null;
+  function scheduleLayout() {
+    clearTimeout(layoutTimer);
+    layoutTimer = setTimeout(runLayout, 100);
+  }
+
+  cy.on('add', 'node', _evt => {
+    scheduleLayout();
   });
 
   // if user clicks on node and the click is on an <a> tag, open the link
@@ -110,42 +120,64 @@ window.addEventListener('DOMContentLoaded', function() {
       window.cy.elements().remove();  // clear the graph
     });
 
-    sse.addEventListener("node_processing", (e) => {
-      console.debug("processing", e.data);  // urlhash; parent
-      parsedData = JSON.parse(e.data);
-      cy.add({
-        data: { id: parsedData.urlhash },
-      });
-      if (parsedData.parent) {
-        edgeObject = {
-          id: `${parsedData.parent}->${parsedData.urlhash}`,
-          source: parsedData.parent,
-          target: parsedData.urlhash
+    // handlers of node events, by event type, called with the parsed event data
+    const nodeHandlers = {
+      node_processing: (parsedData) => {  // urlhash; parent
+        cy.add({
+          data: { id: parsedData.urlhash },
+        });
+        if (parsedData.parent) {
+          edgeObject = {
+            id: `${parsedData.parent}->${parsedData.urlhash}`,
+            source: parsedData.parent,
+            target: parsedData.urlhash
+          }
+          cy.add({data: edgeObject})
         }
-        cy.add({data: edgeObject})
-      }
-    });
-
-    sse.addEventListener("node_render", (e) => {
-      console.debug("got data", e.data);  // urlhash; parent; title; url; published;
-      parsedData = JSON.parse(e.data);
-      parsedData.netloc = getHostname(parsedData.url);
-      window.cy.$id(parsedData.urlhash).data(parsedData);
-      window.cy.$id(parsedData.urlhash).addClass('success');
-    });
+      },
+      node_link: (parsedData) => {  // urlhash; parent
+        edgeId = `${parsedData.parent}->${parsedData.urlhash}`;
+        if (window.cy.$id(edgeId).empty()) {
+          cy.add({data: {id: edgeId, source: parsedData.parent, target: parsedData.urlhash}});
+        }
+      },
+      node_render: (parsedData) => {  // urlhash; parent; title; url; published;
+        parsedData.netloc = getHostname(parsedData.url);
+        window.cy.$id(parsedData.urlhash).data(parsedData);
+        window.cy.$id(parsedData.urlhash).addClass('success');
+      },
+      node_failure: (parsedData) => {
+        parsedData.netloc = getHostname(parsedData.url);
+        window.cy.$id(parsedData.urlhash).data(parsedData);
+        window.cy.$id(parsedData.urlhash).addClass('failure');
+      },
+    };
+
+    for (const [eventType, handler] of Object.entries(nodeHandlers)) {
+      sse.addEventListener(eventType, (e) => {
+        console.debug(eventType, e.data);
+        handler(JSON.parse(e.data));
+      });
+    }
 
-    sse.addEventListener("node_failure", (e) => {
-      console.debug("failure", e.data);
-      parsedData = JSON.parse(e.data);
-      parsedData.netloc = getHostname(parsedData.url);
-      window.cy.$id(parsedData.urlhash).data(parsedData);
-      window.cy.$id(parsedData.urlhash).addClass('failure');
+    // many node events in one message, applied to the graph together
+    sse.addEventListener("node_batch", (e) => {
+      const events = JSON.parse(e.data);  // [{event; data}]
+      console.debug(`batch of ${events.length} events`);
+      window.cy.batch(() => {
+        for (const item of events) {
+          nodeHandlers[item.event](item.data);
+        }
+      });
     });
 
     sse.addEventListener("stream_end", (e) => {
-      console.log("stream ending");
+      parsedData = JSON.parse(e.data);  // nodes; skipped
+      console.log(`stream ending, ${parsedData.nodes} nodes, ${parsedData.skipped} links skipped`);
       sse.close();
       SSERunning = false;
+      clearTimeout(layoutTimer);
+      runLayout();
     } );
   };
 
@@ -154,7 +186,7 @@ window.addEventListener('DOMContentLoaded', function() {
 
     var url = document.getElementById('urlInput').value;
 
-    fetchServerSentEvents(`/a/${url}`);
+    fetchServerSentEvents(`/a/${url}?batch=true`);
   });
 
 });
@@ -0,0 +1,85 @@
+"""
+articlesa.serve.cache module.
+
+cache keeps recently rendered article nodes in memory, so that popular trees
+can be streamed again without a neo4j round trip per node.
+"""
+
+from collections import OrderedDict
+import json
+import time
+from typing import Optional
+
+from articlesa.config import CacheConfig
+from articlesa.metrics import cache_lookups
+
+
+def payload_size(payload: dict) -> int:
+    """Approximate the memory held by a payload by its json length."""
+    return len(json.dumps(payload, default=str))
+
+
+class NodeCache:
+    """
+    NodeCache is a bounded LRU cache of render-ready article payloads.
+
+    Entries are keyed by urlhash, and evicted when older than `ttl` seconds or
+    when the cache holds more than `max_items` entries or `max_bytes` bytes.
+    Payloads are shared between streams and must not be mutated.
+    """
+    def __init__(self,
+                 max_items: int = CacheConfig.node_cache_items,
+                 max_bytes: int = CacheConfig.node_cache_bytes,
+                 ttl: float = CacheConfig.node_cache_ttl,
+                 ) -> None:
+        """Initialize an empty cache."""
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        # urlhash -> (expires at, size, payload)
+        self._entries: OrderedDict[str, tuple[float, int, dict]] = OrderedDict()
+
+    def __len__(self) -> int:
+        """Return the number of cached payloads."""
+        return len(self._entries)
+
+    def get(self, urlhash: str) -> Optional[dict]:
+        """Return the cached payload for urlhash, or None if missing or expired."""
+        entry = self._entries.get(urlhash)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                self.invalidate(urlhash)
+            self.misses += 1
+            cache_lookups.labels("node", "miss").inc()
+            return None
+        self._entries.move_to_end(urlhash)
+        self.hits += 1
+        cache_lookups.labels("node", "hit").inc()
+        return entry[2]
+
+    def put(self, urlhash: str, payload: dict) -> None:
+        """Cache payload for urlhash, replacing any older version."""
+        self.invalidate(urlhash)
+        size = payload_size(payload)
+        if size > self.max_bytes:
+            return
+        self._entries[urlhash] = (time.monotonic() + self.ttl, size, payload)
+        self.bytes += size
+        while len(self._entries) > self.max_items or self.bytes > self.max_bytes:
+            _, (_, evicted_size, _) = self._entries.popitem(last=False)
+            self.bytes -= evicted_size
+
+    def invalidate(self, urlhash: str) -> None:
+        """Drop the cached payload for urlhash, if any."""
+        entry = self._entries.pop(urlhash, None)
+        if entry is not None:
+            self.bytes -= entry[1]
+
+    @property
+    def hit_ratio(self) -> float:
+        """Return the fraction of lookups served from the cache."""
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
@@ -0,0 +1,61 @@
+"""
+articlesa.serve.freshness module.
+
+freshness decides whether a stored article is still fresh enough to serve
+without re-parsing it, optionally with a different max age per publisher.
+"""
+
+from datetime import datetime, timezone
+from typing import Optional
+
+from articlesa.config import CacheConfig
+from articlesa.types import ParsedArticle
+
+
+def parse_max_age_overrides(overrides: str) -> dict[str, float]:
+    """Parse overrides formatted like "apnews.com=3600,example.com=86400"."""
+    parsed = {}
+    for override in overrides.split(","):
+        if not override.strip():
+            continue
+        netloc, _, max_age = override.partition("=")
+        parsed[netloc.strip().lower()] = float(max_age)
+    return parsed
+
+
+class FreshnessPolicy:
+    """Max age policy for stored articles, keyed by publisher netloc."""
+    def __init__(self, max_age: float, overrides: Optional[dict[str, float]] = None) -> None:
+        """Initialize policy with a default max age in seconds and per-netloc overrides."""
+        self.max_age = max_age
+        self.overrides = overrides or {}
+
+    @classmethod
+    def from_config(cls) -> "FreshnessPolicy":
+        """Build policy from CacheConfig."""
+        return cls(
+            max_age=CacheConfig.max_age,
+            overrides=parse_max_age_overrides(CacheConfig.max_age_overrides),
+        )
+
+    def max_age_for(self, netloc: str) -> float:
+        """
+        Return max age for netloc.
+
+        Overrides apply to subdomains too, so an override for apnews.com also
+        covers www.apnews.com.
+        """
+        labels = netloc.lower().split(".")
+        for i in range(len(labels)):
+            if (domain := ".".join(labels[i:])) in self.overrides:
+                return self.overrides[domain]
+        return self.max_age
+
+    def is_stale(self, article: ParsedArticle, now: Optional[datetime] = None) -> bool:
+        """Check if article was parsed longer ago than its publisher's max age."""
+        now = now or datetime.now(timezone.utc)
+        parsed_at = article.parsedAtUtc
+        if parsed_at.tzinfo is None:
+            parsed_at = parsed_at.replace(tzinfo=timezone.utc)
+        age = (now - parsed_at).total_seconds()
+        return age > self.max_age_for(article.publisherNetLoc)
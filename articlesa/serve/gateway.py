@@ -6,30 +6,73 @@ sending server-sent events to the client while an article is being processed.
 """
 
 import asyncio
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 import json
-from typing import AsyncGenerator, Optional
+import time
+from typing import Annotated, AsyncGenerator, Optional, Union
 from arq import ArqRedis
-from arq.jobs import JobStatus
+from arq.constants import abort_jobs_ss, result_key_prefix
+from arq.jobs import Job, ResultNotFound
 
-from fastapi import APIRouter, Request
+from fastapi import APIRouter, Depends, Header, Query, Request
+import orjson
+from pydantic import BaseModel
 from sse_starlette.sse import EventSourceResponse
 
+from articlesa.config import ServeConfig
 from articlesa.logger import logger
+from articlesa.metrics import abandoned, sse_events, stage_seconds, stream_peak_tasks, stream_tasks, streams_active
 from articlesa.neo import Neo4JArticleDriver, ArticleNotFound
+from articlesa.serve.cache import NodeCache
+from articlesa.serve.freshness import FreshnessPolicy
+from articlesa.serve.notify import JobAborted, JobNotifier
+from articlesa.serve.singleflight import SingleFlight
+from articlesa.serve.streams import StreamRegistry
+from articlesa.serve.writer import ArticleWriteBuffer
+from articlesa.trace import Attribute, carrier, span, traced
 from articlesa.types import (
     ParsedArticle,
     StreamEvent,
     SSE,
     clean_url,
+    normalize_url,
     url_to_hash,
+    parse_job_id,
+    NodeLink,
     PlaceholderArticle,
     ParseFailure,
 )
-from articlesa.worker import create_pool
-
 
 router = APIRouter()
+freshness = FreshnessPolicy.from_config()
+cache = NodeCache()
+streams = StreamRegistry()
+inflight: SingleFlight[dict] = SingleFlight()
+revalidating: SingleFlight[dict] = SingleFlight()
+background_tasks: set[asyncio.Task] = set()
+
+# number of streams, across gateways, waiting on a job is kept at this prefix plus the job id
+JOB_WAITERS_PREFIX = "articlesa:job_waiters:"
+
+
+def get_arqpool(request: Request) -> ArqRedis:
+    """Dependency returning the app's shared arq pool."""
+    return request.app.state.arqpool
+
+
+def get_neodriver(request: Request) -> Neo4JArticleDriver:
+    """Dependency returning the app's shared neo4j driver."""
+    return request.app.state.neodriver
+
+
+def get_notifier(request: Request) -> JobNotifier:
+    """Dependency returning the app's shared job notifier."""
+    return request.app.state.notifier
+
+
+def get_writer(request: Request) -> ArticleWriteBuffer:
+    """Dependency returning the app's shared article write buffer."""
+    return request.app.state.writer
 
 
 class SafeEncoder(json.JSONEncoder):
@@ -41,89 +84,484 @@ class SafeEncoder(json.JSONEncoder):
             return super().default(z)
 
 
-def build_event(data: Optional[dict], id: str, event: StreamEvent) -> SSE:
-    """build_event builds a server-sent event from data."""
-    if not data:
-        data = dict()
-    return SSE(data=json.dumps(data, cls=SafeEncoder), id=id, event=event.value)
+def _encode_datetime(z: object) -> str:
+    """Encode datetime objects for orjson like SafeEncoder does."""
+    if isinstance(z, datetime):
+        return str(z)
+    raise TypeError(f"{z.__class__.__name__} is not json serializable")
+
+
+def dump_json(data: dict) -> str:
+    """Serialize data to json like SafeEncoder, but with orjson."""
+    return orjson.dumps(data, default=_encode_datetime, option=orjson.OPT_PASSTHROUGH_DATETIME).decode()
+
+
+def build_event(data: Union[BaseModel, dict, None], id: str, event: StreamEvent) -> SSE:
+    """
+    build_event builds a server-sent event from data.
+
+    Models are serialized straight to json by pydantic. The event type is a
+    StreamEvent already, so the SSE is built without validating it.
+    """
+    if isinstance(data, BaseModel):
+        encoded = data.model_dump_json()
+    else:
+        encoded = dump_json(data or {})
+    return SSE.model_construct(data=encoded, id=id, event=event.value)
+
+
+# node events that batched streams coalesce into node_batch events
+BATCHED_EVENTS = frozenset(e.value for e in (
+    StreamEvent.NODE_PROCESSING, StreamEvent.NODE_RENDER, StreamEvent.NODE_FAILURE, StreamEvent.NODE_LINK,
+))
+
+
+def build_batch_event(events: list[SSE]) -> SSE:
+    """
+    Combine node events into one node_batch event, a json list of {"event", "data"}.
+
+    The batch takes the id of its last event, so a client reconnecting with
+    it resumes after every event in the batch.
+    """
+    # data is json already, so it's spliced in rather than parsed and dumped again
+    items = ",".join(f'{{"event":"{event.event}","data":{event.data}}}' for event in events)
+    return SSE.model_construct(data=f"[{items}]", id=events[-1].id, event=StreamEvent.NODE_BATCH.value)
+
+
+def parse_max_fanout(max_fanout: str) -> list[int]:
+    """Parse per-depth fan-out limits formatted like "50,20,10", empty for no limits."""
+    return [int(limit) for limit in max_fanout.split(",") if limit.strip()]
+
+
+class StreamNodes:
+    """
+    StreamNodes tracks the nodes of one stream, deciding what each link found in it becomes.
+
+    Links are matched to nodes by normalize_url, so each article is processed
+    once per stream and further links to it only add an edge. New nodes are
+    limited to max_nodes in total, and to max_fanout children per article at
+    each depth, the last limit applying to deeper articles too; links over
+    the limits are skipped.
+    """
+    def __init__(self, max_nodes: int, max_fanout: list[int]) -> None:
+        """Initialize a stream with no nodes; an empty max_fanout means no fan-out limits."""
+        self.max_nodes = max_nodes
+        self.max_fanout = max_fanout
+        # normalized urlhash of every article in this stream -> its node urlhash
+        self.visited: dict[str, str] = {}
+        # (parent, child) node urlhashes of every edge sent
+        self.edges: set[tuple[Optional[str], str]] = set()
+        # node urlhash -> number of children processed
+        self.fanout: dict[str, int] = {}
+        # normalized urlhash of every link skipped because of the limits, and not processed since;
+        # a set, since links are seen both as workers publish them and in their parent's result
+        self.skipped: set[str] = set()
+
+    def __len__(self) -> int:
+        """Return the number of nodes."""
+        return len(self.visited)
+
+    def _over_limits(self, depth: int, parent: str) -> bool:
+        """Check if parent, at depth - 1, can't have another child processed."""
+        if len(self.visited) >= self.max_nodes:
+            return True
+        if not self.max_fanout:
+            return False
+        return self.fanout.get(parent, 0) >= self.max_fanout[min(depth - 1, len(self.max_fanout) - 1)]
+
+    def add(self, url: str, depth: int, parent: Optional[str], name: str) -> Optional[SSE]:
+        """
+        Add a link to url found on parent, returning the event to send for it, if any.
+
+        That's node_processing if url is a new node, which is then to be
+        processed, or node_link if it's a new edge to a node already in the
+        stream. Links to the root have no parent.
+        """
+        key = url_to_hash(normalize_url(url))
+        if (urlhash := self.visited.get(key)) is not None:
+            if parent is None or parent == urlhash or (parent, urlhash) in self.edges:
+                return None
+            self.edges.add((parent, urlhash))
+            return build_event(data=NodeLink(urlhash=urlhash, parent=parent), id=name, event=StreamEvent.NODE_LINK)
+        if parent is not None:
+            if self._over_limits(depth, parent):
+                self.skipped.add(key)
+                return None
+            self.fanout[parent] = self.fanout.get(parent, 0) + 1
+        urlhash = url_to_hash(url)
+        self.visited[key] = urlhash
+        self.skipped.discard(key)
+        self.edges.add((parent, urlhash))
+        placeholder_node = PlaceholderArticle(urlhash=urlhash, depth=depth, parent=parent)
+        return build_event(data=placeholder_node, id=name, event=StreamEvent.NODE_PROCESSING)
+
+
+def priority_boost(depth: int, background: bool) -> float:
+    """
+    Return how many seconds ahead to queue the parse job of a node.
+
+    arq runs jobs in order of their queue score, normally the enqueue time, so
+    queueing a job as if it was enqueued earlier moves it ahead. Nodes near the
+    root of interactive streams are moved ahead, while crawls and deeper nodes
+    are queued as background work. A background job is only passed by
+    interactive jobs enqueued less than the boost after it, which bounds how
+    long it can starve.
+    """
+    if background or depth > 1:
+        return 0.0
+    return ServeConfig.priority_boost * (2 - depth)
+
+
+async def _promote(arqpool: ArqRedis, job_id: str, boost: float) -> None:
+    """Move a queued job ahead as if it was enqueued boost seconds ago, if that's earlier."""
+    score = (datetime.now(timezone.utc) - timedelta(seconds=boost)).timestamp() * 1000
+    await arqpool.zadd(arqpool.default_queue_name, {job_id: score}, xx=True, lt=True)
+
+
+async def _release_job(arqpool: ArqRedis, job_id: str, abandon: bool) -> None:
+    """
+    Stop counting a waiter on a job.
+
+    If the waiter abandoned the job and no stream on any gateway waits on it
+    anymore, the job is aborted: a queued job is moved to the front of the
+    queue, so the worker drops it right away, and a running one is cancelled.
+    """
+    waiters = await arqpool.decr(JOB_WAITERS_PREFIX + job_id)
+    if not abandon or waiters > 0:
+        return
+    async with arqpool.pipeline(transaction=True) as pipe:
+        pipe.delete(JOB_WAITERS_PREFIX + job_id)
+        pipe.zadd(arqpool.default_queue_name, {job_id: 1}, xx=True)
+        pipe.zadd(abort_jobs_ss, {job_id: datetime.now(timezone.utc).timestamp() * 1000})
+        await pipe.execute()
+    abandoned.labels("jobs").inc()
+    logger.info(f"aborted job {job_id}, no stream is waiting on it")
+
+
+def render_payload(parsed_article: ParsedArticle) -> dict:
+    """Dump the article fields relevant for rendering, i.e. everything but the text."""
+    return parsed_article.model_dump(exclude={"text"})
+
+
+def render_event(url: str, depth: int, payload: dict, name: str) -> SSE:
+    """Build the node_render event of the node of url from its render payload."""
+    # payloads are shared through the node cache, so copy before changing
+    data = {**payload, "urlhash": url_to_hash(url), "depth": depth}
+    return build_event(data=data, id=name, event=StreamEvent.NODE_RENDER)
+
+
+async def _parse_article(url: str,
+                         arqpool: ArqRedis,
+                         notifier: JobNotifier,
+                         writer: ArticleWriteBuffer,
+                         parent_url: Optional[str] = None,
+                         priority: float = 0.0,
+                         refresh: bool = False,
+                         ) -> dict:
+    """
+    Parse article through arq, queue it on the write buffer and cache its payload.
+
+    Waiters on each job are counted in redis, so that the job is aborted if
+    every stream waiting on it is cancelled, see _release_job. If refresh is
+    set, a result arq kept of an earlier parse of the url is discarded, so the
+    article is parsed again rather than the kept result being returned.
+    """
+    # the job id is derived from the url, so if another gateway already queued
+    # this url we attach to that job (or its kept result) instead
+    job_id = parse_job_id(url)
+    defer_until = None
+    if priority:
+        defer_until = datetime.now(timezone.utc) - timedelta(seconds=priority)
+    async with arqpool.pipeline(transaction=False) as pipe:
+        pipe.incr(JOB_WAITERS_PREFIX + job_id)
+        pipe.expire(JOB_WAITERS_PREFIX + job_id, 24 * 60 * 60)
+        if refresh:
+            pipe.delete(result_key_prefix + job_id)
+        await pipe.execute()
+    cancelled = False
+    try:
+        for attempt in range(2):
+            with span("job", job_id=job_id, attempt=attempt) as job_span:
+                # the worker continues this trace, unless another stream queued the job first
+                job = await arqpool.enqueue_job(
+                    "parse_article", url, trace=carrier(), _job_id=job_id, _defer_until=defer_until
+                )
+                if job is None:
+                    if job_span is not None:
+                        job_span.attributes["joined"] = True
+                    job = Job(job_id, arqpool)
+                    # take back an abort no worker acted on yet, as this stream waits on the
+                    # job; jobs aborted before they start end without publishing completion
+                    if await arqpool.zrem(abort_jobs_ss, job_id):
+                        logger.info(f"kept job {job_id} from being aborted, a stream is waiting on it")
+                    if priority:
+                        await _promote(arqpool, job_id, priority)
+                try:
+                    result = await notifier.wait(job)
+                except (JobAborted, ResultNotFound):
+                    if attempt:
+                        raise
+                    # aborted for an earlier stream, or its result expired before it was
+                    # read; forget any result and queue it again
+                    await arqpool.delete(result_key_prefix + job_id)
+                    continue
+            break
+    except asyncio.CancelledError:
+        cancelled = True
+        raise
+    finally:
+        await asyncio.shield(_release_job(arqpool, job_id, abandon=cancelled))
+    parsed_article = ParsedArticle(**result)
+    writer.put(parsed_article, parent_url=parent_url)
+    payload = render_payload(parsed_article)
+    cache.put(url_to_hash(clean_url(url)), payload)
+    return payload
+
+
+def _finish_revalidation(task: asyncio.Task) -> None:
+    """Release a finished revalidation task, logging its failure if any."""
+    background_tasks.discard(task)
+    if not task.cancelled() and (e := task.exception()):
+        logger.opt(exception=e).warning(f"error revalidating stale article in {task.get_name()}")
+
+
+def _revalidate(url: str,
+                arqpool: ArqRedis,
+                notifier: JobNotifier,
+                writer: ArticleWriteBuffer,
+                ) -> None:
+    """Re-parse a stale article in the background, unless that is already happening."""
+    key = url_to_hash(clean_url(url))
+    if key in revalidating:
+        return
+    task = asyncio.create_task(
+        revalidating.do(key, lambda: _parse_article(url, arqpool, notifier, writer))
+    )
+    task.set_name(f"revalidate/{url}")
+    background_tasks.add(task)
+    task.add_done_callback(_finish_revalidation)
+
+
+async def _retrieve_article(url: str,
+                            arqpool: ArqRedis,
+                            neodriver: Neo4JArticleDriver,
+                            notifier: JobNotifier,
+                            writer: ArticleWriteBuffer,
+                            parent_url: Optional[str] = None,
+                            refresh: bool = False,
+                            priority: float = 0.0,
+                            ) -> dict:
+    """Retrieve article from db or through arq, see retrieve_article."""
+    if not refresh:
+        try:
+            parsed_article = await neodriver.get_article(url)
+        except ArticleNotFound:
+            pass
+        else:
+            if freshness.is_stale(parsed_article):
+                _revalidate(url, arqpool, notifier, writer)
+            payload = render_payload(parsed_article)
+            cache.put(url_to_hash(clean_url(url)), payload)
+            return payload
+    return await _parse_article(
+        url, arqpool, notifier, writer, parent_url=parent_url, priority=priority, refresh=refresh
+    )
 
 
 async def retrieve_article(url: str,
                            arqpool: ArqRedis,
                            neodriver: Neo4JArticleDriver,
+                           notifier: JobNotifier,
+                           writer: ArticleWriteBuffer,
                            parent_url: Optional[str] = None,
+                           refresh: bool = False,
+                           priority: float = 0.0,
                            ) -> dict:
     """
-    Retrieve article from db or through arq; intended to be wrapped in asyncio.Task.
+    Retrieve article render payload; intended to be wrapped in asyncio.Task.
+
+    Tries the in-memory node cache, then neo.Neo4jArticleDriver.get_article,
+    then falls back to arq enqueueing.
+    Job completion is pushed by the worker and delivered through the notifier.
+    Newly parsed articles are queued on the write buffer rather than written inline.
 
-    Tries neo.Neo4jArticleDriver.get_article first, then falls back to arq enqueueing.
+    Stored articles older than the freshness policy allows are still returned,
+    but are re-parsed in the background. If refresh is set, the caches are
+    skipped and the article is always re-parsed.
 
-    If a parent_url is passed, neo4j will create a relationship between the parent
-    and the child article.
+    Concurrent retrievals of the same url share one in-flight retrieval. If a
+    parent_url is passed to the retrieval that starts the flight, neo4j will
+    create a relationship between the parent and the child article.
+
+    If the article has to be parsed, its job is queued priority seconds ahead,
+    see priority_boost. Joining a flight whose job is already queued moves the
+    job ahead if this retrieval's priority is higher.
+    """
+    key = url_to_hash(clean_url(url))
+    if refresh:
+        key += ":refresh"
+    elif (payload := cache.get(key)) is not None:
+        return payload
+    if priority and key in inflight:
+        await _promote(arqpool, parse_job_id(url), priority)
+    return await inflight.do(
+        key,
+        lambda: _retrieve_article(
+            url, arqpool, neodriver, notifier, writer,
+            parent_url=parent_url, refresh=refresh, priority=priority,
+        ),
+    )
+
+
+async def _prefetch_subtree(url: str,
+                            max_depth: int,
+                            max_nodes: int,
+                            neodriver: Neo4JArticleDriver,
+                            ) -> dict[str, dict]:
+    """
+    Fetch the stored subtree under url, returning payloads of up to max_nodes fresh articles.
+
+    Payloads are keyed by url_to_hash(clean_url(url)) and also put into the
+    node cache. Stale articles are left out so they are retrieved, and
+    revalidated, node by node.
     """
     try:
-        parsed_article = await neodriver.get_article(url)
-        return parsed_article.model_dump()
-    except ArticleNotFound:
-        pass
-    job = await arqpool.enqueue_job("parse_article", url)
-    while await job.status() != JobStatus.complete:
-        await asyncio.sleep(0.1)
-    article_dict = await job.result()
-    try:
-        await neodriver.put_article(ParsedArticle(**article_dict), parent_url=parent_url)
+        subtree = await neodriver.get_subtree(url, max_depth, max_nodes)
     except Exception as e:
-        logger.opt(exception=e).error(f"error putting article {url} into db")
-    return article_dict
+        logger.opt(exception=e).error(f"error fetching subtree of {url}")
+        return {}
+    prefetched = {}
+    for article_url, parsed_article in subtree.items():
+        if freshness.is_stale(parsed_article):
+            continue
+        key = url_to_hash(clean_url(article_url))
+        prefetched[key] = render_payload(parsed_article)
+        cache.put(key, prefetched[key])
+    return prefetched
 
 
 async def _article_stream(
-    article_url: str, max_depth: int, neodriver: Neo4JArticleDriver
+    article_url: str,
+    max_depth: int,
+    arqpool: ArqRedis,
+    neodriver: Neo4JArticleDriver,
+    notifier: JobNotifier,
+    writer: ArticleWriteBuffer,
+    refresh: bool = False,
+    max_nodes: int = ServeConfig.max_nodes,
+    max_fanout: Optional[list[int]] = None,
+    background: bool = False,
 ) -> AsyncGenerator[SSE, None]:
     """
     Generate server-sent events to signal article parsing progress.
 
     article_url: url of article to parse
     max_depth: maximum depth to parse to
+    refresh: re-parse every article instead of serving stored ones
+    background: queue every parse job as background work, as crawls do
+    max_nodes: most articles to process, further links are skipped
+    max_fanout: most children to process per article at each depth, the
+        last limit applies to deeper articles too; see StreamNodes
+
+    Children of an article being parsed are started as soon as the worker
+    publishes their final url, rather than once the whole article is parsed.
+    Each article is processed once per stream; links to an article already in
+    the stream only add an edge to its node. The stream end event counts the
+    nodes, and the distinct links skipped because of the limits.
     """
     tasks = set()
-    arqpool = await create_pool()
+    if max_fanout is None:
+        max_fanout = parse_max_fanout(ServeConfig.max_fanout)
+    # fresh stored articles of the whole tree, fetched up front in one query
+    # and keyed like the retrieval flights
+    prefetched: dict[str, dict] = {}
+    nodes = StreamNodes(max_nodes, max_fanout)
+    # most tasks in flight at once, and how many are counted in the stream_tasks gauge
+    peak_tasks = counted_tasks = 0
+    # task waiting on the next published link -> (url, depth, job id, queue) of the parent
+    link_watchers: dict[asyncio.Task, tuple[str, int, str, asyncio.Queue]] = {}
+    # name of a retrieval task -> its link watcher
+    watcher_of: dict[str, asyncio.Task] = {}
+
+    def _watch_links(url: str, depth: int, name: str, queue: Optional[asyncio.Queue] = None) -> None:
+        """Wait on the next link published while url is parsed."""
+        job_id = parse_job_id(url)
+        if queue is None:
+            queue = notifier.watch_links(job_id)
+        watcher = asyncio.create_task(queue.get())
+        link_watchers[watcher] = (url, depth, job_id, queue)
+        watcher_of[name] = watcher
+        tasks.add(watcher)
+
+    def _unwatch_links(name: str) -> None:
+        """Stop waiting on links published for a finished retrieval."""
+        if (watcher := watcher_of.pop(name, None)) is None:
+            return
+        watcher.cancel()
+        tasks.discard(watcher)
+        _, _, job_id, queue = link_watchers.pop(watcher)
+        notifier.unwatch_links(job_id, queue)
 
     async def _begin_processing_task(
-        url: str, depth: int, parent: Optional[str]
+        url: str, depth: int, parent: Optional[str], parent_url: Optional[str] = None
     ) -> AsyncGenerator[SSE, None]:
-        """Submit task to celery, create placholder node."""
-        placeholder_node = PlaceholderArticle(
-            urlhash=url_to_hash(url), depth=depth, parent=parent
-        )
-        task = asyncio.create_task(retrieve_article(url, arqpool, neodriver, parent_url=parent))
-        task.set_name(f"{depth}/{url}")
+        """Create placeholder node, render it if prefetched or else submit task to arq."""
+        name = f"{depth}/{url}"
+        if (event := nodes.add(url, depth, parent, name)) is None:
+            return
+        yield event
+        if event.event != StreamEvent.NODE_PROCESSING.value:
+            return  # already in the stream, only linked the parent to it
+        if (payload := prefetched.get(url_to_hash(clean_url(url)))) is not None:
+            async for event in _render_node(url, depth, payload, name):
+                yield event
+            return
+        task = asyncio.create_task(traced(
+            retrieve_article(
+                url, arqpool, neodriver, notifier, writer,
+                parent_url=parent_url, refresh=refresh, priority=priority_boost(depth, background),
+            ),
+            "retrieve", url=url, node=url_to_hash(url), parent_node=parent, depth=depth,
+        ))
+        task.set_name(name)
         tasks.add(task)
-        yield build_event(
-            data=placeholder_node.model_dump(),
-            id=task.get_name(),
-            event=StreamEvent.NODE_PROCESSING,
-        )
+        if depth < max_depth:
+            _watch_links(url, depth, name)
+
+    async def _process_published_link(watcher: asyncio.Task) -> AsyncGenerator[SSE, None]:
+        """Start processing a link published while its parent is parsed, then wait on the next."""
+        url, depth, job_id, queue = link_watchers.pop(watcher)
+        name = f"{depth}/{url}"
+        del watcher_of[name]
+        if watcher.cancelled():
+            notifier.unwatch_links(job_id, queue)
+            return
+        _watch_links(url, depth, name, queue)
+        published = watcher.result()
+        async for event in _begin_processing_task(
+            published["link"], depth + 1, parent=url_to_hash(url), parent_url=published["parent"]
+        ):
+            yield event
+
+    async def _render_node(
+        url: str, depth: int, payload: dict, name: str
+    ) -> AsyncGenerator[SSE, None]:
+        """Render a retrieved node and, if max depth has not been reached, submit its children."""
+        yield render_event(url, depth, payload, name)
+        if depth < max_depth:
+            for link in payload["links"]:
+                async for event in _begin_processing_task(
+                    link, depth + 1, parent=url_to_hash(url), parent_url=payload["url"]
+                ):
+                    yield event
 
     async def _process_completed_task(task: asyncio.Task) -> AsyncGenerator[SSE, None]:
+        _unwatch_links(task.get_name())
         depth, url = task.get_name().split("/", maxsplit=1)
         try:
             task.exception()  # raise exception if there is one
-            data = ParsedArticle.model_validate(task.result())
-            data.urlhash = url_to_hash(url)
-            data.depth = int(depth)
-            # only pass in fields relevant for rendering
-            del data.text
-            yield build_event(
-                data=data.model_dump(), id=task.get_name(), event=StreamEvent.NODE_RENDER
-            )
-            # if max depth has not been reached, also submit children
-            if data.depth < max_depth:
-                for link in data.links:
-                    async for event in _begin_processing_task(
-                        link, data.depth + 1, parent=data.urlhash
-                    ):
-                        yield event
+            async for event in _render_node(url, int(depth), task.result(), task.get_name()):
+                yield event
         except Exception as e:
             logger.opt(exception=e).error(f"error in task {task.get_name()}")
             failure = ParseFailure(
@@ -132,41 +570,147 @@ async def _article_stream(
                 urlhash=url_to_hash(url),
             )
             yield build_event(
-                data=failure.model_dump(), id=task.get_name(), event=StreamEvent.NODE_FAILURE
+                data=failure, id=task.get_name(), event=StreamEvent.NODE_FAILURE
             )
 
     yield build_event(data=None, id="begin", event=StreamEvent.STREAM_BEGIN)
 
-    async for event in _begin_processing_task(
-        article_url, 0, None
-    ):  # start processing the root node
-        yield event
+    if not refresh:
+        prefetched = await _prefetch_subtree(article_url, max_depth, max_nodes, neodriver)
+
+    streams_active.inc()
+    try:
+        async for event in _begin_processing_task(
+            article_url, 0, None
+        ):  # start processing the root node
+            yield event
 
-    while tasks:
-        done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
-        for task in done:
-            async for event in _process_completed_task(task):
+        while tasks:
+            stream_tasks.inc(len(tasks) - counted_tasks)
+            counted_tasks = len(tasks)
+            peak_tasks = max(peak_tasks, counted_tasks)
+            done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            # links first, a finished retrieval stops watching its links
+            for task in sorted(done, key=lambda task: task not in link_watchers):
+                if task in link_watchers:
+                    async for event in _process_published_link(task):
+                        yield event
+                elif not task.cancelled():
+                    async for event in _process_completed_task(task):
+                        yield event
+    finally:
+        streams_active.dec()
+        stream_tasks.dec(counted_tasks)
+        stream_peak_tasks.observe(peak_tasks)
+        for name in list(watcher_of):
+            _unwatch_links(name)
+        # the stream was abandoned before the tree was done, cancel what's left;
+        # jobs nobody else waits on are aborted by _parse_article
+        if tasks:
+            abandoned.labels("streams").inc()
+            abandoned.labels("tasks").inc(len(tasks))
+            for task in tasks:
+                task.cancel()
+
+    yield build_event(
+        data={"nodes": len(nodes), "skipped": len(nodes.skipped)}, id="done", event=StreamEvent.STREAM_END
+    )
+
+
+async def _traced_stream(
+    sse_generator: AsyncGenerator[SSE, None], **attributes: Attribute
+) -> AsyncGenerator[SSE, None]:
+    """Produce a stream as a new trace, see articlesa.trace."""
+    with span("stream", new_trace=True) as stream_span:
+        if stream_span is not None:
+            stream_span.attributes.update(attributes)
+            logger.info(f"tracing stream of {attributes.get('url')} as {stream_span.trace_id}")
+        try:
+            async for event in sse_generator:
                 yield event
+        finally:
+            # close right away, so tasks of an abandoned stream are cancelled
+            await sse_generator.aclose()
+
 
-    yield build_event(data=None, id="done", event=StreamEvent.STREAM_END)
+async def _coalesce(
+    batches: AsyncGenerator[list[SSE], None],
+    max_events: int = ServeConfig.batch_max_events,
+) -> AsyncGenerator[SSE, None]:
+    """Send each run of node events in a batch as node_batch events of at most max_events."""
+    async for batch in batches:
+        run: list[SSE] = []
+        for event in batch:
+            if event.event in BATCHED_EVENTS and len(run) < max_events:
+                run.append(event)
+                continue
+            if run:
+                yield build_batch_event(run) if len(run) > 1 else run[0]
+            run = [event] if event.event in BATCHED_EVENTS else []
+            if not run:
+                yield event
+        if run:
+            yield build_batch_event(run) if len(run) > 1 else run[0]
 
 
 async def _event_formatter(
     sse_generator: AsyncGenerator[SSE, None]
-) -> AsyncGenerator[dict, None]:
-    """Format server-sent events as dictionaries."""
+) -> AsyncGenerator[bytes, None]:
+    """Encode server-sent events, timing how long each takes to send."""
     async for event in sse_generator:
-        yield event.model_dump()
+        sse_events.labels(event.event).inc()
+        started = time.perf_counter()
+        yield event.encode()
+        stage_seconds.labels("sse_emit").observe(time.perf_counter() - started)
 
 
 @router.get("/a/{article_url:path}")
 async def article_stream(
-    request: Request, article_url: str, depth: int = 3
+    request: Request,
+    article_url: str,
+    arqpool: Annotated[ArqRedis, Depends(get_arqpool)],
+    neodriver: Annotated[Neo4JArticleDriver, Depends(get_neodriver)],
+    notifier: Annotated[JobNotifier, Depends(get_notifier)],
+    writer: Annotated[ArticleWriteBuffer, Depends(get_writer)],
+    depth: Annotated[int, Query(ge=0, le=ServeConfig.max_depth)] = 3,
+    refresh: bool = False,
+    background: bool = False,
+    batch: bool = False,
+    last_event_id: Annotated[Optional[str], Header()] = None,
 ) -> EventSourceResponse:
-    """Begin server-sent event stream for article parsing."""
+    """
+    Begin server-sent event stream for article parsing.
+
+    depth is how many links away from the article to follow, at most
+    ServeConfig.max_depth.
+    Pass refresh=true to bypass stored articles and re-parse the whole tree.
+    Pass background=true for crawls, so their jobs queue behind interactive ones.
+    Pass batch=true to get node events produced close together as node_batch
+    events, see ServeConfig.batch_window.
+
+    The stream is produced in the background, see streams.StreamRegistry.
+    Browsers reconnecting with a Last-Event-ID header are sent the events they
+    missed and keep following the same stream, instead of starting over.
+    """
     article_url = clean_url(article_url)
-    logger.info(f"hello from article stream for {article_url}")
-    async with Neo4JArticleDriver() as neodriver:
-        return EventSourceResponse(
-            _event_formatter(_article_stream(article_url, max_depth=depth, neodriver=neodriver))
-        )
+    key = f"{article_url}?depth={depth}&refresh={refresh}&background={background}"
+    if (resumed := streams.resume(last_event_id, key)) is not None:
+        log, after = resumed
+        logger.info(f"resuming stream {log.stream_id} of {article_url} after event {after}")
+    else:
+        logger.info(f"hello from article stream for {article_url}")
+        log, after = streams.start(key, _traced_stream(_article_stream(
+            article_url,
+            max_depth=depth,
+            arqpool=arqpool,
+            neodriver=neodriver,
+            notifier=notifier,
+            writer=writer,
+            refresh=refresh,
+            background=background,
+        ), url=article_url, depth=depth, refresh=refresh)), -1
+    if batch:
+        events = _coalesce(streams.follow_batches(log, after, request=request, window=ServeConfig.batch_window))
+    else:
+        events = streams.follow(log, after, request=request)
+    return EventSourceResponse(_event_formatter(events))
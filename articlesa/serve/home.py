@@ -1,5 +1,6 @@
 """Informational pages for the site."""
-from fastapi import APIRouter, Request
+from fastapi import APIRouter, Request, Response
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 
 
 router = APIRouter()
@@ -9,3 +10,9 @@ router = APIRouter()
 async def about(request: Request) -> dict:
     """Stub for the about page."""
     return {"message": "what are we about?"}
+
+
+@router.get("/metrics")
+async def metrics() -> Response:
+    """Prometheus metrics of this server process, see articlesa.metrics."""
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,185 @@
+"""
+articlesa.serve.notify module.
+
+notify keeps a single redis subscriber per process which listens for job
+completion messages published by the workers, and wakes whichever coroutines
+are waiting on those jobs. This replaces polling each job's status.
+The same subscriber delivers the links workers publish while parsing, to
+streams watching those jobs.
+"""
+
+import asyncio
+from collections import defaultdict
+import json
+from typing import Any, Optional
+
+from arq.jobs import Job, JobStatus
+from redis.asyncio import Redis
+from redis.asyncio.client import PubSub
+
+from articlesa.logger import logger
+from articlesa.types import JOB_COMPLETE_CHANNEL, LINKS_CHANNEL_PREFIX
+
+
+class JobAborted(Exception):
+    """Raised when waiting on an arq job that was aborted."""
+    pass
+
+
+class JobNotifier:
+    """
+    JobNotifier shares one pub/sub connection between every waiting job.
+
+    Pub/sub messages are fire-and-forget, so waiters still re-check the job
+    status every `fallback_interval` seconds in case a message was missed.
+    If the subscription is lost, resubscribing is retried after
+    `retry_interval` seconds, doubling up to `max_retry_interval`.
+    """
+    def __init__(self,
+                 redis: Redis,
+                 fallback_interval: float = 5.0,
+                 retry_interval: float = 1.0,
+                 max_retry_interval: float = 30.0,
+                 ) -> None:
+        """Initialize notifier, call start() before waiting on jobs."""
+        self.redis = redis
+        self.fallback_interval = fallback_interval
+        self.retry_interval = retry_interval
+        self.max_retry_interval = max_retry_interval
+        self._waiters: defaultdict[str, set[asyncio.Future]] = defaultdict(set)
+        self._link_queues: defaultdict[str, set[asyncio.Queue]] = defaultdict(set)
+        self._pubsub: Optional[PubSub] = None
+        self._listener: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        """Subscribe to the completion channel and start dispatching messages."""
+        self._pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+        await self._subscribe()
+        self._listener = asyncio.create_task(self._listen())
+        self._listener.set_name("job-notifier")
+
+    async def stop(self) -> None:
+        """Stop listening and release the pub/sub connection."""
+        if self._listener:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+        if self._pubsub:
+            await self._pubsub.aclose()
+        for futures in self._waiters.values():
+            for future in futures:
+                future.cancel()
+        self._waiters.clear()
+        self._link_queues.clear()
+
+    async def _subscribe(self) -> None:
+        """Subscribe to the completion channel and every job's links channel."""
+        assert self._pubsub is not None
+        await self._pubsub.subscribe(JOB_COMPLETE_CHANNEL)
+        await self._pubsub.psubscribe(LINKS_CHANNEL_PREFIX + "*")
+
+    async def _listen(self) -> None:
+        """Wake waiters of each job id published on the completion channel, and deliver links."""
+        assert self._pubsub is not None
+        while True:
+            try:
+                async for message in self._pubsub.listen():
+                    if message["type"] == "message":
+                        self._wake(message["data"].decode())
+                    elif message["type"] == "pmessage":
+                        job_id = message["channel"].decode().removeprefix(LINKS_CHANNEL_PREFIX)
+                        self._deliver_link(job_id, json.loads(message["data"]))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # waiters fall back to status checks until we are resubscribed
+                logger.opt(exception=e).error("job notifier lost its subscription")
+                await self._resubscribe()
+
+    async def _resubscribe(self) -> None:
+        """Reset the pub/sub connection and subscribe again, retrying with backoff until redis is back."""
+        assert self._pubsub is not None
+        delay = self.retry_interval
+        while True:
+            await asyncio.sleep(delay)
+            try:
+                await self._pubsub.reset()
+                await self._subscribe()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                delay = min(delay * 2, self.max_retry_interval)
+                logger.opt(exception=e).warning(f"job notifier failed to resubscribe, retrying in {delay}s")
+            else:
+                logger.info("job notifier resubscribed")
+                return
+
+    def _wake(self, job_id: str) -> None:
+        """Resolve every future waiting on job_id."""
+        for future in self._waiters.pop(job_id, ()):
+            if not future.done():
+                future.set_result(None)
+
+    def _deliver_link(self, job_id: str, link: dict) -> None:
+        """Put a link published while parsing job_id on every queue watching it."""
+        for queue in self._link_queues.get(job_id, ()):
+            queue.put_nowait(link)
+
+    def watch_links(self, job_id: str) -> asyncio.Queue:
+        """
+        Return a queue of links published while job_id is parsing.
+
+        Each link is a dict of the "parent" url it was found on and the "link"
+        itself. Links published before watching are missed, so the job result
+        stays the complete list. Call unwatch_links once done.
+        """
+        queue: asyncio.Queue = asyncio.Queue()
+        self._link_queues[job_id].add(queue)
+        return queue
+
+    def unwatch_links(self, job_id: str, queue: asyncio.Queue) -> None:
+        """Stop delivering links of job_id to queue."""
+        queues = self._link_queues.get(job_id)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self._link_queues[job_id]
+
+    async def wait(self, job: Job) -> Any:  # noqa: ANN401
+        """
+        Wait for an arq job to complete and return its result, raising JobAborted if it was aborted.
+
+        Raises arq's ResultNotFound if the job is gone without a result, e.g.
+        because its result expired, rather than waiting on it forever.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            # register before checking status so a completion can't slip between
+            future = loop.create_future()
+            self._waiters[job.job_id].add(future)
+            try:
+                if await job.status() in (JobStatus.complete, JobStatus.not_found):
+                    break
+                try:
+                    await asyncio.wait_for(future, timeout=self.fallback_interval)
+                except asyncio.TimeoutError:
+                    pass
+            finally:
+                waiters = self._waiters.get(job.job_id)
+                if waiters is not None:
+                    waiters.discard(future)
+                    if not waiters:
+                        del self._waiters[job.job_id]
+        # an aborted job's result is a CancelledError, which must not be
+        # mistaken for this waiter being cancelled
+        info = await job.result_info()
+        if info is None:
+            # raises ResultNotFound, unless the job was queued again meanwhile
+            return await job.result()
+        if isinstance(info.result, asyncio.CancelledError):
+            raise JobAborted(f"job {job.job_id} was aborted")
+        if not info.success:
+            raise info.result
+        return info.result
@@ -0,0 +1,59 @@
+"""
+articlesa.serve.singleflight module.
+
+singleflight coalesces concurrent calls for the same key within a process,
+so that every caller attaches to one in-flight call and shares its result.
+A call nobody is waiting on anymore is cancelled.
+"""
+
+import asyncio
+from typing import Awaitable, Callable, Generic, TypeVar
+
+
+T = TypeVar("T")
+
+
+class SingleFlight(Generic[T]):
+    """Run at most one call per key at a time, sharing its result between callers."""
+    def __init__(self) -> None:
+        """Initialize with no calls in flight."""
+        self._flights: dict[str, asyncio.Task[T]] = {}
+        # in-flight call -> number of callers awaiting it
+        self._callers: dict[asyncio.Task[T], int] = {}
+
+    def __contains__(self, key: str) -> bool:
+        """Check if a call for key is in flight."""
+        return key in self._flights
+
+    def _forget(self, key: str, task: asyncio.Task[T]) -> None:
+        """Drop a finished call, marking its exception as retrieved."""
+        if self._flights.get(key) is task:
+            del self._flights[key]
+        if not task.cancelled():
+            task.exception()
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[T]]) -> T:
+        """
+        Await fn(), or the call already in flight for key.
+
+        The shared call is shielded, so one caller being cancelled does not
+        cancel it for the others. Once the last caller is cancelled, the call
+        is cancelled as well.
+        """
+        task = self._flights.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            task.set_name(f"singleflight/{key}")
+            self._flights[key] = task
+            task.add_done_callback(lambda t: self._forget(key, t))
+        self._callers[task] = self._callers.get(task, 0) + 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if self._callers[task] == 1 and not task.done():
+                task.cancel()
+            raise
+        finally:
+            self._callers[task] -= 1
+            if not self._callers[task]:
+                del self._callers[task]
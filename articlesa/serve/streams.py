@@ -0,0 +1,212 @@
+"""
+articlesa.serve.streams module.
+
+streams decouples producing a stream's events from the connections reading
+them. Events are appended to a bounded in-memory log under a stream id, and
+every event id is "{stream_id}:{seq}", so a client that reconnects with a
+Last-Event-ID header is sent only the events it missed and then follows the
+same in-flight stream. Logs live in the memory of one server process, so
+resuming requires reconnecting to the same replica.
+"""
+
+import asyncio
+from collections import deque
+from contextlib import aclosing
+from itertools import islice
+from typing import AsyncGenerator, Optional
+from uuid import uuid4
+
+from fastapi import Request
+
+from articlesa.config import ServeConfig
+from articlesa.logger import logger
+from articlesa.metrics import streams_resumed
+from articlesa.types import SSE
+
+
+class StreamLog:
+    """The events of one stream, numbered from 0, keeping at most `max_events` of the latest."""
+    def __init__(self, stream_id: str, key: str, max_events: int) -> None:
+        """Initialize an empty log; key identifies what the stream is of."""
+        self.stream_id = stream_id
+        self.key = key
+        self.events: deque[SSE] = deque(maxlen=max_events)
+        self.first_seq = 0
+        self.next_seq = 0
+        self.done = False
+        self.abandoned = False
+        self.subscribers = 0
+        self.producer: Optional[asyncio.Task] = None
+        self._appended = asyncio.Event()
+
+    def append(self, event: SSE) -> None:
+        """Append event, numbering it and waking followers."""
+        event.id = f"{self.stream_id}:{self.next_seq}"
+        if len(self.events) == self.events.maxlen:
+            self.first_seq += 1
+        self.events.append(event)
+        self.next_seq += 1
+        self._wake()
+
+    def finish(self) -> None:
+        """Mark the stream as done and wake followers."""
+        self.done = True
+        self._wake()
+
+    def _wake(self) -> None:
+        """Wake every follower waiting for the log to change."""
+        self._appended.set()
+        self._appended = asyncio.Event()
+
+    def can_resume_after(self, seq: int) -> bool:
+        """Check if every event after seq is still in the log."""
+        return self.first_seq <= seq + 1 <= self.next_seq
+
+    async def wait(self, timeout: float) -> None:
+        """Wait until an event is appended or the stream is done, at most timeout seconds."""
+        try:
+            await asyncio.wait_for(self._appended.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+
+
+class StreamRegistry:
+    """
+    StreamRegistry runs stream producers in the background and keeps their logs.
+
+    A producer keeps running while no client follows its stream for up to
+    `grace` seconds, so that a client can reconnect, and is cancelled after.
+    Logs of finished streams are kept for `retention` seconds.
+    """
+    def __init__(self,
+                 grace: float = ServeConfig.stream_grace,
+                 retention: float = ServeConfig.stream_retention,
+                 max_events: int = ServeConfig.stream_log_events,
+                 ) -> None:
+        """Initialize a registry with no streams."""
+        self.grace = grace
+        self.retention = retention
+        self.max_events = max_events
+        self.resumed = 0
+        self._logs: dict[str, StreamLog] = {}
+        self._abandon_handles: dict[str, asyncio.TimerHandle] = {}
+
+    def __len__(self) -> int:
+        """Return the number of streams kept."""
+        return len(self._logs)
+
+    def resume(self, last_event_id: Optional[str], key: str) -> Optional[tuple[StreamLog, int]]:
+        """
+        Find the stream and position a Last-Event-ID header points at.
+
+        Returns None unless the stream is of key, wasn't abandoned and still
+        has every event after that position.
+        """
+        if not last_event_id:
+            return None
+        stream_id, _, seq = last_event_id.rpartition(":")
+        log = self._logs.get(stream_id)
+        if log is None or log.key != key or log.abandoned:
+            return None
+        if not seq.isdigit() or not log.can_resume_after(int(seq)):
+            return None
+        self.resumed += 1
+        streams_resumed.inc()
+        return log, int(seq)
+
+    def start(self, key: str, producer: AsyncGenerator[SSE, None]) -> StreamLog:
+        """Start producing a new stream of key in the background."""
+        log = StreamLog(uuid4().hex, key, self.max_events)
+        self._logs[log.stream_id] = log
+        log.producer = asyncio.create_task(self._produce(log, producer))
+        log.producer.set_name(f"stream/{log.stream_id}")
+        return log
+
+    async def _produce(self, log: StreamLog, producer: AsyncGenerator[SSE, None]) -> None:
+        """Append every produced event to the log, then keep the log for a while."""
+        try:
+            async for event in producer:
+                log.append(event)
+        except asyncio.CancelledError:
+            await producer.aclose()
+            raise
+        except Exception as e:
+            logger.opt(exception=e).error(f"error producing stream {log.stream_id}")
+        finally:
+            log.finish()
+            asyncio.get_running_loop().call_later(self.retention, self._logs.pop, log.stream_id, None)
+
+    def _attach(self, log: StreamLog) -> None:
+        """Count a follower, keeping the producer from being abandoned."""
+        log.subscribers += 1
+        if (handle := self._abandon_handles.pop(log.stream_id, None)) is not None:
+            handle.cancel()
+
+    def _detach(self, log: StreamLog) -> None:
+        """Stop counting a follower, abandoning the producer after the grace period if it was the last."""
+        log.subscribers -= 1
+        if log.subscribers or log.done:
+            return
+        self._abandon_handles[log.stream_id] = asyncio.get_running_loop().call_later(
+            self.grace, self._abandon, log
+        )
+
+    def _abandon(self, log: StreamLog) -> None:
+        """Cancel the producer of a stream nobody reconnected to."""
+        self._abandon_handles.pop(log.stream_id, None)
+        if log.subscribers == 0 and log.producer is not None and not log.producer.done():
+            logger.info(f"nobody reconnected to stream {log.stream_id}, cancelling it")
+            log.abandoned = True
+            log.producer.cancel()
+
+    async def follow_batches(self,
+                             log: StreamLog,
+                             after: int = -1,
+                             request: Optional[Request] = None,
+                             poll_interval: float = 1.0,
+                             window: float = 0.0,
+                             ) -> AsyncGenerator[list[SSE], None]:
+        """
+        Yield the events of a stream after seq `after` in batches, as they are produced.
+
+        Each batch holds the events appended since the last one was copied; once
+        an event is appended to a log that had nothing new, up to `window` more
+        seconds of events are waited for.
+        Stops once the stream is done, or once the client of request has
+        disconnected, which is checked every poll_interval seconds.
+        """
+        self._attach(log)
+        try:
+            seq = after + 1
+            while True:
+                # followers that fell behind the bounded log skip what was dropped
+                seq = max(seq, log.first_seq)
+                # checked before copying, so that no event appended before the end is missed
+                done = log.done
+                # copy, since the log changes while events are being sent
+                if batch := list(islice(log.events, seq - log.first_seq, None)):
+                    yield batch
+                    seq += len(batch)
+                if done:
+                    return
+                # events appended while the batch was being sent are followed right away
+                if log.next_seq == seq:
+                    await log.wait(poll_interval)
+                    if window and log.next_seq > seq and not log.done:
+                        await asyncio.sleep(window)
+                if request is not None and await request.is_disconnected():
+                    return
+        finally:
+            self._detach(log)
+
+    async def follow(self,
+                     log: StreamLog,
+                     after: int = -1,
+                     request: Optional[Request] = None,
+                     poll_interval: float = 1.0,
+                     ) -> AsyncGenerator[SSE, None]:
+        """Yield the events of a stream after seq `after` one by one, see follow_batches."""
+        async with aclosing(self.follow_batches(log, after, request, poll_interval)) as batches:
+            async for batch in batches:
+                for event in batch:
+                    yield event
@@ -0,0 +1,50 @@
+""" Test the in-memory node cache. """
+import time
+
+from articlesa.serve.cache import NodeCache, payload_size
+
+
+def test_get_put() -> None:
+    """Test cached payloads are returned and lookups are counted."""
+    cache = NodeCache(max_items=10, max_bytes=10_000, ttl=60)
+    assert cache.get("a") is None
+    cache.put("a", {"title": "a"})
+    assert cache.get("a") == {"title": "a"}
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert cache.hit_ratio == 0.5
+
+
+def test_lru_eviction() -> None:
+    """Test the least recently used payload is evicted past max_items."""
+    cache = NodeCache(max_items=2, max_bytes=10_000, ttl=60)
+    cache.put("a", {"title": "a"})
+    cache.put("b", {"title": "b"})
+    cache.get("a")
+    cache.put("c", {"title": "c"})
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.get("c") is not None
+
+
+def test_byte_limit() -> None:
+    """Test payloads are evicted to stay under max_bytes, and bytes are tracked."""
+    payload = {"title": "x" * 100}
+    size = payload_size(payload)
+    cache = NodeCache(max_items=10, max_bytes=2 * size, ttl=60)
+    for key in "abc":
+        cache.put(key, payload)
+    assert len(cache) == 2
+    assert cache.bytes == 2 * size
+    cache.put("a", payload)
+    cache.invalidate("a")
+    assert cache.bytes == size
+
+
+def test_ttl_expiry() -> None:
+    """Test payloads older than ttl are not returned."""
+    cache = NodeCache(max_items=10, max_bytes=10_000, ttl=0.01)
+    cache.put("a", {"title": "a"})
+    time.sleep(0.02)
+    assert cache.get("a") is None
+    assert len(cache) == 0
+    assert cache.bytes == 0
@@ -0,0 +1,47 @@
+""" Test the max age policy of stored articles. """
+from datetime import datetime, timedelta, timezone
+
+from articlesa.serve.freshness import FreshnessPolicy, parse_max_age_overrides
+from articlesa.types import ParsedArticle
+
+NOW = datetime(2024, 1, 2, tzinfo=timezone.utc)
+
+
+def make_article(url: str, age: float, aware: bool = True) -> ParsedArticle:
+    """Return an article at url parsed age seconds before NOW, with a naive parsedAtUtc unless aware."""
+    parsed_at = NOW - timedelta(seconds=age)
+    return ParsedArticle(
+        url=url, title="title", text="text", authors=[], links=[], published=None,
+        parsedAtUtc=parsed_at if aware else parsed_at.replace(tzinfo=None),
+    )
+
+
+def test_parse_max_age_overrides() -> None:
+    """Test overrides are parsed with lowercased netlocs, skipping empty entries."""
+    assert parse_max_age_overrides("") == {}
+    assert parse_max_age_overrides(" APNews.com=3600, ,example.com=86400") == {
+        "apnews.com": 3600.0, "example.com": 86400.0,
+    }
+
+
+def test_is_stale_boundary() -> None:
+    """Test an article is fresh up to exactly its max age, and stale past it."""
+    policy = FreshnessPolicy(max_age=60)
+    assert not policy.is_stale(make_article("https://example.com/a", 60), now=NOW)
+    assert policy.is_stale(make_article("https://example.com/a", 60.001), now=NOW)
+
+
+def test_is_stale_naive_parsed_at_is_utc() -> None:
+    """Test a parsedAtUtc without a timezone, as neo4j may return it, is taken as utc."""
+    policy = FreshnessPolicy(max_age=60)
+    assert not policy.is_stale(make_article("https://example.com/a", 59, aware=False), now=NOW)
+    assert policy.is_stale(make_article("https://example.com/a", 61, aware=False), now=NOW)
+
+
+def test_overrides_apply_to_subdomains() -> None:
+    """Test a publisher override covers its subdomains, but not other domains ending alike."""
+    policy = FreshnessPolicy(max_age=3600, overrides={"apnews.com": 60})
+    assert policy.max_age_for("www.APNews.com") == 60
+    assert policy.max_age_for("notapnews.com") == 3600
+    assert policy.is_stale(make_article("https://www.apnews.com/a", 120), now=NOW)
+    assert not policy.is_stale(make_article("https://example.com/a", 120), now=NOW)
@@ -0,0 +1,308 @@
+""" Test which nodes article streams process, which links they skip, and how their events are encoded. """
+import asyncio
+from datetime import datetime, timezone
+import json
+from typing import AsyncGenerator, Optional, cast
+
+from arq import ArqRedis
+from arq.constants import abort_jobs_ss, job_key_prefix, result_key_prefix
+from arq.jobs import Job
+import pytest
+
+from articlesa.neo import ArticleNotFound, Neo4JArticleDriver
+from articlesa.serve import gateway
+from articlesa.serve.cache import NodeCache
+from articlesa.serve.notify import JobNotifier
+from articlesa.serve.writer import ArticleWriteBuffer
+from articlesa.types import SSE, ParsedArticle, StreamEvent, parse_job_id, url_to_hash
+
+ROOT = "https://example.com/root"
+
+
+class FakeDriver:
+    """Stands in for Neo4JArticleDriver, serving fresh articles from a dict."""
+    def __init__(self, links: dict[str, list[str]]) -> None:
+        """Initialize with the links of every article."""
+        self.links = links
+
+    async def get_subtree(self, url: str, max_depth: int, max_nodes: int) -> dict[str, ParsedArticle]:
+        """Return no stored subtree, so every node is retrieved."""
+        return {}
+
+    async def get_article(self, url: str) -> ParsedArticle:
+        """Return the article after a while, so the links published for it are seen first."""
+        await asyncio.sleep(0.01)
+        if url not in self.links:
+            raise ArticleNotFound(url)
+        return ParsedArticle(
+            url=url, title="title", text="text", authors=[], links=self.links[url],
+            published=None, parsedAtUtc=datetime.now(timezone.utc),
+        )
+
+
+class FakeNotifier:
+    """Stands in for JobNotifier, publishing every link of an article as the worker would."""
+    def __init__(self, links: dict[str, list[str]]) -> None:
+        """Initialize with the links of every article."""
+        self.links = {parse_job_id(url): (url, links) for url, links in links.items()}
+
+    def watch_links(self, job_id: str) -> asyncio.Queue:
+        """Return a queue holding every link of the job's article."""
+        queue: asyncio.Queue = asyncio.Queue()
+        url, links = self.links.get(job_id, ("", []))
+        for link in links:
+            queue.put_nowait({"parent": url, "link": link})
+        return queue
+
+    def unwatch_links(self, job_id: str, queue: asyncio.Queue) -> None:
+        """Stop watching nothing."""
+
+
+class FakePipeline:
+    """Stands in for an arq pool pipeline, running its deletes on the pool."""
+    def __init__(self, pool: "FakeArqPool") -> None:
+        """Initialize a pipeline on pool."""
+        self.pool = pool
+
+    async def __aenter__(self) -> "FakePipeline":
+        """Enter the pipeline."""
+        return self
+
+    async def __aexit__(self, *exc_info: object) -> None:
+        """Exit the pipeline."""
+
+    def incr(self, key: str) -> None:
+        """Count nothing."""
+
+    def expire(self, key: str, seconds: int) -> None:
+        """Expire nothing."""
+
+    def delete(self, key: str) -> None:
+        """Delete key from the pool."""
+        self.pool.keys.discard(key)
+
+    async def execute(self) -> list:
+        """Execute nothing more."""
+        return []
+
+
+class FakeArqPool:
+    """Stands in for ArqRedis, refusing to enqueue jobs that exist or whose result is kept, like arq."""
+    def __init__(self, keys: set[str], aborting: Optional[set[str]] = None) -> None:
+        """Initialize with the keys in redis, and the ids of jobs being aborted."""
+        self.keys = keys
+        self.aborting = aborting or set()
+        self.enqueued: list[str] = []
+
+    def pipeline(self, transaction: bool = True) -> FakePipeline:
+        """Return a pipeline."""
+        return FakePipeline(self)
+
+    async def enqueue_job(self, function: str, url: str, trace: dict, _job_id: str, _defer_until: object) -> Optional[Job]:
+        """Enqueue a job, unless its result is kept."""
+        if {job_key_prefix + _job_id, result_key_prefix + _job_id} & self.keys:
+            return None
+        self.enqueued.append(_job_id)
+        return Job(_job_id, cast(ArqRedis, self))
+
+    async def zrem(self, key: str, job_id: str) -> int:
+        """Stop aborting a job, returning if it was being aborted."""
+        assert key == abort_jobs_ss
+        removed = job_id in self.aborting
+        self.aborting.discard(job_id)
+        return int(removed)
+
+    async def decr(self, key: str) -> int:
+        """Return that nobody else waits on the job."""
+        return 0
+
+
+class FakeWriter:
+    """Stands in for ArticleWriteBuffer, writing nothing."""
+    def put(self, parsed_article: ParsedArticle, parent_url: Optional[str] = None) -> None:
+        """Write nothing."""
+
+
+class FakeJobNotifier:
+    """Stands in for JobNotifier, every job having parsed its article."""
+    async def wait(self, job: Job) -> dict:
+        """Return the parsed article."""
+        return ParsedArticle(
+            url=ROOT, title="title", text="text", authors=[], links=[],
+            published=None, parsedAtUtc=datetime.now(timezone.utc),
+        ).model_dump()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("refresh", [False, True])
+async def test_refresh_discards_kept_job_result(refresh: bool) -> None:
+    """Test a refresh parses the article again though arq kept the result of an earlier parse."""
+    job_id = parse_job_id(ROOT)
+    pool = FakeArqPool({result_key_prefix + job_id})
+    await gateway._parse_article(
+        ROOT, cast(ArqRedis, pool), cast(JobNotifier, FakeJobNotifier()), cast(ArticleWriteBuffer, FakeWriter()),
+        refresh=refresh,
+    )
+    assert pool.enqueued == ([job_id] if refresh else [])
+
+
+@pytest.mark.asyncio
+async def test_joining_job_takes_back_its_abort() -> None:
+    """Test a stream joining a queued job that's being aborted keeps it from being aborted."""
+    job_id = parse_job_id(ROOT)
+    pool = FakeArqPool({job_key_prefix + job_id}, aborting={job_id})
+    await gateway._parse_article(
+        ROOT, cast(ArqRedis, pool), cast(JobNotifier, FakeJobNotifier()), cast(ArticleWriteBuffer, FakeWriter()),
+    )
+    assert pool.enqueued == []
+    assert pool.aborting == set()
+
+
+async def stream(links: dict[str, list[str]],
+                 max_depth: int = 2,
+                 max_nodes: int = 100,
+                 max_fanout: Optional[list[int]] = None,
+                 ) -> tuple[list[dict], dict]:
+    """Stream ROOT, returning the data of its node events and of its end event."""
+    events = [event async for event in gateway._article_stream(
+        ROOT, max_depth,
+        cast(ArqRedis, None), cast(Neo4JArticleDriver, FakeDriver(links)),
+        cast(JobNotifier, FakeNotifier(links)), cast(ArticleWriteBuffer, None),
+        max_nodes=max_nodes, max_fanout=max_fanout or [], background=True,
+    )]
+    assert events[-1].event == StreamEvent.STREAM_END.value
+    nodes = [
+        {"event": event.event, **json.loads(event.data)} for event in events
+        if event.event in gateway.BATCHED_EVENTS
+    ]
+    return nodes, json.loads(events[-1].data)
+
+
+def rendered(nodes: list[dict]) -> set[str]:
+    """Return the urls of rendered nodes."""
+    return {node["url"] for node in nodes if node["event"] == StreamEvent.NODE_RENDER.value}
+
+
+@pytest.fixture(autouse=True)
+def node_cache(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Give each test an empty node cache."""
+    monkeypatch.setattr(gateway, "cache", NodeCache())
+
+
+@pytest.mark.asyncio
+async def test_links_to_one_article_make_one_node() -> None:
+    """Test links normalizing to the same url are processed once, and further links only add edges."""
+    links = {
+        ROOT: ["https://example.com/a", "http://EXAMPLE.com/a/?utm_source=x", "https://example.com/b"],
+        "https://example.com/a": [],
+        "https://example.com/b": ["https://example.com/a#comments", ROOT],
+    }
+    nodes, end = await stream(links)
+    assert rendered(nodes) == {ROOT, "https://example.com/a", "https://example.com/b"}
+    processing = [node["urlhash"] for node in nodes if node["event"] == StreamEvent.NODE_PROCESSING.value]
+    assert len(processing) == len(set(processing)) == 3
+    node_links = {
+        (node["parent"], node["urlhash"]) for node in nodes if node["event"] == StreamEvent.NODE_LINK.value
+    }
+    b = url_to_hash("https://example.com/b")
+    assert node_links == {(b, url_to_hash("https://example.com/a")), (b, url_to_hash(ROOT))}
+    assert end == {"nodes": 3, "skipped": 0}
+
+
+@pytest.mark.asyncio
+async def test_fanout_limit_counts_each_skipped_link_once() -> None:
+    """Test a link over the fan-out limit is skipped, and counted once though it's seen twice."""
+    links = {ROOT: ["https://example.com/a", "https://example.com/b"], "https://example.com/a": []}
+    nodes, end = await stream(links, max_fanout=[1])
+    assert rendered(nodes) == {ROOT, "https://example.com/a"}
+    assert end == {"nodes": 2, "skipped": 1}
+
+
+@pytest.mark.asyncio
+async def test_fanout_limit_per_depth() -> None:
+    """Test each depth has its own fan-out limit, the last one applying deeper too."""
+    links = {
+        ROOT: ["https://example.com/a", "https://example.com/b", "https://example.com/c"],
+        "https://example.com/a": ["https://example.com/a1", "https://example.com/a2"],
+        "https://example.com/b": ["https://example.com/b1", "https://example.com/b2"],
+        "https://example.com/a1": ["https://example.com/a1x", "https://example.com/a1y"],
+        "https://example.com/b1": [],
+        "https://example.com/a1x": [],
+    }
+    nodes, end = await stream(links, max_depth=3, max_fanout=[2, 1])
+    assert rendered(nodes) == {
+        ROOT, "https://example.com/a", "https://example.com/b",
+        "https://example.com/a1", "https://example.com/b1", "https://example.com/a1x",
+    }
+    assert end == {"nodes": 6, "skipped": 4}
+
+
+@pytest.mark.asyncio
+async def test_max_nodes_limit() -> None:
+    """Test no more than max_nodes nodes are processed, further links being skipped."""
+    links = {ROOT: [f"https://example.com/{i}" for i in range(5)]}
+    links.update({link: [] for link in links[ROOT]})
+    nodes, end = await stream(links, max_nodes=3)
+    assert rendered(nodes) == {ROOT, "https://example.com/0", "https://example.com/1"}
+    assert end == {"nodes": 3, "skipped": 3}
+
+
+@pytest.mark.asyncio
+async def test_empty_fanout_limits_means_no_limit() -> None:
+    """Test a stream without fan-out limits processes every link."""
+    links = {ROOT: [f"https://example.com/{i}" for i in range(5)]}
+    links.update({link: [] for link in links[ROOT]})
+    nodes, end = await stream(links)
+    assert len(rendered(nodes)) == 6
+    assert end == {"nodes": 6, "skipped": 0}
+
+
+def test_dump_json_matches_safe_encoder() -> None:
+    """Test dump_json encodes payloads, datetimes included, like SafeEncoder."""
+    payload = {"url": ROOT, "links": [ROOT], "published": None, "parsedAtUtc": datetime(2024, 1, 1, 12, 30)}
+    assert json.loads(gateway.dump_json(payload)) == json.loads(json.dumps(payload, cls=gateway.SafeEncoder))
+
+
+async def coalesce(batches: list[list[tuple[StreamEvent, str]]], max_events: int) -> list[tuple[str, str, list]]:
+    """Coalesce batches of (event, id), returning the event, id and batched (event, id) of each sent event."""
+    async def follow() -> AsyncGenerator[list[SSE], None]:
+        for batch in batches:
+            yield [gateway.build_event({"id": id}, id, event) for event, id in batch]
+
+    sent = []
+    async for event in gateway._coalesce(follow(), max_events=max_events):
+        data = json.loads(event.data)
+        items = [(item["event"], item["data"]["id"]) for item in data] if isinstance(data, list) else []
+        sent.append((event.event, event.id, items))
+    return sent
+
+
+@pytest.mark.asyncio
+async def test_coalesce_batches_runs_of_node_events() -> None:
+    """Test runs of node events become node_batch events with the id of their last event, in order."""
+    render, link, begin = StreamEvent.NODE_RENDER, StreamEvent.NODE_LINK, StreamEvent.STREAM_BEGIN
+    sent = await coalesce([
+        [(begin, "0"), (render, "1"), (link, "2"), (render, "3")],
+        [(link, "4")],
+        [(render, "5"), (begin, "6"), (link, "7"), (link, "8")],
+    ], max_events=10)
+    assert sent == [
+        (begin.value, "0", []),
+        (StreamEvent.NODE_BATCH.value, "3", [(render.value, "1"), (link.value, "2"), (render.value, "3")]),
+        (link.value, "4", []),
+        (render.value, "5", []),
+        (begin.value, "6", []),
+        (StreamEvent.NODE_BATCH.value, "8", [(link.value, "7"), (link.value, "8")]),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_coalesce_splits_runs_at_max_events() -> None:
+    """Test a run longer than max_events is split into node_batch events of at most max_events."""
+    render = StreamEvent.NODE_RENDER
+    sent = await coalesce([[(render, str(i)) for i in range(5)]], max_events=2)
+    assert [(event, id, len(items)) for event, id, items in sent] == [
+        (StreamEvent.NODE_BATCH.value, "1", 2),
+        (StreamEvent.NODE_BATCH.value, "3", 2),
+        (render.value, "4", 0),
+    ]
@@ -0,0 +1,199 @@
+""" Test waking job waiters through pub/sub, and the fallback status polling. """
+import asyncio
+import json
+from types import SimpleNamespace
+from typing import AsyncIterator, Optional, Union, cast
+
+from arq.jobs import Job, JobStatus, ResultNotFound
+import pytest
+from redis.asyncio import Redis
+from redis.exceptions import ConnectionError
+
+from articlesa.serve.notify import JobAborted, JobNotifier
+from articlesa.types import JOB_COMPLETE_CHANNEL, LINKS_CHANNEL_PREFIX
+
+
+class FakePubSub:
+    """Delivers what FakeRedis publishes, like a subscribed redis PubSub."""
+    def __init__(self) -> None:
+        """Initialize with no messages."""
+        self.messages: asyncio.Queue[Union[dict, Exception]] = asyncio.Queue()
+
+    async def subscribe(self, channel: str) -> None:
+        """Subscribe to nothing, every message is delivered."""
+
+    async def psubscribe(self, pattern: str) -> None:
+        """Subscribe to nothing, every message is delivered."""
+
+    async def listen(self) -> AsyncIterator[dict]:
+        """Yield published messages, raising any exception put in their place."""
+        while True:
+            message = await self.messages.get()
+            if isinstance(message, Exception):
+                raise message
+            yield message
+
+    async def reset(self) -> None:
+        """Reset nothing."""
+
+    async def aclose(self) -> None:
+        """Close nothing."""
+
+
+class FakeRedis:
+    """Publishes messages to its one FakePubSub."""
+    def __init__(self) -> None:
+        """Initialize with a pub/sub connection."""
+        self.pubsub_connection = FakePubSub()
+
+    def pubsub(self, ignore_subscribe_messages: bool = False) -> FakePubSub:
+        """Return the pub/sub connection."""
+        return self.pubsub_connection
+
+    def publish(self, channel: str, data: str) -> None:
+        """Publish data, as a job completion or a link like the workers do."""
+        if channel == JOB_COMPLETE_CHANNEL:
+            message = {"type": "message", "channel": channel.encode(), "data": data.encode()}
+        else:
+            message = {"type": "pmessage", "channel": channel.encode(), "data": data.encode()}
+        self.pubsub_connection.messages.put_nowait(message)
+
+
+class FakeJob:
+    """An arq job that completes when told to, counting its status checks."""
+    def __init__(self, job_id: str, result: object = "parsed", gone: bool = False) -> None:
+        """Initialize a job that hasn't completed, or that's gone with its result if gone is set."""
+        self.job_id = job_id
+        self.result_value = result
+        self.complete = False
+        self.gone = gone
+        self.status_checks = 0
+
+    async def status(self) -> JobStatus:
+        """Return the job status."""
+        self.status_checks += 1
+        if self.gone:
+            return JobStatus.not_found
+        return JobStatus.complete if self.complete else JobStatus.in_progress
+
+    async def result_info(self) -> Optional[SimpleNamespace]:
+        """Return the job result, if it has one."""
+        if self.gone:
+            return None
+        return SimpleNamespace(result=self.result_value, success=True)
+
+    async def result(self) -> object:
+        """Raise that the job has no result, as arq does once it's gone."""
+        raise ResultNotFound("not waiting for job result because the job is not in queue")
+
+
+async def start_notifier(redis: FakeRedis, fallback_interval: float) -> JobNotifier:
+    """Return a started notifier on redis, retrying to resubscribe quickly."""
+    notifier = JobNotifier(cast(Redis, redis), fallback_interval=fallback_interval, retry_interval=0.01)
+    await notifier.start()
+    return notifier
+
+
+@pytest.mark.asyncio
+async def test_wait_is_woken_by_completion_message() -> None:
+    """Test a waiter wakes as soon as the job completion is published, without polling."""
+    redis = FakeRedis()
+    notifier = await start_notifier(redis, fallback_interval=10)
+    job = FakeJob("a")
+    waiter = asyncio.create_task(notifier.wait(cast(Job, job)))
+    await asyncio.sleep(0.01)
+    job.complete = True
+    redis.publish(JOB_COMPLETE_CHANNEL, job.job_id)
+    assert await asyncio.wait_for(waiter, timeout=1) == "parsed"
+    assert job.status_checks == 2  # once before waiting, once after being woken
+    await notifier.stop()
+
+
+@pytest.mark.asyncio
+async def test_wait_falls_back_to_polling() -> None:
+    """Test a waiter whose completion message is missed finds the job complete by polling."""
+    redis = FakeRedis()
+    notifier = await start_notifier(redis, fallback_interval=0.05)
+    job = FakeJob("a")
+    waiter = asyncio.create_task(notifier.wait(cast(Job, job)))
+    await asyncio.sleep(0.01)
+    job.complete = True
+    assert await asyncio.wait_for(waiter, timeout=1) == "parsed"
+    assert job.status_checks >= 2
+    assert not notifier._waiters
+    await notifier.stop()
+
+
+@pytest.mark.asyncio
+async def test_wait_raises_for_aborted_job() -> None:
+    """Test waiting on an aborted job raises JobAborted rather than being cancelled."""
+    redis = FakeRedis()
+    notifier = await start_notifier(redis, fallback_interval=10)
+    job = FakeJob("a", result=asyncio.CancelledError())
+    job.complete = True
+    with pytest.raises(JobAborted):
+        await notifier.wait(cast(Job, job))
+    await notifier.stop()
+
+
+@pytest.mark.asyncio
+async def test_wait_raises_for_job_gone_without_result() -> None:
+    """Test waiting on a job whose result expired raises ResultNotFound rather than polling forever."""
+    redis = FakeRedis()
+    notifier = await start_notifier(redis, fallback_interval=10)
+    job = FakeJob("a", gone=True)
+    with pytest.raises(ResultNotFound):
+        await asyncio.wait_for(notifier.wait(cast(Job, job)), timeout=1)
+    assert job.status_checks == 1
+    await notifier.stop()
+
+
+@pytest.mark.asyncio
+async def test_watch_links() -> None:
+    """Test links published for a job are delivered to its watchers until they unwatch."""
+    redis = FakeRedis()
+    notifier = await start_notifier(redis, fallback_interval=10)
+    queue = notifier.watch_links("a")
+    link = {"parent": "https://example.com/", "link": "https://example.com/child"}
+    redis.publish(LINKS_CHANNEL_PREFIX + "a", json.dumps(link))
+    redis.publish(LINKS_CHANNEL_PREFIX + "b", json.dumps(link))
+    assert await asyncio.wait_for(queue.get(), timeout=1) == link
+    notifier.unwatch_links("a", queue)
+    redis.publish(LINKS_CHANNEL_PREFIX + "a", json.dumps(link))
+    await asyncio.sleep(0.01)
+    assert queue.empty()
+    await notifier.stop()
+
+
+@pytest.mark.asyncio
+async def test_lost_subscription_is_retried_until_redis_is_back() -> None:
+    """Test the listener survives resubscribing failing, and delivers later completions."""
+    redis = FakeRedis()
+    notifier = await start_notifier(redis, fallback_interval=10)
+    subscribe = notifier._subscribe
+    attempts = 0
+
+    async def flaky_subscribe() -> None:
+        nonlocal attempts
+        attempts += 1
+        if attempts == 1:
+            raise ConnectionError("still down")
+        await subscribe()
+
+    notifier._subscribe = flaky_subscribe  # type: ignore[method-assign]
+    redis.pubsub_connection.messages.put_nowait(ConnectionError("connection lost"))
+
+    async def resubscribed() -> None:
+        while attempts < 2:
+            await asyncio.sleep(0.01)
+
+    await asyncio.wait_for(resubscribed(), timeout=1)
+    assert notifier._listener is not None and not notifier._listener.done()
+    job = FakeJob("a")
+    waiter = asyncio.create_task(notifier.wait(cast(Job, job)))
+    await asyncio.sleep(0.01)
+    job.complete = True
+    redis.publish(JOB_COMPLETE_CHANNEL, job.job_id)
+    assert await asyncio.wait_for(waiter, timeout=1) == "parsed"
+    assert job.status_checks == 2
+    await notifier.stop()
@@ -0,0 +1,70 @@
+""" Test coalescing concurrent calls with SingleFlight. """
+import asyncio
+
+import pytest
+
+from articlesa.serve.singleflight import SingleFlight
+
+
+class SlowCall:
+    """A call that takes a while, counting how often it was made and cancelled."""
+    def __init__(self, seconds: float = 0.05) -> None:
+        """Initialize a call taking seconds."""
+        self.seconds = seconds
+        self.calls = 0
+        self.cancelled = 0
+
+    async def __call__(self) -> str:
+        """Return "result" after a while."""
+        self.calls += 1
+        try:
+            await asyncio.sleep(self.seconds)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        return "result"
+
+
+@pytest.mark.asyncio
+async def test_concurrent_callers_share_one_call() -> None:
+    """Test concurrent callers of a key share one call, and a later caller makes a new one."""
+    flight: SingleFlight[str] = SingleFlight()
+    call = SlowCall()
+    results = await asyncio.gather(*[flight.do("a", call) for _ in range(3)])
+    assert results == ["result"] * 3
+    assert call.calls == 1
+    assert "a" not in flight
+    assert await flight.do("a", call) == "result"
+    assert call.calls == 2
+
+
+@pytest.mark.asyncio
+async def test_cancelled_caller_does_not_cancel_others() -> None:
+    """Test a caller being cancelled leaves the call running for the others."""
+    flight: SingleFlight[str] = SingleFlight()
+    call = SlowCall()
+    cancelled = asyncio.create_task(flight.do("a", call))
+    waiting = asyncio.create_task(flight.do("a", call))
+    await asyncio.sleep(0.01)
+    cancelled.cancel()
+    assert await waiting == "result"
+    assert cancelled.cancelled()
+    assert (call.calls, call.cancelled) == (1, 0)
+
+
+@pytest.mark.asyncio
+async def test_last_cancelled_caller_cancels_call() -> None:
+    """Test the call is cancelled once every caller has been cancelled."""
+    flight: SingleFlight[str] = SingleFlight()
+    call = SlowCall()
+    callers = [asyncio.create_task(flight.do("a", call)) for _ in range(2)]
+    await asyncio.sleep(0.01)
+    callers[0].cancel()
+    await asyncio.sleep(0.01)
+    assert call.cancelled == 0
+    callers[1].cancel()
+    await asyncio.gather(*callers, return_exceptions=True)
+    await asyncio.sleep(0)
+    assert call.cancelled == 1
+    assert "a" not in flight
+    assert not flight._callers
@@ -0,0 +1,68 @@
+""" Test resumable stream logs. """
+import asyncio
+from typing import AsyncGenerator
+
+import pytest
+
+from articlesa.serve.streams import StreamLog, StreamRegistry
+from articlesa.types import SSE, StreamEvent
+
+
+async def produce(count: int) -> AsyncGenerator[SSE, None]:
+    """Produce count render events, slowly."""
+    for i in range(count):
+        yield SSE(data=str(i), id="", event=StreamEvent.NODE_RENDER.value)
+        await asyncio.sleep(0.01)
+
+
+@pytest.mark.asyncio
+async def test_resume_replays_missed_events() -> None:
+    """Test a reconnect with Last-Event-ID gets only the events after it."""
+    streams = StreamRegistry(grace=1, retention=1, max_events=100)
+    log = streams.start("a", produce(5))
+    follower = streams.follow(log)
+    first = [await follower.__anext__() for _ in range(2)]
+    await follower.aclose()
+    assert first[-1].id == f"{log.stream_id}:1"
+    assert streams.resume(first[-1].id, "b") is None
+    resumed = streams.resume(first[-1].id, "a")
+    assert resumed is not None
+    rest = [event.data async for event in streams.follow(*resumed)]
+    assert rest == ["2", "3", "4"]
+
+
+@pytest.mark.asyncio
+async def test_abandoned_stream_is_cancelled() -> None:
+    """Test a stream nobody follows past the grace period is cancelled and can't be resumed."""
+    streams = StreamRegistry(grace=0.01, retention=1, max_events=100)
+    log = streams.start("a", produce(100))
+    follower = streams.follow(log)
+    event = await follower.__anext__()
+    await follower.aclose()
+    await asyncio.sleep(0.1)
+    assert log.producer is not None and log.producer.cancelled()
+    assert streams.resume(event.id, "a") is None
+
+
+@pytest.mark.asyncio
+async def test_follow_batches_coalesces_events() -> None:
+    """Test events appended within the window are followed as one batch, in order."""
+    streams = StreamRegistry(grace=1, retention=1, max_events=100)
+    log = streams.start("a", produce(5))
+    batches = [[event.data for event in batch] async for batch in streams.follow_batches(log, window=0.1)]
+    assert [data for batch in batches for data in batch] == ["0", "1", "2", "3", "4"]
+    assert len(batches) < 5
+
+
+@pytest.mark.asyncio
+async def test_events_appended_during_a_batch_are_followed_right_away() -> None:
+    """Test events appended while a batch is being sent are followed without waiting to poll."""
+    streams = StreamRegistry(grace=1, retention=1, max_events=100)
+    log = StreamLog("s", "a", max_events=100)
+    batches = streams.follow_batches(log, poll_interval=10)
+    log.append(SSE(data="0", id="", event=StreamEvent.NODE_RENDER.value))
+    assert [event.data for event in await batches.__anext__()] == ["0"]
+    log.append(SSE(data="1", id="", event=StreamEvent.NODE_RENDER.value))
+    batch = await asyncio.wait_for(batches.__anext__(), timeout=1)
+    assert [event.data for event in batch] == ["1"]
+    await batches.aclose()
@@ -0,0 +1,63 @@
+""" Test the article write buffer. """
+import asyncio
+from datetime import datetime
+from typing import Optional, Sequence, cast
+
+import pytest
+
+from articlesa.neo import Neo4JArticleDriver
+from articlesa.serve.writer import ArticleWriteBuffer
+from articlesa.types import ParsedArticle
+
+
+class SlowDriver:
+    """Stands in for Neo4JArticleDriver, taking a while to write each batch."""
+    def __init__(self, seconds: float) -> None:
+        """Initialize a driver that has written nothing."""
+        self.seconds = seconds
+        self.written: list[str] = []
+
+    async def put_articles(self, batch: Sequence[tuple[ParsedArticle, Optional[str]]]) -> None:
+        """Write a batch after a while."""
+        await asyncio.sleep(self.seconds)
+        self.written.extend(article.url for article, _ in batch)
+
+
+def make_article(i: int) -> ParsedArticle:
+    """Return an article with a url numbered i."""
+    return ParsedArticle(
+        url=f"https://example.com/{i}", title="title", text="text", authors=[], links=[],
+        published=None, parsedAtUtc=datetime(2024, 1, 1),
+    )
+
+
+@pytest.mark.asyncio
+async def test_stop_during_flush_writes_every_article() -> None:
+    """Test stopping the buffer while a flush is writing loses none of its batches."""
+    driver = SlowDriver(seconds=0.05)
+    writer = ArticleWriteBuffer(cast(Neo4JArticleDriver, driver), batch_size=1, flush_interval=10)
+    await writer.start()
+    for i in range(3):
+        writer.put(make_article(i))
+    await asyncio.sleep(0.01)  # the flush of the 3 batches is writing the first
+    await writer.stop()
+    assert driver.written == [f"https://example.com/{i}" for i in range(3)]
+    assert (writer.written, len(writer)) == (3, 0)
+
+
+@pytest.mark.asyncio
+async def test_cancelled_flush_requeues_unwritten_articles() -> None:
+    """Test articles a cancelled flush didn't write are put back in the buffer, ahead of newer ones."""
+    driver = SlowDriver(seconds=0.05)
+    writer = ArticleWriteBuffer(cast(Neo4JArticleDriver, driver), batch_size=1, flush_interval=10)
+    for i in range(3):
+        writer.put(make_article(i))
+    flush = asyncio.create_task(writer.flush())
+    await asyncio.sleep(0.07)  # the first batch is written, the second is writing
+    writer.put(make_article(3))
+    flush.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await flush
+    assert driver.written == ["https://example.com/0"]
+    await writer.flush()
+    assert driver.written == [f"https://example.com/{i}" for i in range(4)]
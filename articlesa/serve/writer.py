@@ -0,0 +1,100 @@
+"""
+articlesa.serve.writer module.
+
+writer buffers article writes behind the gateway, so that streams don't wait
+on neo4j commits and many small writes are flushed as one batched transaction.
+"""
+
+import asyncio
+import time
+from typing import Optional
+
+from articlesa.config import Neo4JConfig
+from articlesa.logger import logger
+from articlesa.metrics import articles_written, write_errors
+from articlesa.neo import Neo4JArticleDriver
+from articlesa.trace import carrier, record
+from articlesa.types import ParsedArticle
+
+
+class ArticleWriteBuffer:
+    """
+    ArticleWriteBuffer collects articles and flushes them with put_articles.
+
+    A flush happens once `batch_size` articles are pending, or every
+    `flush_interval` seconds otherwise. Failed batches are logged and counted
+    in `errors`, they are not retried. A flush that is cancelled puts the
+    articles it didn't get to write back in the buffer. Each write is traced under the trace
+    the article was put from, see articlesa.trace.
+    """
+    def __init__(self,
+                 neodriver: Neo4JArticleDriver,
+                 batch_size: int = Neo4JConfig.write_batch_size,
+                 flush_interval: float = Neo4JConfig.write_flush_interval,
+                 ) -> None:
+        """Initialize buffer, call start() to begin flushing."""
+        self.neodriver = neodriver
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.written = 0
+        self.errors = 0
+        # (article, parent_url, trace carrier) of every article waiting to be written
+        self._pending: list[tuple[ParsedArticle, Optional[str], Optional[dict]]] = []
+        self._full = asyncio.Event()
+        self._stopping = False
+        self._flusher: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        """Return the number of articles waiting to be written."""
+        return len(self._pending)
+
+    def put(self, parsed_article: ParsedArticle, parent_url: Optional[str] = None) -> None:
+        """Queue an article for writing, see Neo4JArticleDriver.put_article."""
+        self._pending.append((parsed_article, parent_url, carrier()))
+        if len(self._pending) >= self.batch_size:
+            self._full.set()
+
+    async def start(self) -> None:
+        """Start the background flush loop."""
+        self._flusher = asyncio.create_task(self._run())
+        self._flusher.set_name("article-write-buffer")
+
+    async def stop(self) -> None:
+        """Stop the flush loop, letting a flush in progress finish, and write whatever is still pending."""
+        self._stopping = True
+        if self._flusher:
+            self._full.set()
+            await self._flusher
+        await self.flush()
+
+    async def _run(self) -> None:
+        """Flush whenever the buffer fills up or the interval elapses, until stopped."""
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._full.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._full.clear()
+            await self.flush()
+
+    async def flush(self) -> None:
+        """Write all pending articles, at most batch_size per transaction."""
+        pending, self._pending = self._pending, []
+        for i in range(0, len(pending), self.batch_size):
+            batch = pending[i:i + self.batch_size]
+            started = time.time()
+            try:
+                await self.neodriver.put_articles([(article, parent_url) for article, parent_url, _ in batch])
+            except asyncio.CancelledError:
+                # writes are merges, so the interrupted batch is safe to write again
+                self._pending[:0] = pending[i:]
+                raise
+            except Exception as e:
+                self.errors += 1
+                write_errors.inc()
+                logger.opt(exception=e).error(f"error writing batch of {len(batch)} articles into db")
+                continue
+            for _, _, trace in batch:
+                record("neo4j_write", started, time.time(), parent=trace, articles=len(batch))
+            self.written += len(batch)
+            articles_written.inc(len(batch))
@@ -1,18 +1,28 @@
-""" mocks nonsense articles in a deterministic way. """
+"""
+mocks nonsense articles in a deterministic way.
 
+The shape of the synthetic web, how many links articles have, how slow and
+unreliable it is, and how many links redirect or point at articles linked
+from elsewhere too, is set through MockConfig. The same config always serves
+the same web.
+"""
+
+import asyncio
 from pathlib import Path
 import random
 
-from fastapi import FastAPI
-from fastapi.responses import HTMLResponse
+from fastapi import FastAPI, Response
+from fastapi.responses import HTMLResponse, RedirectResponse
 from jinja2 import Template
 from newspaper.text import StopWords
 
+from articlesa.config import MockConfig
+
 
 app = FastAPI()
 
 
-words_file = Path("/usr/share/dict/words")
+words_file = Path(MockConfig.words_file)
 words = words_file.read_text().splitlines()
 
 stop_words = StopWords().STOP_WORDS
@@ -40,20 +50,53 @@ article_template = Template("""\
 """)
 
 
-@app.get("/articles/{article_id}", response_class=HTMLResponse)
+def seeded(*parts: str) -> random.Random:
+    """Return a random generator seeded from MockConfig.seed and parts."""
+    return random.Random(":".join((MockConfig.seed, *parts)) if MockConfig.seed else ":".join(parts))
+
+
+async def delay(article_id: str) -> None:
+    """Wait out the configured latency of a response."""
+    if MockConfig.latency or MockConfig.latency_jitter:
+        jitter = seeded(article_id, "latency").random() * MockConfig.latency_jitter
+        await asyncio.sleep(MockConfig.latency + jitter)
+
+
+def link_path(rng: random.Random) -> str:
+    """Pick the path of a link, to a new or shared article, maybe through a redirect."""
+    if rng.random() < MockConfig.duplicate_ratio:
+        new_article_id = f"shared{rng.randrange(MockConfig.duplicate_pool)}"
+    else:
+        new_article_id = rng.randbytes(8).hex()
+    if rng.random() < MockConfig.redirect_ratio:
+        return f"/r/{new_article_id}"
+    return f"/articles/{new_article_id}"
+
+
+@app.api_route("/r/{article_id}", methods=["GET", "HEAD"])
+async def redirect_article(article_id: str) -> Response:
+    """Redirect to the article with article_id."""
+    await delay(article_id)
+    return RedirectResponse(f"/articles/{article_id}", status_code=301)
+
+
+@app.api_route("/articles/{article_id}", methods=["GET", "HEAD"], response_class=HTMLResponse)
 async def random_article(article_id: str) -> HTMLResponse:
     """Make and return a random article initialized from article_id in path."""
-    random.seed(article_id)
+    await delay(article_id)
+    if seeded(article_id, "error").random() < MockConfig.error_rate:
+        return HTMLResponse(content="mock failure", status_code=500)
+    rng = seeded(article_id)
+    link_rng = seeded(article_id, "links")
     n_words = 200
-    article_authors = f"Alex Cannan, {' '.join(random.sample(words, 2)).title()}"
-    article_words = random.sample(words, n_words)
-    article_words += random.sample(stop_words, 10)
-    random.shuffle(article_words)
-    n_links = random.randint(1, 5)  # noqa: S311
-    link_indices = random.sample(range(n_words), n_links)
+    article_authors = f"Alex Cannan, {' '.join(rng.sample(words, 2)).title()}"
+    article_words = rng.sample(words, n_words)
+    article_words += rng.sample(stop_words, 10)
+    rng.shuffle(article_words)
+    n_links = rng.randint(MockConfig.min_links, MockConfig.max_links)
+    link_indices = rng.sample(range(n_words), n_links)
     for link_index in link_indices:
-        new_article_id = random.randbytes(8).hex()
-        article_words[link_index] = f'<a href="/articles/{new_article_id}">{article_words[link_index]}</a>'
+        article_words[link_index] = f'<a href="{link_path(link_rng)}">{article_words[link_index]}</a>'
     article_text = " ".join(article_words)
     article_html = article_template.render(
         article_id=article_id,
@@ -0,0 +1,304 @@
+"""
+articlesa.test.loadtest measures the whole system on the synthetic web of articlemock.
+
+It starts the mock web, a gateway and a worker as subprocesses, opens
+concurrent article streams through the gateway, and reports nodes rendered per
+second, time to first render, node latency percentiles and the peak memory of
+each process. Redis and neo4j must already be running locally, e.g. with
+`docker compose up redis neo4j`.
+
+The mock web is served from one host, so the worker is started with per-host
+limits high enough not to bound the run, set with --host-concurrency and
+--host-min-interval and recorded in the report's config like every option.
+
+Results are written as json, so they can be kept as a baseline and later runs
+compared against it:
+
+    python -m articlesa.test.loadtest --streams 8 --depth 2 --output loadtest_baseline.json
+    python -m articlesa.test.loadtest --streams 8 --depth 2 --compare loadtest_baseline.json
+"""
+
+import argparse
+import asyncio
+from contextlib import AsyncExitStack, asynccontextmanager
+import json
+import os
+from pathlib import Path
+import subprocess
+import sys
+import tempfile
+import time
+from typing import AsyncIterator, Optional
+
+from aiohttp import ClientSession, ClientTimeout
+
+from articlesa.logger import logger
+
+
+def percentile(values: list[float], fraction: float) -> Optional[float]:
+    """Return the nearest-rank percentile of values, None if there are none."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))]
+
+
+def process_tree_rss(pid: int) -> int:
+    """Return the resident memory in bytes of a process and all its descendants, 0 if it's gone."""
+    try:
+        status = Path(f"/proc/{pid}/status").read_text()
+        children = Path(f"/proc/{pid}/task/{pid}/children").read_text().split()
+    except OSError:
+        return 0
+    rss = 0
+    for line in status.splitlines():
+        if line.startswith("VmRSS:"):
+            rss = int(line.split()[1]) * 1024
+    return rss + sum(process_tree_rss(int(child)) for child in children)
+
+
+class Service:
+    """A subprocess of the system under test, with its peak memory sampled while it runs."""
+    def __init__(self, name: str, argv: list[str], env: dict[str, str], log_dir: Path) -> None:
+        """Initialize service; nothing runs until started."""
+        self.name = name
+        self.argv = argv
+        self.env = env
+        self.log_path = log_dir / f"{name}.log"
+        self.peak_rss = 0
+        self._process: Optional[subprocess.Popen] = None
+
+    def start(self) -> None:
+        """Start the subprocess, logging to log_path."""
+        with self.log_path.open("w") as log_file:
+            self._process = subprocess.Popen(  # noqa: S603
+                self.argv, env={**os.environ, **self.env}, stdout=log_file, stderr=subprocess.STDOUT
+            )
+
+    def sample(self) -> None:
+        """Record the current memory of the process tree, if it's the most so far."""
+        if self._process is not None:
+            self.peak_rss = max(self.peak_rss, process_tree_rss(self._process.pid))
+
+    def stop(self) -> None:
+        """Terminate the subprocess."""
+        if self._process is not None:
+            self._process.terminate()
+            try:
+                self._process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self._process.kill()
+
+
+async def wait_for_url(session: ClientSession, url: str, timeout: float = 30) -> None:
+    """Wait until url answers at all."""
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            async with session.get(url):
+                return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            await asyncio.sleep(0.2)
+
+
+@asynccontextmanager
+async def running(services: list[Service], interval: float = 0.2) -> AsyncIterator[None]:
+    """Run services, sampling their memory every interval seconds."""
+    async def _sample() -> None:
+        while True:
+            for service in services:
+                service.sample()
+            await asyncio.sleep(interval)
+
+    for service in services:
+        service.start()
+    sampler = asyncio.create_task(_sample())
+    try:
+        yield
+    finally:
+        sampler.cancel()
+        for service in services:
+            service.stop()
+
+
+class StreamStats:
+    """Timings of one article stream, in seconds since it was requested."""
+    def __init__(self) -> None:
+        """Initialize stats of a stream that hasn't started."""
+        self.first_render: Optional[float] = None
+        self.end: Optional[float] = None
+        self.node_latencies: list[float] = []
+        self.renders = 0
+        self.failures = 0
+        self.links = 0
+
+
+async def run_stream(session: ClientSession, url: str) -> StreamStats:
+    """Follow one article stream to its end, timing each node from processing to render."""
+    stats = StreamStats()
+    started = time.monotonic()
+    processing: dict[str, float] = {}
+    event, data = "", ""
+    async with session.get(url) as response:
+        response.raise_for_status()
+        async for raw_line in response.content:
+            line = raw_line.decode().rstrip("\r\n")
+            if line.startswith("event:"):
+                event = line.removeprefix("event:").strip()
+            elif line.startswith("data:"):
+                data = line.removeprefix("data:").strip()
+            elif line or not event:
+                continue
+            else:
+                now = time.monotonic() - started
+                payload = json.loads(data) if data else {}
+                # batched streams send node events as lists of {"event", "data"}
+                received = [(item["event"], item["data"]) for item in payload] if event == "node_batch" else [(event, payload)]
+                for event, payload in received:
+                    if event == "node_processing":
+                        processing[payload["urlhash"]] = now
+                    elif event in ("node_render", "node_failure"):
+                        if event == "node_render":
+                            stats.renders += 1
+                            if stats.first_render is None:
+                                stats.first_render = now
+                        else:
+                            stats.failures += 1
+                        if (begun := processing.pop(payload.get("urlhash", ""), None)) is not None:
+                            stats.node_latencies.append(now - begun)
+                    elif event == "node_link":
+                        stats.links += 1
+                    elif event == "stream_end":
+                        stats.end = now
+                if stats.end is not None:
+                    break
+                event, data = "", ""
+    return stats
+
+
+def summarize(stats: list[StreamStats], wall: float, services: list[Service]) -> dict:
+    """Summarize the stats of every stream into the reported results."""
+    ttfr = [s.first_render for s in stats if s.first_render is not None]
+    latencies = [latency for s in stats for latency in s.node_latencies]
+    renders = sum(s.renders for s in stats)
+    return {
+        "wall_seconds": wall,
+        "streams_completed": sum(s.end is not None for s in stats),
+        "nodes_rendered": renders,
+        "nodes_failed": sum(s.failures for s in stats),
+        "node_links": sum(s.links for s in stats),
+        "nodes_per_second": renders / wall if wall else 0.0,
+        "ttfr_p50": percentile(ttfr, 0.5),
+        "ttfr_p99": percentile(ttfr, 0.99),
+        "node_latency_p50": percentile(latencies, 0.5),
+        "node_latency_p99": percentile(latencies, 0.99),
+        **{f"peak_rss_mb_{service.name}": service.peak_rss / 2 ** 20 for service in services},
+    }
+
+
+def compare(results: dict, baseline: dict) -> None:
+    """Print each result next to its baseline value."""
+    for metric, value in results.items():
+        base = baseline.get("results", {}).get(metric)
+        if isinstance(value, (int, float)) and isinstance(base, (int, float)) and base:
+            change = f"{(value - base) / base:+.1%}"
+        else:
+            change = ""
+        print(f"{metric:>24}  {base!s:>22}  {value!s:>22}  {change}")  # noqa: T201
+
+
+def git_commit() -> Optional[str]:
+    """Return the commit being measured, if in a git checkout."""
+    try:
+        return subprocess.run(  # noqa: S603
+            ["git", "rev-parse", "HEAD"], capture_output=True, check=True, text=True  # noqa: S607
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def main(args: argparse.Namespace) -> dict:
+    """Run the load test and return its report."""
+    mock_url = f"http://127.0.0.1:{args.mock_port}"
+    gateway_url = f"http://127.0.0.1:{args.gateway_port}"
+    log_dir = Path(tempfile.mkdtemp(prefix="articlesa-loadtest-"))
+    mock_env = {
+        "MOCK_SEED": args.seed,
+        "MOCK_MIN_LINKS": str(args.min_links),
+        "MOCK_MAX_LINKS": str(args.max_links),
+        "MOCK_LATENCY": str(args.latency),
+        "MOCK_LATENCY_JITTER": str(args.jitter),
+        "MOCK_ERROR_RATE": str(args.error_rate),
+        "MOCK_REDIRECT_RATIO": str(args.redirect_ratio),
+        "MOCK_DUPLICATE_RATIO": str(args.duplicate_ratio),
+    }
+    # the whole synthetic web is one host, so the worker's per-host limits would bound the run
+    worker_env = {
+        "WORKER_HTML_STORE_DIR": str(log_dir / "html_store"),
+        "WORKER_HOST_CONCURRENCY": str(args.host_concurrency),
+        "WORKER_HOST_MIN_INTERVAL": str(args.host_min_interval),
+    }
+    services = [] if args.no_spawn else [
+        Service("mock", [
+            sys.executable, "-m", "uvicorn", "articlesa.test.articlemock:app", "--port", str(args.mock_port),
+        ], mock_env, log_dir),
+        Service("gateway", [
+            sys.executable, "-m", "uvicorn", "articlesa.serve:app", "--port", str(args.gateway_port),
+        ], {}, log_dir),
+        Service("worker", [
+            sys.executable, "-m", "arq", "articlesa.worker.WorkerSettings",
+        ], worker_env, log_dir),
+    ]
+    logger.info(f"logging services to {log_dir}")
+    timeout = ClientTimeout(total=args.timeout)
+    async with AsyncExitStack() as stack:
+        session = await stack.enter_async_context(ClientSession(timeout=timeout))
+        await stack.enter_async_context(running(services))
+        await wait_for_url(session, f"{mock_url}/articles/ping")
+        await wait_for_url(session, f"{gateway_url}/")
+        urls = [
+            f"{gateway_url}/a/{mock_url}/articles/{args.seed}load{i}?depth={args.depth}&refresh=true&batch={str(args.batch).lower()}"
+            for i in range(args.streams)
+        ]
+        started = time.monotonic()
+        stats = await asyncio.gather(*[run_stream(session, url) for url in urls])
+        wall = time.monotonic() - started
+    return {
+        "commit": git_commit(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        "results": summarize(stats, wall, services),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure article streams on a synthetic web.")
+    parser.add_argument("--streams", type=int, default=8, help="concurrent streams")
+    parser.add_argument("--depth", type=int, default=2)
+    parser.add_argument("--min-links", type=int, default=1)
+    parser.add_argument("--max-links", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds per mock response")
+    parser.add_argument("--jitter", type=float, default=0.05, help="up to this many more seconds")
+    parser.add_argument("--error-rate", type=float, default=0.02)
+    parser.add_argument("--redirect-ratio", type=float, default=0.2)
+    parser.add_argument("--duplicate-ratio", type=float, default=0.1)
+    parser.add_argument("--seed", type=str, default="")
+    parser.add_argument("--batch", action="store_true", help="request node_batch events")
+    parser.add_argument("--host-concurrency", type=int, default=64, help="worker requests in flight to the mock")
+    parser.add_argument("--host-min-interval", type=float, default=0.0, help="worker seconds between mock requests")
+    parser.add_argument("--mock-port", type=int, default=8000)
+    parser.add_argument("--gateway-port", type=int, default=7655)
+    parser.add_argument("--timeout", type=float, default=600, help="seconds before giving up on the run")
+    parser.add_argument("--no-spawn", action="store_true", help="use a mock, gateway and worker already running")
+    parser.add_argument("--output", type=Path, help="write the report here, e.g. as a new baseline")
+    parser.add_argument("--compare", type=Path, help="compare the results against this report")
+    args = parser.parse_args()
+
+    report = asyncio.run(main(args))
+    if args.compare:
+        compare(report["results"], json.loads(args.compare.read_text()))
+    else:
+        print(json.dumps(report, indent=2))  # noqa: T201
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2) + "\n")
@@ -0,0 +1,319 @@
+"""
+Benchmark the functions every node of a stream passes through.
+
+Each benchmark fails if its median time per call exceeds its budget in
+BUDGETS_US, so per-node CPU costs of the gateway and worker can't grow
+unnoticed. Budgets are several times what a laptop takes, to leave room for
+slow CI runners; tighten them when a function gets faster. Benchmarks are
+disabled by default, so a plain `pytest` runs each function once without
+timing it or checking its budget. CI runs them in a separate job that fails on
+any budget going over, and keeps each commit's results as an artifact. Run
+only the benchmarks, and compare against a saved run, with
+
+    make benchmark
+    pytest articlesa/test_benchmarks.py --benchmark-enable --benchmark-only --benchmark-compare
+"""
+import asyncio
+from datetime import datetime
+import json
+from pathlib import Path
+import random
+from typing import Optional
+
+from neo4j.time import DateTime
+import pytest
+from pytest_benchmark.fixture import BenchmarkFixture
+
+from articlesa.neo import Neo4JArticleDriver
+from articlesa.serve.gateway import (
+    SafeEncoder,
+    StreamNodes,
+    build_batch_event,
+    build_event,
+    dump_json,
+    render_event,
+    render_payload,
+)
+from articlesa.types import (
+    SSE,
+    HostBlacklist,
+    ParsedArticle,
+    PlaceholderArticle,
+    StreamEvent,
+    clean_url,
+    normalize_url,
+    relative_to_absolute_url,
+    url_to_hash,
+)
+from articlesa.worker import parse
+from articlesa.worker.extract import ExtractedArticle
+from articlesa.worker.parse import build_parsed_article
+
+
+# budget of median microseconds per call, by benchmark
+BUDGETS_US = {
+    "clean_url": 50,
+    "normalize_url": 40,
+    "url_to_hash": 5,
+    "relative_to_absolute_url": 40,
+    "blacklist_contains": 15,
+    "blacklist_filter": 40,
+    "parsed_article_validate": 50,
+    "parsed_article_dump": 50,
+    "json_dumps_safe_encoder": 300,
+    "dump_json": 300,
+    "sse_validate": 20,
+    "sse_encode": 10,
+    "build_event_render": 400,
+    "build_batch_event": 5,
+    "gateway_link": 150,
+    "gateway_render": 500,
+    "worker_links": 15000,
+}
+
+HOSTS = [
+    "www.nytimes.com", "www.washingtonpost.com", "apnews.com", "www.reuters.com",
+    "www.bbc.co.uk", "edition.cnn.com", "www.theguardian.com", "www.foxnews.com",
+    "news.yahoo.com", "www.npr.org", "thehill.com", "www.politico.com",
+]
+WORDS = [
+    "senate", "vote", "budget", "court", "ruling", "election", "climate", "report",
+    "market", "shares", "fall", "rise", "minister", "says", "new", "law", "city",
+]
+
+
+def make_url(rng: random.Random) -> str:
+    """Return a url shaped like a news article link, sometimes with a query string or fragment."""
+    slug = "-".join(rng.choices(WORDS, k=rng.randint(4, 10)))
+    date = f"{rng.randint(2015, 2024)}/{rng.randint(1, 12):02d}/{rng.randint(1, 28):02d}"
+    url = f"https://{rng.choice(HOSTS)}/{rng.choice(WORDS)}/{date}/{slug}"
+    if rng.random() < 0.3:
+        url += f"?utm_source={rng.choice(WORDS)}&utm_medium=social"
+    if rng.random() < 0.1:
+        url += "#comments"
+    return url
+
+
+@pytest.fixture(scope="module")
+def urls() -> list[str]:
+    """Return thousands of article urls."""
+    rng = random.Random(0)  # noqa: S311
+    return [make_url(rng) for _ in range(2000)]
+
+
+@pytest.fixture
+def blacklist(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> HostBlacklist:
+    """Return a blacklist of the repo's hosts plus tens of thousands more."""
+    rng = random.Random(0)  # noqa: S311
+    hosts = Path("blacklist.txt").read_text().splitlines()
+    hosts += [f"{''.join(rng.choices('abcdefghijklmnop', k=10))}.com" for _ in range(20000)]
+    path = tmp_path / "blacklist.txt"
+    path.write_text("\n".join(hosts) + "\nreuters.com\n")
+    monkeypatch.setattr(HostBlacklist, "blacklist_file", path)
+    return HostBlacklist()
+
+
+@pytest.fixture(scope="module")
+def article() -> dict:
+    """Return the fields of a stored article with 200 links."""
+    rng = random.Random(0)  # noqa: S311
+    return {
+        "url": make_url(rng),
+        "title": "Senate passes budget after late night vote",
+        "text": " ".join(rng.choices(WORDS, k=1500)),
+        "authors": ["Jane Doe", "John Roe"],
+        "links": [make_url(rng) for _ in range(200)],
+        "published": "2023-05-01T12:00:00",
+        "parsedAtUtc": datetime(2023, 5, 2, 8, 30),
+    }
+
+
+def check_budget(benchmark: BenchmarkFixture, name: str, calls: int = 1) -> None:
+    """Fail if the median time per call of a benchmark run over its budget."""
+    if benchmark.disabled or benchmark.stats is None:
+        return
+    us_per_call = benchmark.stats.stats.median / calls * 1e6
+    benchmark.extra_info["us_per_call"] = us_per_call
+    assert us_per_call <= BUDGETS_US[name], f"{name} took {us_per_call:.1f}us per call, budget is {BUDGETS_US[name]}us"
+
+
+def test_clean_url(benchmark: BenchmarkFixture, urls: list[str]) -> None:
+    """Benchmark clean_url."""
+    benchmark(lambda: [clean_url(url) for url in urls])
+    check_budget(benchmark, "clean_url", len(urls))
+
+
+def test_normalize_url(benchmark: BenchmarkFixture, urls: list[str]) -> None:
+    """Benchmark normalize_url."""
+    benchmark(lambda: [normalize_url(url) for url in urls])
+    check_budget(benchmark, "normalize_url", len(urls))
+
+
+def test_url_to_hash(benchmark: BenchmarkFixture, urls: list[str]) -> None:
+    """Benchmark url_to_hash."""
+    benchmark(lambda: [url_to_hash(url) for url in urls])
+    check_budget(benchmark, "url_to_hash", len(urls))
+
+
+def test_relative_to_absolute_url(benchmark: BenchmarkFixture, urls: list[str]) -> None:
+    """Benchmark relative_to_absolute_url."""
+    relative = ["/" + url.split("/", 3)[3] for url in urls]
+    benchmark(lambda: [relative_to_absolute_url(path, urls[0]) for path in relative])
+    check_budget(benchmark, "relative_to_absolute_url", len(relative))
+
+
+def test_blacklist_contains(benchmark: BenchmarkFixture, urls: list[str], blacklist: HostBlacklist) -> None:
+    """Benchmark HostBlacklist.__contains__ on a large blacklist."""
+    hosts = [url.split("/")[2] for url in urls]
+    blocked = benchmark(lambda: [host in blacklist for host in hosts])
+    assert any(blocked) and not all(blocked)
+    check_budget(benchmark, "blacklist_contains", len(hosts))
+
+
+def test_blacklist_filter(benchmark: BenchmarkFixture, urls: list[str], blacklist: HostBlacklist) -> None:
+    """Benchmark HostBlacklist.filter on a large blacklist."""
+    allowed = benchmark(blacklist.filter, urls)
+    assert 0 < len(allowed) < len(urls)
+    check_budget(benchmark, "blacklist_filter", len(urls))
+
+
+def test_parsed_article_validate(benchmark: BenchmarkFixture, article: dict) -> None:
+    """Benchmark validating an article with 200 links."""
+    benchmark(ParsedArticle.model_validate, article)
+    check_budget(benchmark, "parsed_article_validate")
+
+
+def test_parsed_article_dump(benchmark: BenchmarkFixture, article: dict) -> None:
+    """Benchmark dumping an article with 200 links for rendering."""
+    parsed_article = ParsedArticle.model_validate(article)
+    benchmark(render_payload, parsed_article)
+    check_budget(benchmark, "parsed_article_dump")
+
+
+def test_json_dumps_safe_encoder(benchmark: BenchmarkFixture, article: dict) -> None:
+    """Benchmark encoding a render payload, which has datetimes, with SafeEncoder."""
+    payload = render_payload(ParsedArticle.model_validate(article))
+    benchmark(json.dumps, payload, cls=SafeEncoder)
+    check_budget(benchmark, "json_dumps_safe_encoder")
+
+
+def test_dump_json(benchmark: BenchmarkFixture, article: dict) -> None:
+    """Benchmark encoding a render payload with dump_json, which uses orjson."""
+    payload = render_payload(ParsedArticle.model_validate(article))
+    benchmark(dump_json, payload)
+    check_budget(benchmark, "dump_json")
+
+
+def test_sse_validate(benchmark: BenchmarkFixture) -> None:
+    """Benchmark validating an SSE."""
+    benchmark(SSE, data="{}", id="1/https://example.com/", event=StreamEvent.NODE_PROCESSING.value)
+    check_budget(benchmark, "sse_validate")
+
+
+def test_sse_encode(benchmark: BenchmarkFixture) -> None:
+    """Benchmark encoding an SSE as sent."""
+    event = build_event(data={"urlhash": "0" * 32}, id="0123:1", event=StreamEvent.NODE_PROCESSING)
+    benchmark(event.encode)
+    check_budget(benchmark, "sse_encode")
+
+
+def test_build_batch_event(benchmark: BenchmarkFixture, urls: list[str]) -> None:
+    """Benchmark coalescing node events into a node_batch event, per event."""
+    events = [
+        build_event(data=PlaceholderArticle(urlhash=url_to_hash(url), depth=1, parent=None), id=f"0123:{i}", event=StreamEvent.NODE_PROCESSING)
+        for i, url in enumerate(urls[:100])
+    ]
+    benchmark(build_batch_event, events)
+    check_budget(benchmark, "build_batch_event", len(events))
+
+
+def test_build_event_render(benchmark: BenchmarkFixture, article: dict) -> None:
+    """Benchmark building the render event of an article with 200 links."""
+    payload = render_payload(ParsedArticle.model_validate(article))
+    benchmark(build_event, data=payload, id="0/url", event=StreamEvent.NODE_RENDER)
+    check_budget(benchmark, "build_event_render")
+
+
+def test_gateway_link(benchmark: BenchmarkFixture, urls: list[str]) -> None:
+    """Benchmark what the gateway does for each new link of a stream, up to its placeholder event."""
+    sample = urls[:200]
+    parent = url_to_hash(sample[0])
+
+    def _add_links() -> list[Optional[SSE]]:
+        nodes = StreamNodes(max_nodes=len(sample), max_fanout=[])
+        return [nodes.add(url, 1, parent, f"1/{url}") for url in sample]
+
+    events = benchmark(_add_links)
+    assert events[0] is not None and events[0].event == StreamEvent.NODE_PROCESSING.value
+    check_budget(benchmark, "gateway_link", len(sample))
+
+
+def test_gateway_render(benchmark: BenchmarkFixture, article: dict) -> None:
+    """Benchmark what the gateway does to render a stored article with 200 links."""
+    # an article node as neo4j returns it, which has no text
+    node = {key: value for key, value in article.items() if key not in ("text", "authors")}
+    node["parsedAtUtc"] = DateTime.from_native(article["parsedAtUtc"])
+    node["urlhash"] = url_to_hash(article["url"])
+    authors = [{"name": author} for author in article["authors"]]
+
+    def _render() -> SSE:
+        # _to_parsed_article changes the node it's passed, as it may since nodes are read once
+        parsed_article = Neo4JArticleDriver._to_parsed_article(dict(node), authors)
+        return render_event(article["url"], 0, render_payload(parsed_article), "0/url")
+
+    event = benchmark(_render)
+    assert event.event == StreamEvent.NODE_RENDER.value
+    check_budget(benchmark, "gateway_render")
+
+
+class FakePipeline:
+    """Stands in for a redis pipeline, doing nothing."""
+    async def __aenter__(self) -> "FakePipeline":
+        """Enter the pipeline."""
+        return self
+
+    async def __aexit__(self, *exc_info: object) -> None:
+        """Exit the pipeline."""
+
+    def incrby(self, key: str, amount: int) -> None:
+        """Increment nothing."""
+
+    async def execute(self) -> list:
+        """Execute nothing."""
+        return []
+
+
+class FakeRedis:
+    """Stands in for the worker's redis, with no redirects cached."""
+    async def mget(self, keys: list[str]) -> list[None]:
+        """Return a miss for every key."""
+        return [None] * len(keys)
+
+    def pipeline(self, transaction: bool = True) -> FakePipeline:
+        """Return a pipeline doing nothing."""
+        return FakePipeline()
+
+
+def test_worker_links(
+    benchmark: BenchmarkFixture, article: dict, blacklist: HostBlacklist, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """Benchmark how the worker builds a parsed article with 200 links, besides resolving redirects."""
+    monkeypatch.setattr(parse, "blacklist", blacklist)
+    extracted: ExtractedArticle = {
+        "title": article["title"],
+        "text": article["text"],
+        "authors": article["authors"],
+        # a quarter of the links are relative
+        "links": ["/" + link.split("/", 3)[3] if i % 4 == 0 else link for i, link in enumerate(article["links"])],
+        "publish_date": None,
+    }
+    ctx = {"redis": FakeRedis()}
+    loop = asyncio.new_event_loop()
+    try:
+        parsed_article = benchmark(lambda: loop.run_until_complete(
+            build_parsed_article(ctx, article["url"], extracted, article["parsedAtUtc"], offline=True)
+        ))
+    finally:
+        loop.close()
+    assert 0 < len(parsed_article.links) < len(extracted["links"])
+    check_budget(benchmark, "worker_links")
@@ -0,0 +1,54 @@
+""" Test tracing spans across tasks and processes. """
+import asyncio
+from pathlib import Path
+
+import pytest
+
+import articlesa.trace
+from articlesa.trace import JsonlExporter, carrier, critical_path, load_traces, span, traced
+
+
+@pytest.fixture
+def trace_file(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Path:
+    """Export spans to a temporary file."""
+    path = tmp_path / "traces.jsonl"
+    monkeypatch.setattr(articlesa.trace, "exporter", JsonlExporter(path))
+    return path
+
+
+@pytest.mark.asyncio
+async def test_spans_follow_tasks_and_carriers(trace_file: Path) -> None:
+    """Test tasks continue the span they're created in, and carriers continue traces elsewhere."""
+    async def _enqueue() -> dict | None:
+        await asyncio.sleep(0)
+        return carrier()
+
+    with span("outside"):
+        pass  # not traced without a trace to continue
+    with span("stream", new_trace=True):
+        remote = await asyncio.create_task(traced(_enqueue(), "retrieve", node="a"))
+    with span("job", parent=remote):
+        pass
+
+    traces = load_traces(trace_file)
+    assert len(traces) == 1
+    spans = {s["name"]: s for s in next(iter(traces.values()))}
+    assert set(spans) == {"stream", "retrieve", "job"}
+    assert spans["stream"]["parent_id"] is None
+    assert spans["retrieve"]["parent_id"] == spans["stream"]["span_id"]
+    assert spans["retrieve"]["attributes"] == {"node": "a"}
+    assert spans["job"]["parent_id"] == spans["retrieve"]["span_id"]
+
+
+def test_critical_path() -> None:
+    """Test the critical path ends at the last node to finish and goes up its parents."""
+    def _node(node: str, parent: str | None, start: float, end: float) -> dict:
+        return {"name": "retrieve", "start": start, "end": end, "attributes": {"node": node, "parent_node": parent}}
+
+    spans = [
+        _node("root", None, 0, 1),
+        _node("a", "root", 0.5, 2),
+        _node("b", "root", 0.5, 5),
+        _node("c", "a", 1.5, 4),
+    ]
+    assert [s["attributes"]["node"] for s in critical_path(spans)] == ["root", "b"]
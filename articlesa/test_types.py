@@ -0,0 +1,54 @@
+""" Test the host blacklist. """
+import os
+from pathlib import Path
+
+import pytest
+
+from articlesa.types import HostBlacklist
+
+
+@pytest.fixture
+def blacklist_file(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Path:
+    """Point HostBlacklist at a temporary blacklist file."""
+    path = tmp_path / "blacklist.txt"
+    path.write_text("amazon.com\n*.t.co\n\nTwitter.com.  # comment\n")
+    monkeypatch.setattr(HostBlacklist, "blacklist_file", path)
+    return path
+
+
+def test_label_boundaries(blacklist_file: Path) -> None:
+    """Test blacklisted domains block subdomains, but not lookalike domains."""
+    blacklist = HostBlacklist()
+    assert "amazon.com" in blacklist
+    assert "smile.amazon.com" in blacklist
+    assert "SMILE.Amazon.com:443" in blacklist
+    assert "twitter.com" in blacklist
+    assert "t.co" in blacklist
+    assert "notamazon.com" not in blacklist
+    assert "amazon.com.evil.org" not in blacklist
+    assert "com" not in blacklist
+
+
+def test_filter(blacklist_file: Path) -> None:
+    """Test filter drops blacklisted, hostless and None urls, keeping order."""
+    blacklist = HostBlacklist()
+    urls = [
+        "https://b.org/1",
+        "https://www.amazon.com/dp/1",
+        None,
+        "/relative",
+        "https://notamazon.com/",
+        "https://t.co/abc",
+    ]
+    assert blacklist.filter(urls) == ["https://b.org/1", "https://notamazon.com/"]
+
+
+def test_reload(blacklist_file: Path) -> None:
+    """Test the blacklist is re-read when the file changes."""
+    blacklist = HostBlacklist(reload_interval=0)
+    assert "example.com" not in blacklist
+    blacklist_file.write_text("example.com\n")
+    stat = blacklist_file.stat()
+    os.utime(blacklist_file, (stat.st_atime, stat.st_mtime + 1))
+    assert "www.example.com" in blacklist
+    assert "amazon.com" not in blacklist
@@ -0,0 +1,255 @@
+"""
+articlesa.trace follows an article stream across the gateway, workers and neo4j.
+
+A stream is one trace. Spans are opened with span(), and the current span is
+kept in a context variable, so asyncio tasks created inside a span continue
+it. The gateway passes carrier() to each arq job, and the worker continues the
+trace from it. Finished spans are appended as json lines to TraceConfig.file;
+processes may share the file. Nothing is traced unless it's set.
+
+Find which node held up a stream, and why, with
+
+    python -m articlesa.trace traces.jsonl
+"""
+
+import argparse
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+import json
+from pathlib import Path
+import threading
+import time
+from typing import Awaitable, Iterator, Optional, TextIO, TypeVar, Union
+from uuid import uuid4
+
+from articlesa.config import TraceConfig
+
+
+T = TypeVar("T")
+# span attributes are exported as json
+Attribute = Union[str, int, float, bool, None]
+
+
+class Span:
+    """A timed, named piece of work in a trace, with start and end as unix timestamps."""
+    def __init__(self,
+                 name: str,
+                 trace_id: str,
+                 parent_id: Optional[str],
+                 attributes: dict[str, Attribute],
+                 start: Optional[float] = None,
+                 ) -> None:
+        """Initialize span, started now unless start is passed."""
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.start = time.time() if start is None else start
+        self.end: Optional[float] = None
+        self.error: Optional[str] = None
+
+    def to_dict(self) -> dict:
+        """Return the span as exported."""
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start,
+            "end": self.end,
+            "error": self.error,
+            "attributes": self.attributes,
+        }
+
+
+class JsonlExporter:
+    """Appends finished spans to a file, one json object per line."""
+    def __init__(self, path: Path) -> None:
+        """Initialize exporter, the file is opened on the first export."""
+        self.path = path
+        self._file: Optional[TextIO] = None
+        self._lock = threading.Lock()
+
+    def export(self, span: Span) -> None:
+        """Append span to the file."""
+        line = json.dumps(span.to_dict(), default=str) + "\n"
+        with self._lock:
+            if self._file is None:
+                self._file = self.path.open("a")
+            self._file.write(line)
+            self._file.flush()
+
+
+exporter = JsonlExporter(Path(TraceConfig.file)) if TraceConfig.file else None
+_current: ContextVar[Optional[Span]] = ContextVar("articlesa_span", default=None)
+
+
+def carrier() -> Optional[dict]:
+    """Return what another process needs to continue the current trace, None if not tracing."""
+    current = _current.get()
+    if current is None:
+        return None
+    return {"trace_id": current.trace_id, "span_id": current.span_id}
+
+
+def _start(name: str,
+           parent: Optional[dict],
+           new_trace: bool,
+           attributes: dict[str, Attribute],
+           start: Optional[float] = None,
+           ) -> Optional[Span]:
+    """Start a span under parent, the current span, or else a new trace if new_trace."""
+    if exporter is None:
+        return None
+    if parent is None and (current := _current.get()) is not None:
+        parent = {"trace_id": current.trace_id, "span_id": current.span_id}
+    if parent is not None:
+        return Span(name, parent["trace_id"], parent["span_id"], attributes, start)
+    if new_trace:
+        return Span(name, uuid4().hex, None, attributes, start)
+    return None
+
+
+@contextmanager
+def span(name: str, parent: Optional[dict] = None, new_trace: bool = False, **attributes: Attribute) -> Iterator[Optional[Span]]:
+    """
+    Trace the enclosed code as a span, yielding it so attributes can be added.
+
+    The span is a child of parent, a carrier() from another process, or else
+    of the current span. Without either, a new trace is started only if
+    new_trace is set, otherwise nothing is traced and None is yielded.
+    """
+    started = _start(name, parent, new_trace, attributes)
+    if started is None:
+        yield None
+        return
+    token = _current.set(started)
+    try:
+        yield started
+    except BaseException as e:
+        started.error = e.__class__.__name__
+        raise
+    finally:
+        try:
+            _current.reset(token)
+        except ValueError:
+            pass  # an async generator closed from another context
+        started.end = time.time()
+        assert exporter is not None
+        exporter.export(started)
+
+
+async def traced(awaitable: Awaitable[T], name: str, **attributes: Attribute) -> T:
+    """Await awaitable in a span, e.g. to trace a task from where it's created."""
+    with span(name) as traced_span:
+        if traced_span is not None:
+            traced_span.attributes.update(attributes)
+        return await awaitable
+
+
+def record(name: str, start: float, end: float, parent: Optional[dict] = None, **attributes: Attribute) -> None:
+    """Export a span of work that's already done, e.g. waiting in a queue, see span()."""
+    if (finished := _start(name, parent, False, attributes, start)) is None:
+        return
+    finished.end = end
+    assert exporter is not None
+    exporter.export(finished)
+
+
+def load_traces(path: Path) -> dict[str, list[dict]]:
+    """Load exported spans, grouped by trace id."""
+    traces: dict[str, list[dict]] = defaultdict(list)
+    with path.open() as f:
+        for line in f:
+            if line.strip():
+                exported = json.loads(line)
+                traces[exported["trace_id"]].append(exported)
+    return traces
+
+
+def critical_path(spans: list[dict]) -> list[dict]:
+    """
+    Return the node spans of a stream that held up its completion, from the root down.
+
+    That's the node that finished last, preceded by the chain of nodes it was
+    linked from, each of which had to be parsed before the next could start.
+    """
+    nodes: dict[str, dict] = {}
+    for node in sorted((s for s in spans if s["name"] == "retrieve"), key=lambda s: s["start"]):
+        nodes.setdefault(node["attributes"].get("node"), node)
+    if not nodes:
+        return []
+    last = max(nodes.values(), key=lambda s: s["end"] or 0)
+    path = [last]
+    while (parent := nodes.get(path[-1]["attributes"].get("parent_node"))) is not None and parent not in path:
+        path.append(parent)
+    return path[::-1]
+
+
+def descendants(spans: list[dict], root: dict) -> list[tuple[int, dict]]:
+    """Return every span under root with its depth below it, in order of start."""
+    children: dict[str, list[dict]] = defaultdict(list)
+    for child in spans:
+        children[child["parent_id"]].append(child)
+    found = []
+
+    def _walk(span_id: str, depth: int) -> None:
+        for child in sorted(children[span_id], key=lambda s: s["start"]):
+            found.append((depth, child))
+            _walk(child["span_id"], depth + 1)
+
+    _walk(root["span_id"], 1)
+    return found
+
+
+def report(trace_id: str, spans: list[dict]) -> str:
+    """Describe the critical path of a stream, with where each node on it spent its time."""
+    root = next((s for s in spans if s["name"] == "stream"), None)
+    if root is None or root["end"] is None:
+        return f"trace {trace_id}: no finished stream"
+    t0 = root["start"]
+    lines = [
+        f"trace {trace_id}: {root['attributes'].get('url')} took {root['end'] - t0:.3f}s,"
+        f" {sum(s['name'] == 'retrieve' for s in spans)} retrievals"
+    ]
+    for node in critical_path(spans):
+        duration = (node["end"] or node["start"]) - node["start"]
+        attributes = node["attributes"]
+        lines.append(
+            f"  depth {attributes.get('depth')} {node['start'] - t0:+.3f}s {duration:.3f}s"
+            f" {attributes.get('url')}" + (f" failed with {node['error']}" if node["error"] else "")
+        )
+        under = descendants(spans, node)
+        for depth, child in under:
+            lines.append(
+                f"  {'  ' * depth}{child['name']} {child['start'] - t0:+.3f}s"
+                f" {(child['end'] or child['start']) - child['start']:.3f}s"
+            )
+        # leaves are where time was actually spent, their parents only wrap them
+        leaves = [child for depth, child in under if not any(s["parent_id"] == child["span_id"] for s in spans)]
+        if leaves:
+            slowest = max(leaves, key=lambda s: (s["end"] or s["start"]) - s["start"])
+            lines.append(f"    held up by {slowest['name']} {(slowest['end'] or slowest['start']) - slowest['start']:.3f}s")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Report the critical path of traced streams.")
+    parser.add_argument("file", type=Path, help="json lines file spans were exported to")
+    parser.add_argument("--trace", help="only report this trace id")
+    parser.add_argument("--slowest", type=int, default=10, help="report this many of the slowest streams")
+    args = parser.parse_args()
+
+    traces = load_traces(args.file)
+    if args.trace:
+        traces = {args.trace: traces.get(args.trace, [])}
+
+    def _stream_seconds(spans: list[dict]) -> float:
+        root = next((s for s in spans if s["name"] == "stream" and s["end"]), None)
+        return root["end"] - root["start"] if root else 0.0
+
+    slowest = sorted(traces.items(), key=lambda item: _stream_seconds(item[1]), reverse=True)
+    for trace_id, spans in slowest[:args.slowest]:
+        print(report(trace_id, spans), end="\n\n")  # noqa: T201
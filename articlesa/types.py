@@ -3,12 +3,21 @@ from datetime import datetime
 from enum import Enum
 import hashlib
 from pathlib import Path
-from typing import Optional, Union
+import time
+from typing import Iterable, Optional, Union
 from urllib.parse import urlparse
 
 from pydantic import BaseModel, validator
 from yarl import URL
 
+from articlesa.logger import logger
+
+
+# redis pub/sub channel that workers publish finished arq job ids to
+JOB_COMPLETE_CHANNEL = "articlesa:job_complete"
+# workers publish the links of an article as they're resolved to this prefix plus the job id
+LINKS_CHANNEL_PREFIX = "articlesa:links:"
+
 
 def clean_url(url: Union[str, URL]) -> str:
     """Parse article urls, remove query strings and fragments."""
@@ -17,6 +26,18 @@ def clean_url(url: Union[str, URL]) -> str:
     return _parsed.geturl()
 
 
+def normalize_url(url: str) -> str:
+    """
+    Normalize url for telling whether two links point at the same article.
+
+    Drops the scheme, query string, fragment, a default port and trailing
+    slashes, and lowercases the host.
+    """
+    _parsed = urlparse(url)
+    netloc = _parsed.netloc.lower().removesuffix(":80").removesuffix(":443")
+    return netloc + _parsed.path.rstrip("/")
+
+
 def relative_to_absolute_url(relative_url: str, base_url: str) -> str:
     """Given a relative url and a base url, return an absolute url."""
     assert relative_url.startswith("/")
@@ -30,37 +51,84 @@ def url_to_hash(url: str) -> str:
     return hashlib.md5(url.encode()).hexdigest()  # noqa: S324
 
 
+def parse_job_id(url: str) -> str:
+    """Build the arq job id for parsing url; every caller of the same url shares it."""
+    return f"parse_article:{url_to_hash(clean_url(url))}"
+
+
 class HostBlacklist:
-    """Blacklist object, used to filter links."""
+    """
+    Blacklist object, used to filter links.
+
+    Blacklisted domains also block their subdomains, on label boundaries only:
+    amazon.com blocks smile.amazon.com but not notamazon.com. Lookups check
+    each suffix of the host against a set, so they take one set lookup per
+    label however long the blacklist is. The blacklist file is re-read when it
+    changes, checked at most every `reload_interval` seconds.
+    """
     blacklist_file: Path = Path("blacklist.txt")
 
+    @staticmethod
+    def _normalize(host: str) -> str:
+        """Lowercase host and strip any userinfo, port, wildcard or trailing dot."""
+        host = host.rpartition("@")[2].partition(":")[0]
+        return host.strip().lower().removeprefix("*.").strip(".")
+
     def _read_blacklist(self: "HostBlacklist") -> set:
         """Blacklist of netlocs to ignore."""
         with self.blacklist_file.open("r") as f:
             blacklist = set()
             for line in f:
-                if sline := line.strip():
+                if sline := self._normalize(line.split("#")[0]):
                     blacklist.add(sline)
             return blacklist
 
-    def __init__(self: "HostBlacklist") -> None:
+    def __init__(self: "HostBlacklist", reload_interval: float = 10) -> None:
         """Initialize blacklist."""
+        self.reload_interval = reload_interval
+        self._mtime = self.blacklist_file.stat().st_mtime
+        self._next_check = time.monotonic() + reload_interval
         self.blacklist = self._read_blacklist()
 
+    def _maybe_reload(self: "HostBlacklist") -> None:
+        """Re-read the blacklist file if it changed since it was last read."""
+        if time.monotonic() < self._next_check:
+            return
+        self._next_check = time.monotonic() + self.reload_interval
+        try:
+            if (mtime := self.blacklist_file.stat().st_mtime) == self._mtime:
+                return
+            self.blacklist = self._read_blacklist()
+            self._mtime = mtime
+        except OSError as e:
+            logger.warning(f"keeping old blacklist, reading {self.blacklist_file} failed with {e}")
+            return
+        logger.info(f"reloaded {len(self.blacklist)} hosts from {self.blacklist_file}")
+
+    def _blocks(self: "HostBlacklist", host: str) -> bool:
+        """Check if normalized host or one of its parent domains is blacklisted."""
+        labels = host.split(".")
+        return any(".".join(labels[i:]) in self.blacklist for i in range(len(labels)))
+
     def __contains__(self: "HostBlacklist", host: str) -> bool:
         """
         Check if host is in blacklist.
 
-        The netloc in the blacklist may be a subset of the host.
+        The netloc in the blacklist may be a parent domain of the host.
         For example, we want to block any subdomains of
         amazon.com, like smile.amazon.com.
         """
-        if host in self.blacklist:
-            return True
-        for blacklisted_host in self.blacklist:
-            if host.endswith(blacklisted_host):
-                return True
-        return False
+        self._maybe_reload()
+        return self._blocks(self._normalize(host))
+
+    def filter(self: "HostBlacklist", urls: Iterable[Optional[str]]) -> list[str]:
+        """Return urls that have a host which isn't blacklisted, dropping None and hostless urls."""
+        self._maybe_reload()
+        allowed = []
+        for url in urls:
+            if url and (host := urlparse(url).hostname) and not self._blocks(host.rstrip(".")):
+                allowed.append(url)
+        return allowed
 
 
 class PlaceholderArticle(BaseModel):
@@ -70,6 +138,12 @@ class PlaceholderArticle(BaseModel):
     parent: Optional[str]
 
 
+class NodeLink(BaseModel):
+    """Object for when a source links to a node that's already in the stream."""
+    urlhash: str
+    parent: str
+
+
 class ParseFailure(BaseModel):
     """Object returned from parse worker when parse failed."""
     message: str
@@ -101,7 +175,13 @@ class StreamEvent(Enum):
     NODE_PROCESSING = "node_processing"
     NODE_RENDER = "node_render"
     NODE_FAILURE = "node_failure"
+    NODE_LINK = "node_link"
     STREAM_END = "stream_end"
+    NODE_BATCH = "node_batch"
+
+
+# every valid SSE event type, built once rather than on each validation
+STREAM_EVENT_VALUES = frozenset(e.value for e in StreamEvent)
 
 
 class SSE(BaseModel):
@@ -128,5 +208,9 @@ class SSE(BaseModel):
     @validator("event")
     def event_must_be_valid(cls: "SSE", v: str) -> str:
         """Validate that event is a valid StreamEvent."""
-        assert v in [e.value for e in StreamEvent]
+        assert v in STREAM_EVENT_VALUES
         return v
+
+    def encode(self) -> bytes:
+        """Encode the event as sent, like sse_starlette's ServerSentEvent; data must be one line, as json is."""
+        return f"id: {self.id}\r\nevent: {self.event}\r\ndata: {self.data}\r\nretry: {self.retry}\r\n\r\n".encode()
@@ -4,15 +4,22 @@ base directory where workers can be launched from.
 Try `arq articlesa.worker.WorkerSettings`
 """
 
+from datetime import datetime, timezone
 from pathlib import Path
 
-from aiohttp import ClientSession
-from arq import create_pool
+from aiohttp import ClientSession, TCPConnector
+from arq import ArqRedis, create_pool
 from arq.connections import RedisSettings
-from arsenic import start_session, stop_session, services, browsers
+from arsenic import services, browsers
+from prometheus_client import start_http_server
 
-from articlesa.config import RedisConfig
+from articlesa.config import RedisConfig, WorkerConfig
 from articlesa.logger import logger
+from articlesa.metrics import stage_seconds
+from articlesa.types import JOB_COMPLETE_CHANNEL
+from articlesa.worker.browserpool import BrowserPool
+from articlesa.worker.extract import make_parse_pool, start_parse_pool
+from articlesa.worker.htmlstore import HtmlStore
 from articlesa.worker.parse import parse_article
 
 
@@ -22,33 +29,75 @@ chrome_options = {'goog:chromeOptions': {'args': ['--headless', '--disable-gpu']
 browser = browsers.Chrome(**chrome_options)
 
 
-async def make_pool() -> None:
+redis_settings = RedisSettings.from_dsn(RedisConfig.url)
+redis_settings.max_connections = RedisConfig.max_connections
+
+
+async def make_pool() -> ArqRedis:
     """Create a redis pool for the worker, used to enqueue jobs."""
-    return await create_pool(
-        RedisSettings(
-            host=RedisConfig.host,
-            port=RedisConfig.port,
-        )
-    )
+    return await create_pool(redis_settings)
 
 
 async def startup(ctx: dict) -> None:
-    """Startup function for arq worker, creates aiohttp session."""
+    """Startup function for arq worker, creates parsing, browser pools and aiohttp session."""
     logger.info("starting up")
-    ctx['arsenicsession'] = await start_session(service, browser)
-    ctx['aiohttpsession'] = await ClientSession().__aenter__()
+    start_metrics_server()
+    ctx['parsepool'] = make_parse_pool()
+    await start_parse_pool(ctx['parsepool'])
+    ctx['htmlstore'] = HtmlStore() if WorkerConfig.html_store_dir else None
+    ctx['browserpool'] = BrowserPool(service, browser)
+    await ctx['browserpool'].start()
+    # keep-alive and cached dns lookups, since links point to the same few hosts
+    connector = TCPConnector(
+        limit=WorkerConfig.connections,
+        limit_per_host=WorkerConfig.host_concurrency,
+        ttl_dns_cache=300,
+        keepalive_timeout=30,
+    )
+    ctx['aiohttpsession'] = await ClientSession(connector=connector).__aenter__()
 
 
 async def shutdown(ctx: dict) -> None:
-    """Shutdown function for arq worker, closes aiohttp session."""
+    """Shutdown function for arq worker, closes parsing, browser pools and aiohttp session."""
     logger.info("shutting down")
-    await stop_session(ctx['arsenicsession'])
+    await ctx['browserpool'].stop()
     await ctx['aiohttpsession'].__aexit__(None, None, None)
+    if ctx['parsepool'] is not None:
+        ctx['parsepool'].shutdown(cancel_futures=True)
+
+
+def start_metrics_server(port: int = WorkerConfig.metrics_port) -> None:
+    """Serve this worker's metrics on port, unless it's 0 or taken by another worker."""
+    if not port:
+        return
+    try:
+        start_http_server(port)
+    except OSError as e:
+        logger.warning(f"not serving metrics, port {port} is unavailable: {e}")
+        return
+    logger.info(f"serving metrics on port {port}")
+
+
+async def on_job_start(ctx: dict) -> None:
+    """Record how long the job waited in the queue."""
+    waited = datetime.now(timezone.utc) - ctx['enqueue_time']
+    stage_seconds.labels("queue_wait").observe(waited.total_seconds())
+
+
+async def after_job_end(ctx: dict) -> None:
+    """Publish the finished job id so waiting gateways wake up without polling."""
+    await ctx['redis'].publish(JOB_COMPLETE_CHANNEL, ctx['job_id'])
 
 
 class WorkerSettings:
     """https://arq-docs.helpmanual.io/#arq.worker.Worker <- docs."""
     functions = [parse_article]
+    redis_settings = redis_settings
     on_startup = startup
     on_shutdown = shutdown
+    on_job_start = on_job_start
+    after_job_end = after_job_end
     max_jobs = 5
+    # gateways abort jobs that no stream is waiting on anymore
+    allow_abort_jobs = True
+    keep_result = WorkerConfig.keep_result
@@ -1,11 +1,18 @@
 """ main module of source space worker """
 
 import asyncio
+from itertools import islice
 
 from arq import create_pool
 from arq.connections import RedisSettings
 from arq.jobs import Job
 
+from articlesa.neo import Neo4JArticleDriver
+from articlesa.worker import make_pool
+from articlesa.worker.extract import make_parse_pool, start_parse_pool
+from articlesa.worker.htmlstore import HtmlStore
+from articlesa.worker.parse import MissingArticleText, RedirectCache, reparse_article
+
 
 async def submit() -> None:
     """ submit a few test urls to the scrape worker. """
@@ -22,12 +29,57 @@ async def submit() -> None:
         print(f'{url} -> {result}')  # noqa: T201
 
 
+async def redirect_stats() -> None:
+    """ Print the redirect cache hit rate across all workers. """
+    redis = await make_pool()
+    hits, misses = await RedirectCache.global_stats(redis)
+    lookups = hits + misses
+    hit_rate = hits / lookups if lookups else 0.0
+    print(f'{lookups} lookups, {hit_rate:.1%} hit rate')  # noqa: T201
+
+
+async def reparse(batch_size: int) -> None:
+    """ Rebuild stored articles from the html store, without fetching anything. """
+    redis, parsepool = await make_pool(), make_parse_pool()
+    await start_parse_pool(parsepool)
+    ctx = {'redis': redis, 'parsepool': parsepool}
+    reparsed = failed = 0
+    async with Neo4JArticleDriver() as neodriver:
+        stored = iter(HtmlStore())
+        while batch := list(islice(stored, batch_size)):
+            results = await asyncio.gather(
+                *[reparse_article(ctx, html) for html in batch], return_exceptions=True
+            )
+            articles = []
+            for result in results:
+                if isinstance(result, MissingArticleText):
+                    failed += 1
+                elif isinstance(result, BaseException):
+                    raise result
+                else:
+                    articles.append((result, None))
+            if articles:
+                await neodriver.put_articles(articles)
+            reparsed += len(articles)
+            print(f'{reparsed} articles reparsed, {failed} without text')  # noqa: T201
+    if parsepool is not None:
+        parsepool.shutdown()
+    await redis.aclose()
+
+
 if __name__ == '__main__':
     import argparse
     parser = argparse.ArgumentParser()
     subcommands = parser.add_subparsers(dest='subcommand', required=True)
     submit_parser = subcommands.add_parser('submit')
+    redirect_stats_parser = subcommands.add_parser('redirect-stats')
+    reparse_parser = subcommands.add_parser('reparse')
+    reparse_parser.add_argument('--batch-size', type=int, default=100)
     args = parser.parse_args()
 
     if args.subcommand == 'submit':
         asyncio.run(submit())
+    elif args.subcommand == 'redirect-stats':
+        asyncio.run(redirect_stats())
+    elif args.subcommand == 'reparse':
+        asyncio.run(reparse(args.batch_size))
@@ -0,0 +1,129 @@
+"""
+articlesa.worker.browserpool manages the headless browsers used to download articles.
+
+Each worker keeps a pool of browser sessions. A session is leased for one page
+load at a time, health checked before use, and restarted when it crashes, hangs
+or has loaded enough pages that its memory use should be reset.
+"""
+
+import asyncio
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+
+from aiohttp import ClientError
+from arsenic import Session, start_session, stop_session
+from arsenic.browsers import Browser
+from arsenic.errors import ArsenicError
+from arsenic.services import Service
+
+from articlesa.config import WorkerConfig
+from articlesa.logger import logger
+
+
+# errors from a page load that mean the browser crashed, can't be reached or hung,
+# as opposed to e.g. the job being aborted or the page failing to parse
+BROWSER_ERRORS = (ArsenicError, ClientError, asyncio.TimeoutError)
+
+
+class BrowserSlot:
+    """One pooled browser session and the number of pages it has loaded."""
+    def __init__(self, index: int) -> None:
+        """Initialize an empty slot, the session is started on first lease."""
+        self.index = index
+        self.session: Optional[Session] = None
+        self.pages = 0
+
+
+class BrowserPool:
+    """
+    BrowserPool leases out a fixed number of browser sessions.
+
+    The number of sessions is the number of pages loading at once, whatever
+    the number of concurrent jobs.
+    """
+    def __init__(self,
+                 service: Service,
+                 browser: Browser,
+                 size: int = WorkerConfig.browser_sessions,
+                 max_pages: int = WorkerConfig.browser_max_pages,
+                 health_timeout: float = WorkerConfig.browser_health_timeout,
+                 ) -> None:
+        """Initialize pool settings, call start() to launch the sessions."""
+        self.service = service
+        self.browser = browser
+        self.size = size
+        self.max_pages = max_pages
+        self.health_timeout = health_timeout
+        self._slots = [BrowserSlot(i) for i in range(size)]
+        self._idle: asyncio.Queue[BrowserSlot] = asyncio.Queue()
+
+    async def start(self) -> None:
+        """Launch every session of the pool."""
+        for slot in self._slots:
+            try:
+                await self._restart(slot)
+            except Exception as e:
+                # the slot is started again on its first lease
+                logger.opt(exception=e).error(f"error starting browser session {slot.index}")
+            self._idle.put_nowait(slot)
+
+    async def stop(self) -> None:
+        """Stop every session of the pool."""
+        for slot in self._slots:
+            await self._stop(slot)
+
+    async def _stop(self, slot: BrowserSlot) -> None:
+        """Stop the slot's session, which may already be dead."""
+        if slot.session is None:
+            return
+        try:
+            await asyncio.wait_for(stop_session(slot.session), self.health_timeout)
+        except Exception as e:
+            logger.opt(exception=e).warning(f"error stopping browser session {slot.index}")
+        slot.session = None
+
+    async def _restart(self, slot: BrowserSlot) -> None:
+        """Replace the slot's session, if any, with a new one."""
+        await self._stop(slot)
+        slot.session = await start_session(self.service, self.browser)
+        slot.pages = 0
+        logger.info(f"started browser session {slot.index}")
+
+    async def _healthy(self, slot: BrowserSlot) -> bool:
+        """Check the slot's session still responds."""
+        assert slot.session is not None
+        try:
+            await asyncio.wait_for(slot.session.get_url(), self.health_timeout)
+            return True
+        except Exception:
+            return False
+
+    @asynccontextmanager
+    async def lease(self) -> AsyncIterator[Session]:
+        """
+        Lease a healthy session for one page load.
+
+        If the page load raises one of BROWSER_ERRORS, e.g. because the browser
+        crashed or the load timed out, the session is restarted before it is
+        leased again. On any other exception, including cancellation, the
+        session is returned to the pool as is.
+        """
+        slot = await self._idle.get()
+        try:
+            if slot.session is not None and not await self._healthy(slot):
+                logger.warning(f"browser session {slot.index} is unhealthy, restarting")
+                await self._stop(slot)
+            if slot.session is None:
+                await self._restart(slot)
+            assert slot.session is not None
+            try:
+                yield slot.session
+            except BROWSER_ERRORS:
+                await self._stop(slot)
+                raise
+            slot.pages += 1
+            if slot.pages >= self.max_pages:
+                logger.info(f"browser session {slot.index} loaded {slot.pages} pages, restarting")
+                await self._stop(slot)
+        finally:
+            self._idle.put_nowait(slot)
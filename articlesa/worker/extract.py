@@ -0,0 +1,135 @@
+"""
+articlesa.worker.extract turns article html into article fields, in a process pool.
+
+newspaper parsing is CPU bound, so running it on the worker event loop stalls
+every other job on it. Instead the html is sent to a pool of processes that
+have newspaper preloaded, and only the fields ParsedArticle needs come back.
+"""
+
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+import multiprocessing
+from typing import Optional, TypedDict
+
+from newspaper import Article
+
+from articlesa.config import WorkerConfig
+from articlesa.logger import logger
+from articlesa.metrics import stage_seconds
+from articlesa.trace import span
+
+
+class ExtractedArticle(TypedDict):
+    """Article fields extracted from html, small enough to send between processes."""
+    title: str
+    text: str
+    authors: list[str]
+    links: list[str]
+    publish_date: Optional[datetime]
+
+
+warm_up_html = "<html><head><title>warm up</title></head><body><p>warm up</p></body></html>"
+
+
+def parse_html(url: str, html: str) -> ExtractedArticle:
+    """Parse article html using forked newspaper3k with .links property."""
+    article = Article(url)
+    article.download_state = 2  # set to success
+    article.set_html(html)
+    article.parse()
+    return ExtractedArticle(
+        title=article.title,
+        text=article.text,
+        authors=article.authors,
+        links=article.links,
+        publish_date=article.publish_date,
+    )
+
+
+def warm_up() -> None:
+    """Parse a tiny document, so a new process loads newspaper and lxml before real work."""
+    try:
+        parse_html("http://localhost/", warm_up_html)
+    except Exception as e:
+        # an initializer that raises breaks the whole pool, real parses will report errors
+        logger.warning(f"warming up parsing process failed with {e.__class__.__name__}")
+
+
+class ParsePool:
+    """
+    ParsePool parses html in a pool of processes, replacing the pool if it breaks.
+
+    One process dying, e.g. killed for using too much memory or crashing in
+    lxml, breaks the whole process pool, and every later parse on it fails.
+    A parse that finds the pool broken replaces it with a new, warmed up one
+    and is retried once.
+
+    Processes are spawned rather than forked, since forking a process that is
+    running an event loop and browser sessions is unsafe.
+    """
+    def __init__(self, processes: int = WorkerConfig.parse_processes) -> None:
+        """Initialize the pool, call start() to start its processes up front."""
+        self.processes = processes
+        self.executor = self._make_executor()
+        self._replacing = asyncio.Lock()
+
+    def _make_executor(self) -> ProcessPoolExecutor:
+        """Create a process pool whose processes warm up as they start."""
+        return ProcessPoolExecutor(
+            max_workers=self.processes,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=warm_up,
+        )
+
+    async def start(self) -> None:
+        """Start every process of the pool, so the first parses don't pay for it."""
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*[loop.run_in_executor(self.executor, warm_up) for _ in range(self.processes)])
+        logger.info(f"started {self.processes} parsing processes")
+
+    async def _replace(self, broken: ProcessPoolExecutor) -> None:
+        """Replace a broken process pool, unless a parse that found it broken already did."""
+        async with self._replacing:
+            if self.executor is not broken:
+                return
+            logger.warning("a parsing process died, replacing the pool")
+            broken.shutdown(wait=False, cancel_futures=True)
+            self.executor = self._make_executor()
+            await self.start()
+
+    async def parse(self, url: str, html: str) -> ExtractedArticle:
+        """Parse html in a process, see parse_html."""
+        loop = asyncio.get_running_loop()
+        executor = self.executor
+        try:
+            return await loop.run_in_executor(executor, parse_html, url, html)
+        except BrokenProcessPool:
+            await self._replace(executor)
+        return await loop.run_in_executor(self.executor, parse_html, url, html)
+
+    def shutdown(self, cancel_futures: bool = False) -> None:
+        """Shut the processes down."""
+        self.executor.shutdown(cancel_futures=cancel_futures)
+
+
+def make_parse_pool(processes: int = WorkerConfig.parse_processes) -> Optional[ParsePool]:
+    """Create a pool of parsing processes, or None to parse on the event loop."""
+    if processes <= 0:
+        return None
+    return ParsePool(processes)
+
+
+async def start_parse_pool(pool: Optional[ParsePool]) -> None:
+    """Start every process of pool up front, if there is a pool."""
+    if pool is not None:
+        await pool.start()
+
+
+async def extract_article(pool: Optional[ParsePool], url: str, html: str) -> ExtractedArticle:
+    """Parse html in pool, or on the event loop if there is no pool."""
+    with stage_seconds.labels("parse").time(), span("parse"):
+        if pool is None:
+            return parse_html(url, html)
+        return await pool.parse(url, html)
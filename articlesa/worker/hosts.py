@@ -0,0 +1,94 @@
+"""
+articlesa.worker.hosts schedules outbound requests politely, per host.
+
+Every request a worker makes to a site, whether a HEAD request, a plain GET
+or a browser page load, first takes a slot from the HostScheduler. Slots limit
+how many requests run against one netloc at once, space out their starts, and
+hold requests back while a host that answered 429 or 503 is backed off.
+"""
+
+import asyncio
+from contextlib import asynccontextmanager
+import time
+from typing import AsyncIterator, Optional
+from urllib.parse import urlparse
+
+from articlesa.config import WorkerConfig
+from articlesa.logger import logger
+
+
+class HostState:
+    """Concurrency, spacing and backoff state of a single netloc."""
+    def __init__(self, concurrency: int) -> None:
+        """Initialize state for a host that has not been contacted yet."""
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.lock = asyncio.Lock()
+        self.next_start = 0.0
+        self.backoff = 0.0
+        self.active = 0
+
+
+class HostScheduler:
+    """
+    HostScheduler hands out per-netloc request slots.
+
+    At most `concurrency` requests run against a netloc at once, and their
+    starts are at least `min_interval` seconds apart. A 429 or 503 backs the
+    host off, doubling up to `max_backoff` seconds unless the response has a
+    Retry-After header.
+    """
+    def __init__(self,
+                 concurrency: int = WorkerConfig.host_concurrency,
+                 min_interval: float = WorkerConfig.host_min_interval,
+                 max_backoff: float = WorkerConfig.host_max_backoff,
+                 max_hosts: int = 10000,
+                 ) -> None:
+        """Initialize a scheduler with no known hosts."""
+        self.concurrency = concurrency
+        self.min_interval = min_interval
+        self.max_backoff = max_backoff
+        self.max_hosts = max_hosts
+        self._hosts: dict[str, HostState] = {}
+
+    def _host(self, netloc: str) -> HostState:
+        """Return the state of netloc, forgetting idle hosts if there are too many."""
+        if netloc not in self._hosts and len(self._hosts) >= self.max_hosts:
+            now = time.monotonic()
+            self._hosts = {
+                known: host for known, host in self._hosts.items()
+                if host.active or host.next_start > now
+            }
+        return self._hosts.setdefault(netloc, HostState(self.concurrency))
+
+    @asynccontextmanager
+    async def slot(self, url: str) -> AsyncIterator[None]:
+        """Wait for, then hold, a request slot for the host of url."""
+        host = self._host(urlparse(url).netloc)
+        async with host.semaphore:
+            async with host.lock:
+                if (delay := host.next_start - time.monotonic()) > 0:
+                    await asyncio.sleep(delay)
+                host.next_start = time.monotonic() + self.min_interval
+            host.active += 1
+            try:
+                yield
+            finally:
+                host.active -= 1
+
+    def report(self, url: str, status: int, retry_after: Optional[str] = None) -> bool:
+        """
+        Report the response status of a request to url, returning whether it was throttled.
+
+        Throttled hosts get no new slots until their backoff has passed.
+        """
+        host = self._host(urlparse(url).netloc)
+        if status not in (429, 503):
+            host.backoff = 0.0
+            return False
+        if retry_after and retry_after.isdigit():
+            host.backoff = min(float(retry_after), self.max_backoff)
+        else:
+            host.backoff = min(max(host.backoff * 2, 1.0), self.max_backoff)
+        host.next_start = max(host.next_start, time.monotonic() + host.backoff)
+        logger.info(f"{urlparse(url).netloc} answered {status}, backing off {host.backoff:.1f}s")
+        return True
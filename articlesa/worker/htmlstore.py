@@ -0,0 +1,180 @@
+"""
+articlesa.worker.htmlstore keeps the html of fetched articles on local disk.
+
+Stored html lets articles be re-parsed, after the parser or link cleaning
+changes, without downloading every page again. Html is compressed and stored
+once per content hash under objects/, and each url has a small json entry under
+urls/ pointing at the html it last fetched. When the store grows past its size
+limit, the least recently used html is evicted; url entries pointing at evicted
+html are dropped when they're next read.
+
+Compression uses zstd when available, otherwise gzip.
+"""
+
+import asyncio
+from datetime import datetime
+import gzip
+import hashlib
+import json
+import os
+from pathlib import Path
+import tempfile
+from typing import Iterator, Optional
+
+from articlesa.config import WorkerConfig
+from articlesa.logger import logger
+from articlesa.types import url_to_hash
+
+try:
+    from compression import zstd
+except ImportError:
+    try:
+        from backports import zstd
+    except ImportError:
+        try:
+            import zstandard as zstd
+        except ImportError:
+            zstd = None
+
+
+class StoredHtml:
+    """Html of an article as fetched, with the url and time it was fetched."""
+    def __init__(self, url: str, html: str, fetched_at: datetime) -> None:
+        """Initialize stored html."""
+        self.url = url
+        self.html = html
+        self.fetched_at = fetched_at
+
+
+class HtmlStore:
+    """
+    HtmlStore is a content-addressed, size-bounded store of article html.
+
+    The store is safe to share between worker processes on one machine; the
+    size is tracked per process and recounted from disk before evicting, and
+    html may be evicted by another process at any time.
+    """
+    def __init__(self,
+                 root: Path = Path(WorkerConfig.html_store_dir),
+                 max_bytes: int = WorkerConfig.html_store_bytes,
+                 ) -> None:
+        """Initialize the store at root, creating it if needed."""
+        self.root = root
+        self.max_bytes = max_bytes
+        self.suffix = ".zst" if zstd is not None else ".gz"
+        (root / "objects").mkdir(parents=True, exist_ok=True)
+        (root / "urls").mkdir(parents=True, exist_ok=True)
+        self.bytes = sum(size for _, size, _ in self._stat_objects())
+
+    def _objects(self) -> Iterator[Path]:
+        """Yield the path of every stored html object."""
+        return (path for path in (self.root / "objects").glob("*/*") if path.suffix != ".tmp")
+
+    def _stat_objects(self) -> list[tuple[float, int, Path]]:
+        """Return the mtime, size and path of every stored html object."""
+        objects = []
+        for path in self._objects():
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue  # evicted by another worker
+            objects.append((stat.st_mtime, stat.st_size, path))
+        return objects
+
+    def _object_path(self, content_hash: str, suffix: str) -> Path:
+        """Return the path html with content_hash is stored at."""
+        return self.root / "objects" / content_hash[:2] / (content_hash + suffix)
+
+    def _url_path(self, url: str) -> Path:
+        """Return the path the entry for url is stored at."""
+        return self.root / "urls" / (url_to_hash(url) + ".json")
+
+    def _compress(self, data: bytes) -> bytes:
+        """Compress data with zstd, or gzip without it."""
+        if zstd is not None:
+            return zstd.compress(data)
+        return gzip.compress(data, compresslevel=6)
+
+    @staticmethod
+    def _decompress(path: Path) -> bytes:
+        """Decompress the object at path, by its suffix."""
+        if path.suffix == ".zst":
+            if zstd is None:
+                raise RuntimeError(f"{path} is zstd compressed, but zstd is not installed")
+            return zstd.decompress(path.read_bytes())
+        return gzip.decompress(path.read_bytes())
+
+    def put(self, url: str, html: str, fetched_at: Optional[datetime] = None) -> None:
+        """Store html fetched from url, replacing the entry for url."""
+        data = html.encode()
+        content_hash = hashlib.sha256(data).hexdigest()
+        path = self._object_path(content_hash, self.suffix)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            path.parent.mkdir(exist_ok=True)
+            compressed = self._compress(data)
+            # unique per writer, since threads and processes may store the same html at once
+            fd, tmp_name = tempfile.mkstemp(prefix=f"{path.name}.", suffix=".tmp", dir=path.parent)
+            with os.fdopen(fd, "wb") as tmp_file:
+                tmp_file.write(compressed)
+            Path(tmp_name).replace(path)
+            self.bytes += len(compressed)
+        entry = {
+            "url": url,
+            "content": path.name,
+            "fetchedAtUtc": (fetched_at or datetime.utcnow()).isoformat(),
+        }
+        self._url_path(url).write_text(json.dumps(entry))
+        if self.bytes > self.max_bytes:
+            self.evict()
+
+    def get(self, url: str) -> Optional[StoredHtml]:
+        """Return the html last stored for url, or None if there is none."""
+        try:
+            entry = json.loads(self._url_path(url).read_text())
+        except FileNotFoundError:
+            return None
+        return self._load(entry)
+
+    def _load(self, entry: dict) -> Optional[StoredHtml]:
+        """Load the html a url entry points at, dropping the entry if it was evicted."""
+        path = self._object_path(entry["content"], "")
+        try:
+            html = self._decompress(path).decode()
+        except FileNotFoundError:
+            self._url_path(entry["url"]).unlink(missing_ok=True)
+            return None
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass  # evicted by another worker since it was read
+        return StoredHtml(entry["url"], html, datetime.fromisoformat(entry["fetchedAtUtc"]))
+
+    def __iter__(self) -> Iterator[StoredHtml]:
+        """Yield the html stored for every url."""
+        for url_path in (self.root / "urls").glob("*.json"):
+            try:
+                entry = json.loads(url_path.read_text())
+            except (OSError, ValueError):
+                continue
+            if (stored := self._load(entry)) is not None:
+                yield stored
+
+    def evict(self, target: float = 0.9) -> int:
+        """Evict least recently used html until the store is under target of max_bytes, return bytes evicted."""
+        objects = sorted(self._stat_objects())
+        self.bytes = sum(size for _, size, _ in objects)
+        evicted = 0
+        for _, size, path in objects:
+            if self.bytes <= self.max_bytes * target:
+                break
+            path.unlink(missing_ok=True)
+            self.bytes -= size
+            evicted += size
+        logger.info(f"evicted {evicted} bytes of html, {self.bytes} bytes stored")
+        return evicted
+
+    async def aput(self, url: str, html: str) -> None:
+        """Store html fetched from url without blocking the event loop."""
+        await asyncio.to_thread(self.put, url, html)
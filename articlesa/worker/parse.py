@@ -2,6 +2,8 @@
 articlesa.worker.parse reads tasks from a redis queue and processes them.
 
 the main functionality is to download an article, parse it, then return it via redis value.
+articles are fetched with a plain GET first, and only loaded in a headless browser when
+that doesn't yield any article text.
 the worker can optionally use a residential proxy to cut down on bad returns.
 the links parsed from the article should go through a HEAD request to make sure they're
 not redirect links.
@@ -9,20 +11,28 @@ not redirect links.
 
 import asyncio
 from datetime import datetime
-from typing import Optional
+import json
+import time
+from typing import Awaitable, Callable, Optional
 from urllib.parse import urlparse
 
 from aiohttp import ClientSession
 from arsenic import Session
-from newspaper import Article
+from redis.asyncio import Redis
 
+from articlesa.config import WorkerConfig
 from articlesa.logger import logger
-from articlesa.types import ParsedArticle, relative_to_absolute_url, HostBlacklist
+from articlesa.metrics import cache_lookups, stage_seconds
+from articlesa.trace import record, span
+from articlesa.types import LINKS_CHANNEL_PREFIX, ParsedArticle, relative_to_absolute_url, HostBlacklist
+from articlesa.worker.browserpool import BrowserPool
+from articlesa.worker.extract import ExtractedArticle, extract_article
+from articlesa.worker.htmlstore import HtmlStore, StoredHtml
+from articlesa.worker.hosts import HostScheduler
 
 
 blacklist = HostBlacklist()
-redirect_semaphore = asyncio.Semaphore(value=25)
-download_semaphore = asyncio.Semaphore(value=1)
+hosts = HostScheduler()
 
 
 global_header = {
@@ -35,102 +45,402 @@ class MissingArticleText(Exception):
     pass
 
 
+class HostUnavailable(Exception):
+    """Raised when a host is throttling requests or failing, so its answer says nothing about the url."""
+    pass
+
+
+class RenderHints:
+    """
+    Per-domain hints on whether articles need a browser to render.
+
+    Hints are learned when a plain GET of a page returns html without article
+    text, but the browser does get text. They are shared between workers
+    through redis and expire after `ttl` seconds, so domains that stop needing
+    a browser are tried plainly again. Each worker remembers at most
+    `max_local` hints itself.
+    """
+    key_prefix = "articlesa:needs_browser:"
+
+    def __init__(self, ttl: int = WorkerConfig.render_hint_ttl, local_ttl: float = 60, max_local: int = 10000) -> None:
+        """Initialize hints, which are remembered locally for local_ttl seconds."""
+        self.ttl = ttl
+        self.local_ttl = local_ttl
+        self.max_local = max_local
+        self._local: dict[str, tuple[float, bool]] = {}
+
+    def _remember(self, netloc: str, needs_browser: bool) -> None:
+        """Remember a hint locally, forgetting expired hints, or else the oldest, if there are too many."""
+        now = time.monotonic()
+        if netloc not in self._local and len(self._local) >= self.max_local:
+            self._local = {known: hint for known, hint in self._local.items() if hint[0] > now}
+            if len(self._local) >= self.max_local:
+                del self._local[next(iter(self._local))]
+        self._local[netloc] = (now + self.local_ttl, needs_browser)
+
+    async def needs_browser(self, redis: Redis, netloc: str) -> bool:
+        """Check if articles from netloc are known to need a browser."""
+        if (local := self._local.get(netloc)) and local[0] > time.monotonic():
+            return local[1]
+        needs_browser = bool(await redis.exists(self.key_prefix + netloc))
+        self._remember(netloc, needs_browser)
+        return needs_browser
+
+    async def learn_needs_browser(self, redis: Redis, netloc: str) -> None:
+        """Remember that articles from netloc need a browser."""
+        logger.info(f"learned that {netloc} needs a browser to render articles")
+        await redis.set(self.key_prefix + netloc, 1, ex=self.ttl)
+        self._remember(netloc, True)
+
+
+render_hints = RenderHints()
+
+
+class RedirectCache:
+    """
+    Redirect resolutions shared between workers through redis.
+
+    Maps a url to the final url it redirects to, or to a negative result when
+    it could not be resolved. Negative results expire sooner. Hits and misses
+    are counted locally, and across workers under `stats_key_prefix`.
+    """
+    key_prefix = "articlesa:redirect:"
+    stats_key_prefix = "articlesa:redirect_stats:"
+
+    def __init__(self,
+                 ttl: int = WorkerConfig.redirect_ttl,
+                 negative_ttl: int = WorkerConfig.redirect_negative_ttl,
+                 ) -> None:
+        """Initialize cache with expiries in seconds for positive and negative entries."""
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.hits = 0
+        self.misses = 0
+
+    async def get_many(self, redis: Redis, urls: list[str]) -> dict[str, Optional[str]]:
+        """Return cached resolutions of urls, None meaning unresolvable; misses are left out."""
+        if not urls:
+            return {}
+        values = await redis.mget([self.key_prefix + url for url in urls])
+        cached = {
+            url: (value.decode() or None)
+            for url, value in zip(urls, values, strict=True)
+            if value is not None
+        }
+        hits, misses = len(cached), len(urls) - len(cached)
+        self.hits += hits
+        self.misses += misses
+        cache_lookups.labels("redirect", "hit").inc(hits)
+        cache_lookups.labels("redirect", "miss").inc(misses)
+        async with redis.pipeline(transaction=False) as pipe:
+            pipe.incrby(self.stats_key_prefix + "hits", hits)
+            pipe.incrby(self.stats_key_prefix + "misses", misses)
+            await pipe.execute()
+        return cached
+
+    async def set_many(self, redis: Redis, resolved: dict[str, Optional[str]]) -> None:
+        """Cache resolutions of urls, None meaning unresolvable."""
+        if not resolved:
+            return
+        async with redis.pipeline(transaction=False) as pipe:
+            for url, final_url in resolved.items():
+                if final_url is None:
+                    pipe.set(self.key_prefix + url, "", ex=self.negative_ttl)
+                else:
+                    pipe.set(self.key_prefix + url, final_url, ex=self.ttl)
+            await pipe.execute()
+
+    @classmethod
+    async def global_stats(cls, redis: Redis) -> tuple[int, int]:
+        """Return hits and misses counted across all workers."""
+        hits, misses = await redis.mget([cls.stats_key_prefix + "hits", cls.stats_key_prefix + "misses"])
+        return int(hits or 0), int(misses or 0)
+
+    @property
+    def hit_ratio(self) -> float:
+        """Return the fraction of lookups served from the cache by this worker."""
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+redirect_cache = RedirectCache()
+
+
 async def check_redirect(session: ClientSession, url: str) -> Optional[str]:
-    """Given a url, check if it redirects and return the final url."""
-    async with redirect_semaphore:
-        logger.debug(f"checking redirect for url {url}")
-        async with session.head(
-            url, headers=global_header, allow_redirects=True
-        ) as response:
-            if response.status == 405:
-                return url  # HEAD not allowed, assume no redirect
+    """
+    Given a url, check if it redirects and return the final url, None if it's a client error.
+
+    Raises HostUnavailable if the host answers with a server error, or is
+    still throttling requests after retrying, since that may pass.
+    """
+    for _ in range(WorkerConfig.host_max_retries + 1):
+        async with hosts.slot(url):
+            logger.debug(f"checking redirect for url {url}")
+            started = time.monotonic()
+            async with session.head(
+                url, headers=global_header, allow_redirects=True
+            ) as response:
+                stage_seconds.labels("head").observe(time.monotonic() - started)
+                throttled = hosts.report(url, response.status, response.headers.get("Retry-After"))
+                if throttled:
+                    continue  # wait out the backoff for another slot
+                if response.status == 405:
+                    return url  # HEAD not allowed, assume no redirect
+                if response.status >= 500:
+                    raise HostUnavailable(f"{url} answered {response.status}")
+                if response.status >= 400:
+                    return None
+                return str(response.url)
+    raise HostUnavailable(f"{url} is still throttled after {WorkerConfig.host_max_retries} retries")
+
+
+class LinkPublisher:
+    """
+    Publishes the links of an article while they're resolved.
+
+    Gateways subscribe to the channel of the job, so they can start on an
+    article's children before the slowest of its links has been resolved.
+    Blacklisted links and links already published are skipped. Publishing is
+    best effort, the job result still holds every link.
+    """
+    def __init__(self, redis: Redis, job_id: str, url: str) -> None:
+        """Initialize publisher for the links of url, parsed by job_id."""
+        self.redis = redis
+        self.channel = LINKS_CHANNEL_PREFIX + job_id
+        self.url = url
+        self.published: set[str] = set()
+
+    async def publish(self, links: list[Optional[str]]) -> None:
+        """Publish links that haven't been published yet."""
+        new_links = [link for link in blacklist.filter(links) if link not in self.published]
+        if not new_links:
+            return
+        self.published.update(new_links)
+        try:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for link in new_links:
+                    pipe.publish(self.channel, json.dumps({"parent": self.url, "link": link}))
+                await pipe.execute()
+        except Exception as e:
+            logger.warning(f"publishing links of {self.url} failed with {e.__class__.__name__}")
+
+
+async def resolve_redirects(ctx: dict,
+                            urls: list[str],
+                            offline: bool = False,
+                            on_resolved: Optional[Callable[[list[Optional[str]]], Awaitable[None]]] = None,
+                            ) -> list[Optional[str]]:
+    """
+    Resolve the final url of each url, None where it can't be resolved.
+
+    Resolutions are looked up in, and added to, the shared redirect cache, so
+    only urls no worker has resolved recently get a HEAD request. Urls whose
+    HEAD request raises, e.g. because the host is throttling or erroring, are
+    not cached, since the error may be transient.
+    When offline, no requests are made and urls missing from the cache are
+    assumed not to redirect.
+    If on_resolved is passed, it's called with final urls as soon as they're
+    known: once with every cached one, then with each newly resolved one.
+    """
+    resolved = await redirect_cache.get_many(ctx["redis"], urls)
+    if offline:
+        return [resolved.get(url, url) for url in urls]
+    if on_resolved is not None and resolved:
+        await on_resolved(list(resolved.values()))
+    session: ClientSession = ctx["aiohttpsession"]
+    misses = [url for url in dict.fromkeys(urls) if url not in resolved]
+
+    async def _check_redirect(url: str) -> Optional[str]:
+        final_url = await check_redirect(session, url)
+        if on_resolved is not None:
+            await on_resolved([final_url])
+        return final_url
+
+    results = await asyncio.gather(
+        *[_check_redirect(url) for url in misses], return_exceptions=True
+    )
+    newly_resolved = {}
+    for url, result in zip(misses, results, strict=True):
+        if isinstance(result, BaseException):
+            logger.debug(f"checking redirect for url {url} failed with {result.__class__.__name__}")
+            resolved[url] = None
+        else:
+            resolved[url] = newly_resolved[url] = result
+    await redirect_cache.set_many(ctx["redis"], newly_resolved)
+    return [resolved[url] for url in urls]
+
+
+async def fetch_article(session: ClientSession, url: str) -> Optional[str]:
+    """Given a url, GET the article without a browser, return the html or None on failure."""
+    for attempt in range(WorkerConfig.host_max_retries + 1):
+        async with hosts.slot(url):
+            logger.debug(f"fetching article from url {url}")
+            started = time.monotonic()
             try:
-                response.raise_for_status()
-            except Exception:
+                async with session.get(url, headers=global_header) as response:
+                    throttled = hosts.report(url, response.status, response.headers.get("Retry-After"))
+                    if throttled and attempt < WorkerConfig.host_max_retries:
+                        continue  # wait out the backoff for another slot
+                    if response.status >= 400 or "html" not in response.content_type:
+                        return None
+                    html = await response.text()
+                    stage_seconds.labels("fetch").observe(time.monotonic() - started)
+                    return html
+            except Exception as e:
+                logger.debug(f"plain fetch of {url} failed with {e.__class__.__name__}")
                 return None
-            return str(response.url)
+    return None
 
 
 async def download_article(session: Session, url: str) -> str:
     """Given a url, download the article and return the html as a string."""
-    async with download_semaphore:
-        logger.debug(f"downloading article from url {url}")
-        await session.set_window_fullscreen()
-        await session.get(url)
-        # TODO: save screenshot for debugging?
-        # with open('image.png', 'wb') as of:
-        #     of.write((await session.get_screenshot()).getbuffer())
-        return await session.get_page_source()
-
-
-async def parse_article(ctx: dict, url: str) -> dict:
-    """Given a url, parse the article and return a dict like ParsedArticle."""
-    arsenicsession: Session = ctx["arsenicsession"]
+    logger.debug(f"downloading article from url {url}")
+    await session.set_window_fullscreen()
+    await session.get(url)
+    # TODO: save screenshot for debugging?
+    # with open('image.png', 'wb') as of:
+    #     of.write((await session.get_screenshot()).getbuffer())
+    return await session.get_page_source()
+
+
+async def get_article(ctx: dict, url: str) -> ExtractedArticle:
+    """
+    Given a url, fetch and parse the article, using a browser only when needed.
+
+    A plain GET is tried first, unless the domain is known to need a browser.
+    If that fails or yields no article text, the page is loaded in a browser
+    instead. The domain is hinted as needing one only if the GET did return
+    html, just without text, and the browser gets text; a GET failing, e.g.
+    timing out or being throttled, says nothing about how pages render.
+    """
+    browserpool: BrowserPool = ctx["browserpool"]
+    parsepool = ctx.get("parsepool")
     aiohttpsession: ClientSession = ctx["aiohttpsession"]
-
-    # Check for redirects
-    final_url = await check_redirect(aiohttpsession, url)
-    if str(final_url) != url:
-        logger.info(f"redirected from {url} to {final_url}")
-    final_url = final_url or url
-
-    # Download the article
-    article_html = await download_article(arsenicsession, final_url)
-
-    # Parse the article using forked newspaper3k with .links property
-    article = Article(str(final_url))
-    article.download_state = 2  # set to success
-    article.set_html(article_html)
-    article.parse()
-
-    if not article.text:
+    netloc = urlparse(url).netloc
+
+    plain_text_missing = False
+    if not await render_hints.needs_browser(ctx["redis"], netloc):
+        with span("fetch"):
+            article_html = await fetch_article(aiohttpsession, url)
+        if article_html:
+            article = await extract_article(parsepool, url, article_html)
+            if article["text"]:
+                await keep_html(ctx, url, article_html)
+                return article
+            plain_text_missing = True
+
+    # Download the article, hung page loads get their browser restarted; the host
+    # slot is taken once a browser is free, so waiting on one doesn't block the host
+    async with browserpool.lease() as session, hosts.slot(url):
+        with stage_seconds.labels("browser_download").time(), span("browser_download"):
+            article_html = await asyncio.wait_for(
+                download_article(session, url), WorkerConfig.page_timeout
+            )
+    article = await extract_article(parsepool, url, article_html)
+    if article["text"]:
+        await keep_html(ctx, url, article_html)
+        if plain_text_missing:
+            await render_hints.learn_needs_browser(ctx["redis"], netloc)
+    return article
+
+
+async def keep_html(ctx: dict, url: str, html: str) -> None:
+    """Keep the html fetched from url in the html store, if the worker has one."""
+    htmlstore: Optional[HtmlStore] = ctx.get("htmlstore")
+    if htmlstore is None:
+        return
+    try:
+        await htmlstore.aput(url, html)
+    except OSError as e:
+        logger.warning(f"keeping html of {url} failed with {e}")
+
+
+async def parse_article(ctx: dict, url: str, trace: Optional[dict] = None) -> dict:
+    """
+    Given a url, parse the article and return a dict like ParsedArticle.
+
+    trace is the articlesa.trace carrier of whoever queued the job, the job
+    is traced under it, and as a new trace without one.
+    """
+    with span("parse_article", parent=trace, new_trace=True, url=url, job_id=ctx.get("job_id")):
+        if "enqueue_time" in ctx:
+            record("queue_wait", ctx["enqueue_time"].timestamp(), time.time())
+
+        # Check for redirects
+        with span("resolve_redirect"):
+            final_url, = await resolve_redirects(ctx, [url])
+        if str(final_url) != url:
+            logger.info(f"redirected from {url} to {final_url}")
+        final_url = final_url or url
+
+        # Download and parse the article
+        article = await get_article(ctx, str(final_url))
+
+        parsed_article = await build_parsed_article(ctx, str(final_url), article, datetime.utcnow())
+        return parsed_article.model_dump()
+
+
+async def reparse_article(ctx: dict, stored: StoredHtml) -> ParsedArticle:
+    """
+    Parse an article again from its stored html, without fetching anything.
+
+    Links are resolved from the redirect cache only, and the article keeps the
+    time its html was fetched as its parse time.
+    """
+    article = await extract_article(ctx.get("parsepool"), stored.url, stored.html)
+    return await build_parsed_article(ctx, stored.url, article, stored.fetched_at, offline=True)
+
+
+async def build_parsed_article(ctx: dict,
+                               final_url: str,
+                               article: ExtractedArticle,
+                               parsed_at: datetime,
+                               offline: bool = False,
+                               ) -> ParsedArticle:
+    """Clean up the links of an extracted article and build a ParsedArticle from it."""
+    if not article["text"]:
         raise MissingArticleText(f"unable to parse text from url {final_url}, other parsing likely failed too")
 
-    logger.debug(f"{article.text=}")
-    logger.debug(f"{article.links=}")
+    logger.debug(f"{article['links']=}")
 
     # make relative links absolute
-    for i, link in enumerate(article.links):
-        if link.startswith("/"):
-            article.links[i] = relative_to_absolute_url(link, str(final_url))
-
-    # remove links that don't have a netloc
-    article.links = [link for link in article.links if urlparse(link).netloc]
-
-    # filter links by blacklist
-    article.links = [
-        link for link in article.links if urlparse(link).netloc not in blacklist
+    links = [
+        relative_to_absolute_url(link, final_url) if link.startswith("/") else link
+        for link in article["links"]
     ]
 
-    # redirect links if needed
-    article.links = await asyncio.gather(
-        *[check_redirect(aiohttpsession, link) for link in article.links]
-    )
+    # filter links by blacklist, also remove links that don't have a netloc
+    links = blacklist.filter(links)
+
+    # redirect links if needed, publishing them as they're resolved
+    publisher = None
+    if not offline and "job_id" in ctx:
+        publisher = LinkPublisher(ctx["redis"], ctx["job_id"], final_url)
+    with span("resolve_links", links=len(links)):
+        resolved_links = await resolve_redirects(
+            ctx, links, offline=offline, on_resolved=publisher.publish if publisher else None
+        )
 
     # filter links by blacklist again after redirects, also remove None
-    article.links = [
-        link
-        for link in article.links
-        if link and (urlparse(link).netloc not in blacklist)
-    ]
+    links = blacklist.filter(resolved_links)
 
     # deduplicate links
-    article.links = list(set(article.links))
+    links = list(set(links))
 
     # MAYBE: filter author list by if NER thinks it's a person
 
     # Create a ParsedArticle object
     parsed_article = ParsedArticle(
-        url=str(final_url),
-        title=article.title,
-        text=article.text,
-        authors=article.authors,
-        links=article.links,
-        published=article.publish_date,
-        parsedAtUtc=datetime.utcnow(),
+        url=final_url,
+        title=article["title"],
+        text=article["text"],
+        authors=article["authors"],
+        links=links,
+        published=article["publish_date"],
+        parsedAtUtc=parsed_at,
     )
 
-    return parsed_article.model_dump()
+    return parsed_article
 
 
 if __name__ == "__main__":
@@ -0,0 +1,118 @@
+""" Test leasing and restarting pooled browser sessions. """
+import asyncio
+from itertools import count
+from typing import cast
+
+from arsenic.browsers import Browser
+from arsenic.errors import ArsenicError
+from arsenic.services import Service
+import pytest
+
+from articlesa.worker import browserpool
+from articlesa.worker.browserpool import BrowserPool
+
+
+class FakeSession:
+    """Stands in for an arsenic session, answering health checks unless it's hung."""
+    def __init__(self, number: int) -> None:
+        """Initialize the session started as number."""
+        self.number = number
+        self.hung = False
+        self.stopped = False
+
+    async def get_url(self) -> str:
+        """Return the current url, or never if hung."""
+        if self.hung:
+            await asyncio.sleep(10)
+        return "about:blank"
+
+
+class FakeBrowsers:
+    """Starts and stops fake sessions in place of arsenic, failing to start when told to."""
+    def __init__(self) -> None:
+        """Initialize with no sessions started."""
+        self.numbers = count()
+        self.fail_start = False
+
+    async def start_session(self, service: Service, browser: Browser) -> FakeSession:
+        """Start a new session."""
+        if self.fail_start:
+            raise ArsenicError("chromedriver is not running")
+        return FakeSession(next(self.numbers))
+
+    async def stop_session(self, session: FakeSession) -> None:
+        """Stop a session."""
+        session.stopped = True
+
+
+@pytest.fixture
+def browsers(monkeypatch: pytest.MonkeyPatch) -> FakeBrowsers:
+    """Replace arsenic's session management with FakeBrowsers."""
+    fake = FakeBrowsers()
+    monkeypatch.setattr(browserpool, "start_session", fake.start_session)
+    monkeypatch.setattr(browserpool, "stop_session", fake.stop_session)
+    return fake
+
+
+async def start_pool(max_pages: int = 10) -> BrowserPool:
+    """Return a started pool of one session."""
+    pool = BrowserPool(cast(Service, None), cast(Browser, None), size=1, max_pages=max_pages, health_timeout=0.05)
+    await pool.start()
+    return pool
+
+
+async def lease_number(pool: BrowserPool) -> int:
+    """Lease a session for a page load that succeeds, returning its number."""
+    async with pool.lease() as session:
+        return cast(FakeSession, session).number
+
+
+@pytest.mark.asyncio
+async def test_session_is_restarted_after_max_pages(browsers: FakeBrowsers) -> None:
+    """Test a session is reused for max_pages page loads, then restarted."""
+    pool = await start_pool(max_pages=2)
+    assert [await lease_number(pool) for _ in range(5)] == [0, 0, 1, 1, 2]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("error", [ArsenicError("crashed"), asyncio.TimeoutError()])
+async def test_session_is_restarted_after_browser_error(browsers: FakeBrowsers, error: Exception) -> None:
+    """Test a page load raising a browser error restarts the session."""
+    pool = await start_pool()
+    with pytest.raises(type(error)):
+        async with pool.lease() as session:
+            raise error
+    assert cast(FakeSession, session).stopped
+    assert await lease_number(pool) == 1
+
+
+@pytest.mark.asyncio
+async def test_session_is_kept_after_other_errors(browsers: FakeBrowsers) -> None:
+    """Test a page load raising something else, or being cancelled, keeps the session."""
+    pool = await start_pool()
+    with pytest.raises(ValueError):
+        async with pool.lease():
+            raise ValueError("unparseable page")
+    with pytest.raises(asyncio.CancelledError):
+        async with pool.lease():
+            raise asyncio.CancelledError()
+    assert await lease_number(pool) == 0
+
+
+@pytest.mark.asyncio
+async def test_unhealthy_session_is_restarted(browsers: FakeBrowsers) -> None:
+    """Test a session that doesn't answer its health check is replaced before being leased."""
+    pool = await start_pool()
+    async with pool.lease() as session:
+        cast(FakeSession, session).hung = True
+    assert await lease_number(pool) == 1
+    assert cast(FakeSession, session).stopped
+
+
+@pytest.mark.asyncio
+async def test_session_failing_to_start_is_started_on_lease(browsers: FakeBrowsers) -> None:
+    """Test a session that failed to start with the pool is started on its first lease."""
+    browsers.fail_start = True
+    pool = await start_pool()
+    browsers.fail_start = False
+    assert await lease_number(pool) == 0
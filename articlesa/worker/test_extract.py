@@ -0,0 +1,21 @@
+""" Test parsing html in a process pool. """
+import os
+
+import pytest
+
+from articlesa.worker.extract import ParsePool, extract_article, parse_html, warm_up_html
+
+
+@pytest.mark.asyncio
+async def test_broken_pool_is_replaced() -> None:
+    """Test a parse on a pool whose process died replaces the pool and succeeds."""
+    pool = ParsePool(processes=1)
+    await pool.start()
+    broken = pool.executor
+    try:
+        broken.submit(os._exit, 1)  # the process dies, breaking the pool
+        article = await extract_article(pool, "http://localhost/", warm_up_html)
+        assert article == parse_html("http://localhost/", warm_up_html)
+        assert pool.executor is not broken
+    finally:
+        pool.shutdown()
@@ -0,0 +1,84 @@
+""" Test scheduling requests politely per host. """
+import asyncio
+from itertools import pairwise
+import time
+
+import pytest
+
+from articlesa.worker.hosts import HostScheduler
+
+
+async def hold_slot(hosts: HostScheduler, url: str, seconds: float, started: list[float]) -> None:
+    """Hold a slot for url for a while, recording when it was taken."""
+    async with hosts.slot(url):
+        started.append(time.monotonic())
+        await asyncio.sleep(seconds)
+
+
+@pytest.mark.asyncio
+async def test_concurrency_is_limited_per_host() -> None:
+    """Test no more than concurrency requests run against a host, while other hosts aren't held up."""
+    hosts = HostScheduler(concurrency=2, min_interval=0)
+    started: list[float] = []
+    began = time.monotonic()
+    await asyncio.gather(
+        *[hold_slot(hosts, f"https://a.com/{i}", 0.05, started) for i in range(3)],
+        hold_slot(hosts, "https://b.com/", 0.05, started),
+    )
+    delays = sorted(start - began for start in started)
+    assert delays[2] < 0.04 <= delays[3]
+
+
+@pytest.mark.asyncio
+async def test_starts_are_spaced_by_min_interval() -> None:
+    """Test requests to a host start at least min_interval apart."""
+    hosts = HostScheduler(concurrency=10, min_interval=0.05)
+    started: list[float] = []
+    await asyncio.gather(*[hold_slot(hosts, f"https://a.com/{i}", 0, started) for i in range(3)])
+    gaps = [b - a for a, b in pairwise(started)]
+    assert all(gap >= 0.045 for gap in gaps)
+
+
+def test_backoff_doubles_up_to_max_and_resets() -> None:
+    """Test throttled responses back a host off exponentially, and any other response resets it."""
+    hosts = HostScheduler(max_backoff=4)
+    backoffs = []
+    for _ in range(5):
+        assert hosts.report("https://a.com/", 429)
+        backoffs.append(hosts._hosts["a.com"].backoff)
+    assert backoffs == [1, 2, 4, 4, 4]
+    assert not hosts.report("https://a.com/", 200)
+    assert hosts._hosts["a.com"].backoff == 0
+    assert hosts.report("https://a.com/", 503)
+    assert hosts._hosts["a.com"].backoff == 1
+
+
+def test_backoff_follows_retry_after() -> None:
+    """Test a numeric Retry-After sets the backoff, capped at max_backoff, and other forms are doubled."""
+    hosts = HostScheduler(max_backoff=60)
+    hosts.report("https://a.com/", 429, retry_after="30")
+    assert hosts._hosts["a.com"].backoff == 30
+    hosts.report("https://a.com/", 429, retry_after="3600")
+    assert hosts._hosts["a.com"].backoff == 60
+    hosts.report("https://b.com/", 429, retry_after="Wed, 21 Oct 2015 07:28:00 GMT")
+    assert hosts._hosts["b.com"].backoff == 1
+
+
+@pytest.mark.asyncio
+async def test_backed_off_host_gets_no_slot_until_backoff_passes() -> None:
+    """Test a slot for a throttled host is only handed out once its backoff has passed."""
+    hosts = HostScheduler(min_interval=0, max_backoff=0.05)
+    hosts.report("https://a.com/", 429)
+    started: list[float] = []
+    began = time.monotonic()
+    await hold_slot(hosts, "https://a.com/", 0, started)
+    assert started[0] - began >= 0.045
+
+
+def test_idle_hosts_are_forgotten_past_max_hosts() -> None:
+    """Test idle hosts are dropped once max_hosts are known, while backed off hosts are kept."""
+    hosts = HostScheduler(max_hosts=2, max_backoff=60)
+    hosts.report("https://a.com/", 429)
+    hosts.report("https://b.com/", 200)
+    hosts.report("https://c.com/", 200)
+    assert set(hosts._hosts) == {"a.com", "c.com"}
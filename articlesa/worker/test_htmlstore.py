@@ -0,0 +1,113 @@
+""" Test storing fetched html on disk. """
+from datetime import datetime
+import os
+from pathlib import Path
+
+import pytest
+
+from articlesa.worker import htmlstore
+from articlesa.worker.htmlstore import HtmlStore
+
+
+@pytest.fixture(params=["zstd", "gzip"])
+def compression(request: pytest.FixtureRequest, monkeypatch: pytest.MonkeyPatch) -> str:
+    """Compress with zstd, if it's installed, then with gzip."""
+    if request.param == "gzip":
+        monkeypatch.setattr(htmlstore, "zstd", None)
+    elif htmlstore.zstd is None:
+        pytest.skip("zstd is not installed")
+    return request.param
+
+
+def make_html(i: int) -> str:
+    """Return article html numbered i, which doesn't compress away."""
+    return f"<html><body><p>{i}</p>{os.urandom(2000).hex()}</body></html>"
+
+
+def age(store: HtmlStore, url: str, mtime: float) -> None:
+    """Set when the html stored for url was last used."""
+    stored = store._url_path(url).read_text()
+    content = stored.split('"content": "')[1].split('"')[0]
+    path = store._object_path(content, "")
+    os.utime(path, (mtime, mtime))
+
+
+def test_put_get(tmp_path: Path, compression: str) -> None:
+    """Test html is returned as stored, compressed by the available method."""
+    store = HtmlStore(tmp_path, max_bytes=10**6)
+    fetched_at = datetime(2024, 1, 1, 12, 0)
+    html = make_html(0)
+    store.put("https://example.com/a", html, fetched_at)
+    stored = store.get("https://example.com/a")
+    assert stored is not None
+    assert (stored.url, stored.html, stored.fetched_at) == ("https://example.com/a", html, fetched_at)
+    assert [path.suffix for path in store._objects()] == [".zst" if compression == "zstd" else ".gz"]
+    assert store.get("https://example.com/b") is None
+
+
+def test_same_html_is_stored_once(tmp_path: Path, compression: str) -> None:
+    """Test urls with the same html share one object, and storing a url again replaces its entry."""
+    store = HtmlStore(tmp_path, max_bytes=10**6)
+    html = make_html(0)
+    store.put("https://example.com/a", html)
+    size = store.bytes
+    store.put("https://example.com/b", html)
+    assert (len(list(store._objects())), store.bytes) == (1, size)
+    new_html = make_html(1)
+    store.put("https://example.com/a", new_html)
+    assert {stored.url for stored in store} == {"https://example.com/a", "https://example.com/b"}
+    stored = store.get("https://example.com/a")
+    assert stored is not None and stored.html == new_html
+    assert len(list(store._objects())) == 2
+    assert HtmlStore(tmp_path, max_bytes=10**6).bytes == store.bytes
+
+
+def test_least_recently_used_html_is_evicted(tmp_path: Path, compression: str) -> None:
+    """Test html is evicted least recently used first past max_bytes, and entries pointing at it dropped."""
+    store = HtmlStore(tmp_path, max_bytes=10**6)
+    for i in range(3):
+        store.put(f"https://example.com/{i}", make_html(i))
+        age(store, f"https://example.com/{i}", mtime=1000 + i)
+    # reading html counts as using it
+    assert store.get("https://example.com/0") is not None
+    store.max_bytes = int(store.bytes / 0.9) - 1
+    evicted = store.evict()
+    assert evicted > 0
+    assert store.get("https://example.com/1") is None
+    assert not store._url_path("https://example.com/1").exists()
+    assert store.get("https://example.com/0") is not None
+    assert store.get("https://example.com/2") is not None
+    assert store.bytes == sum(path.stat().st_size for path in store._objects())
+
+
+def test_put_rewrites_html_evicted_meanwhile(tmp_path: Path, compression: str) -> None:
+    """Test storing html whose object another worker evicted writes it again."""
+    store = HtmlStore(tmp_path, max_bytes=10**6)
+    html = make_html(0)
+    store.put("https://example.com/a", html)
+    for path in store._objects():
+        path.unlink()
+    store.put("https://example.com/a", html)
+    stored = store.get("https://example.com/a")
+    assert stored is not None and stored.html == html
+
+
+def test_gzip_html_is_read_once_zstd_is_installed(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test html stored with gzip, before zstd was installed, is still read."""
+    if (zstd := htmlstore.zstd) is None:
+        pytest.skip("zstd is not installed")
+    monkeypatch.setattr(htmlstore, "zstd", None)
+    html = make_html(0)
+    HtmlStore(tmp_path, max_bytes=10**6).put("https://example.com/a", html)
+    monkeypatch.setattr(htmlstore, "zstd", zstd)
+    stored = HtmlStore(tmp_path, max_bytes=10**6).get("https://example.com/a")
+    assert stored is not None and stored.html == html
+
+
+def test_zstd_html_without_zstd_raises(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test reading zstd html without zstd installed raises, rather than being taken for gzip."""
+    monkeypatch.setattr(htmlstore, "zstd", None)
+    path = tmp_path / "html.zst"
+    path.write_bytes(b"\x28\xb5\x2f\xfd")
+    with pytest.raises(RuntimeError):
+        HtmlStore._decompress(path)
@@ -0,0 +1,105 @@
+""" Test sharing redirect resolutions between workers through redis. """
+from typing import Optional, cast
+
+from redis.asyncio import Redis
+import pytest
+
+from articlesa.worker import parse
+from articlesa.worker.parse import RedirectCache, resolve_redirects
+
+
+class FakeRedis:
+    """Stands in for redis, expiring keys on a clock moved by hand."""
+    def __init__(self) -> None:
+        """Initialize an empty redis at time 0."""
+        self.now = 0.0
+        self.values: dict[str, tuple[bytes, Optional[float]]] = {}
+
+    def _get(self, key: str) -> Optional[bytes]:
+        """Return the value of key, unless it's missing or expired."""
+        value, expires = self.values.get(key, (None, None))
+        return value if expires is None or expires > self.now else None
+
+    async def mget(self, keys: list[str]) -> list[Optional[bytes]]:
+        """Return the value of each key."""
+        return [self._get(key) for key in keys]
+
+    def pipeline(self, transaction: bool = True) -> "FakePipeline":
+        """Return a pipeline on this redis."""
+        return FakePipeline(self)
+
+
+class FakePipeline:
+    """Stands in for a redis pipeline, running each command on FakeRedis as it's queued."""
+    def __init__(self, redis: FakeRedis) -> None:
+        """Initialize a pipeline on redis."""
+        self.redis = redis
+
+    async def __aenter__(self) -> "FakePipeline":
+        """Enter the pipeline."""
+        return self
+
+    async def __aexit__(self, *exc_info: object) -> None:
+        """Exit the pipeline."""
+
+    def set(self, key: str, value: str, ex: Optional[int] = None) -> None:
+        """Set key, expiring after ex seconds."""
+        self.redis.values[key] = (value.encode(), None if ex is None else self.redis.now + ex)
+
+    def incrby(self, key: str, amount: int) -> None:
+        """Increment key by amount."""
+        value = int(self.redis._get(key) or 0) + amount
+        self.redis.values[key] = (str(value).encode(), None)
+
+    async def execute(self) -> list:
+        """Execute nothing more."""
+        return []
+
+
+@pytest.mark.asyncio
+async def test_hits_misses_and_negative_results() -> None:
+    """Test cached resolutions are returned, unresolvable urls as None, and lookups are counted."""
+    redis = FakeRedis()
+    cache = RedirectCache(ttl=60, negative_ttl=10)
+    await cache.set_many(cast(Redis, redis), {"https://a.com/": "https://www.a.com/", "https://b.com/": None})
+    cached = await cache.get_many(cast(Redis, redis), ["https://a.com/", "https://b.com/", "https://c.com/"])
+    assert cached == {"https://a.com/": "https://www.a.com/", "https://b.com/": None}
+    assert (cache.hits, cache.misses) == (2, 1)
+    assert cache.hit_ratio == pytest.approx(2 / 3)
+    assert await RedirectCache.global_stats(cast(Redis, redis)) == (2, 1)
+
+
+@pytest.mark.asyncio
+async def test_negative_results_expire_sooner() -> None:
+    """Test unresolvable urls are looked up again after negative_ttl, resolutions after ttl."""
+    redis = FakeRedis()
+    cache = RedirectCache(ttl=60, negative_ttl=10)
+    await cache.set_many(cast(Redis, redis), {"https://a.com/": "https://www.a.com/", "https://b.com/": None})
+    redis.now = 30
+    assert await cache.get_many(cast(Redis, redis), ["https://a.com/", "https://b.com/"]) == {
+        "https://a.com/": "https://www.a.com/",
+    }
+    redis.now = 90
+    assert await cache.get_many(cast(Redis, redis), ["https://a.com/", "https://b.com/"]) == {}
+
+
+@pytest.mark.asyncio
+async def test_resolve_redirects_caches_only_answered_urls(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test urls are checked once across calls, except those whose check raised, which may pass."""
+    redis = FakeRedis()
+    checked: list[str] = []
+
+    async def check_redirect(session: object, url: str) -> Optional[str]:
+        checked.append(url)
+        if "down" in url:
+            raise parse.HostUnavailable(f"{url} answered 503")
+        return None if "gone" in url else url + "final"
+
+    monkeypatch.setattr(parse, "check_redirect", check_redirect)
+    monkeypatch.setattr(parse, "redirect_cache", RedirectCache(ttl=60, negative_ttl=10))
+    ctx = {"redis": redis, "aiohttpsession": None}
+    urls = ["https://a.com/", "https://gone.com/", "https://down.com/", "https://a.com/"]
+    expected = ["https://a.com/final", None, None, "https://a.com/final"]
+    assert await resolve_redirects(ctx, urls) == expected
+    assert await resolve_redirects(ctx, urls) == expected
+    assert checked == ["https://a.com/", "https://gone.com/", "https://down.com/", "https://down.com/"]